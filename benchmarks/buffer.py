@@ -0,0 +1,65 @@
+import threading
+import timeit
+try:
+    from ptc.buffer import DataBuffer
+except:
+    import sys
+    sys.path.append('../')
+    from ptc.buffer import DataBuffer
+
+# Amount of data, in bytes, streamed through the buffer.
+SIZES = [64 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+# Data is read back in Ethernet-sized segments.
+SEGMENT_SIZE = 1460
+
+
+class StringBuffer(object):
+    # The str-backed buffer that DataBuffer replaced (chunks left out).
+    
+    def __init__(self):
+        self.buffer = str()
+        self.condition = threading.Condition(threading.RLock())
+        
+    def put(self, data):
+        with self.condition:
+            self.buffer += data
+            self.condition.notifyAll()
+        
+    def get(self, size):
+        with self.condition:
+            data = self.buffer[:size]
+            self.buffer = self.buffer[size:]
+            return data
+    
+    def empty(self):
+        with self.condition:
+            return len(self.buffer) == 0
+
+
+def stream(buffer_class, data, **kwargs):
+    # Put data in the buffer as a single write and then read it back in
+    # segments, as the packet sender does.
+    data_buffer = buffer_class()
+    data_buffer.put(data)
+    while not data_buffer.empty():
+        data_buffer.get(SEGMENT_SIZE, **kwargs)
+
+
+def seconds(function):
+    return min(timeit.repeat(function, number=1, repeat=3))
+
+
+def run():
+    print '%10s %14s %14s %14s' % ('bytes', 'str (ms)', 'deque (ms)',
+                                   'no copy (ms)')
+    for size in SIZES:
+        data = 'x' * size
+        old = seconds(lambda: stream(StringBuffer, data))
+        new = seconds(lambda: stream(DataBuffer, data))
+        no_copy = seconds(lambda: stream(DataBuffer, data, copy=False))
+        print '%10d %14.2f %14.2f %14.2f' % (size, 1e3 * old, 1e3 * new,
+                                             1e3 * no_copy)
+
+
+if __name__ == '__main__':
+    run()
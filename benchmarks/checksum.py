@@ -0,0 +1,55 @@
+import os
+import timeit
+try:
+    from ptc.checksum import IPChecksumAlgorithm
+except:
+    import sys
+    sys.path.append('../')
+    from ptc.checksum import IPChecksumAlgorithm
+
+ITERATIONS = 20000
+
+# Sizes in bytes: a bare IP header, IP plus PTC headers, an Ethernet-sized
+# datagram and the largest possible IP datagram.
+SIZES = [20, 36, 1500, 65535]
+
+
+def naive_checksum(message):
+    # The word-by-word implementation that IPChecksumAlgorithm replaced.
+    value = 0
+    if len(message) % 2 == 1:
+        message += '\0'
+    for i in range(0, len(message), 2):
+        value += (ord(message[i]) << 8) + ord(message[i+1])
+    while value >> 16:
+        value = (value & 0xffff) + (value >> 16)
+    return ~value & 0xffff
+
+
+def time_per_call(function, iterations):
+    seconds = timeit.timeit(function, number=iterations)
+    return 1e6 * seconds / iterations
+
+
+def run():
+    print '%8s %14s %14s' % ('bytes', 'naive (us)', 'bulk (us)')
+    for size in SIZES:
+        message = os.urandom(size)
+        iterations = max(10, ITERATIONS * 20 / size)
+        naive = time_per_call(lambda: naive_checksum(message), iterations)
+        bulk = time_per_call(
+                    lambda: IPChecksumAlgorithm.for_bytes(message).value(),
+                    iterations)
+        print '%8d %14.3f %14.3f' % (size, naive, bulk)
+
+    header = os.urandom(20)
+    checksum = IPChecksumAlgorithm.for_bytes(header).value()
+    incremental = time_per_call(
+                    lambda: IPChecksumAlgorithm.update_word(checksum, 0x24,
+                                                            0x5dc),
+                    ITERATIONS)
+    print 'incremental update of one header word: %.3f us' % incremental
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,105 @@
+import collections
+import sys
+import types
+try:
+    from ptc.packet_utils import PacketBuilder
+    from ptc.packet import ACKFlag
+    from ptc.rqueue import RetransmissionQueue
+except:
+    sys.path.append('../')
+    from ptc.packet_utils import PacketBuilder
+    from ptc.packet import ACKFlag
+    from ptc.rqueue import RetransmissionQueue
+
+SEGMENTS = 10000
+PAYLOAD_SIZES = [0, 64, 1024]
+# Bytes per packet, by payload size, when a PTCPacket was made of three
+# objects (the packet itself wrapping an IP and a PTC packet, each with its
+# instance dict and SequenceNumber objects), measured as in
+# bytes_per_packet. Kept for reference, since that code is gone.
+THREE_OBJECT_PACKET_BYTES = {0: 3493.9, 64: 3581.9, 1024: 4565.9}
+
+
+def deep_size(obj, seen):
+    # Sum of sys.getsizeof over every object reachable from obj that was
+    # not seen before. Classes, functions and modules are shared and thus
+    # not accounted.
+    if id(obj) in seen or isinstance(obj, (type, types.ClassType,
+                                           types.FunctionType,
+                                           types.ModuleType)):
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)):
+        for item in obj:
+            size += deep_size(item, seen)
+    if hasattr(obj, '__dict__'):
+        size += deep_size(obj.__dict__, seen)
+    for cls in type(obj).__mro__:
+        for slot in cls.__dict__.get('__slots__', list()):
+            if hasattr(obj, slot):
+                size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def get_packet_builder():
+    packet_builder = PacketBuilder()
+    packet_builder.set_source_address('192.168.0.101')
+    packet_builder.set_source_port(7777)
+    packet_builder.set_destination_address('192.168.0.102')
+    packet_builder.set_destination_port(8888)
+    return packet_builder
+
+
+def build_packets(payload):
+    # Serialized packets, as they are sent. Payload and addresses are shared
+    # by every packet and are not part of the per-segment overhead, so their
+    # ids are returned as well.
+    packet_builder = get_packet_builder()
+    packets = [packet_builder.build(payload=payload, flags=[ACKFlag],
+                                    seq=1000 + i * len(payload), ack=5000,
+                                    window=1024)
+               for i in range(SEGMENTS)]
+    for packet in packets:
+        packet.get_bytes()
+    shared = set(map(id, [payload, packet_builder.source_address,
+                          packet_builder.destination_address]))
+    return packets, shared
+
+
+def bytes_per_packet(payload_size):
+    packets, shared = build_packets('x' * payload_size)
+    baseline = deep_size(list(), set(shared))
+    return float(deep_size(packets, set(shared)) - baseline) / SEGMENTS
+
+
+def bytes_per_segment(payload_size):
+    # Same for a retransmission queue, which should keep none of the packet
+    # fields: only sequence ranges are held.
+    packets, shared = build_packets('x' * payload_size)
+    rqueue = RetransmissionQueue()
+    baseline = deep_size(rqueue, set(shared))
+    for packet in packets:
+        rqueue.put(packet)
+    return float(deep_size(rqueue, set(shared)) - baseline) / SEGMENTS
+
+
+def run():
+    print 'packets held in a list, in bytes per packet:'
+    print '%14s %16s %16s' % ('payload bytes', 'three objects', 'slotted')
+    for payload_size in PAYLOAD_SIZES:
+        print '%14d %16.1f %16.1f' % (payload_size,
+                                      THREE_OBJECT_PACKET_BYTES[payload_size],
+                                      bytes_per_packet(payload_size))
+    print
+    print 'retransmission queue:'
+    print '%14s %22s' % ('payload bytes', 'bytes per segment')
+    for payload_size in PAYLOAD_SIZES:
+        print '%14d %22.1f' % (payload_size, bytes_per_segment(payload_size))
+
+
+if __name__ == '__main__':
+    run()
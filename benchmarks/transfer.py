@@ -0,0 +1,66 @@
+import sys
+import threading
+import time
+try:
+    import ptc
+except:
+    sys.path.append('../')
+    import ptc
+
+# Amount of data, in bytes, sent from one endpoint to the other.
+SIZES = [64 * 1024, 256 * 1024, 1024 * 1024]
+ADDRESS = '127.0.0.1'
+PORT = 6677
+# Window announced by the receiver. The default receive buffer size would
+# bound every transfer to a kilobyte per round trip, whatever the transport.
+RECEIVE_BUFFER_SIZE = ptc.constants.MAX_WND
+
+
+def receive(server, size):
+    received = 0
+    while received < size:
+        received += len(server.recv(size))
+
+
+def transfer(transport, size):
+    # Send size bytes through a new connection and return the seconds
+    # taken until the receiver has got them all.
+    ready = threading.Event()
+    done = threading.Event()
+    
+    def run_server():
+        with ptc.Socket(transport=transport) as server:
+            server.set_receive_buffer_size(RECEIVE_BUFFER_SIZE)
+            server.bind((ADDRESS, PORT))
+            server.listen()
+            ready.set()
+            server.accept()
+            receive(server, size)
+            done.set()
+    
+    thread = threading.Thread(target=run_server)
+    thread.setDaemon(True)
+    thread.start()
+    ready.wait()
+    with ptc.Socket(transport=transport) as client:
+        client.connect((ADDRESS, PORT))
+        start = time.time()
+        client.send('x' * size)
+        done.wait()
+        elapsed = time.time() - start
+    thread.join()
+    return elapsed
+
+
+def run(transport):
+    print 'transport: %s' % transport
+    print '%10s %14s %14s' % ('bytes', 'time (ms)', 'MB/s')
+    for size in SIZES:
+        elapsed = transfer(transport, size)
+        print '%10d %14.2f %14.2f' % (size, 1e3 * elapsed,
+                                      size / elapsed / (1 << 20))
+
+
+if __name__ == '__main__':
+    transport = sys.argv[1] if len(sys.argv) > 1 else ptc.MEMORY_TRANSPORT
+    run(transport)
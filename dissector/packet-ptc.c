@@ -17,6 +17,10 @@
 #define RST_FLAG_MASK 0x04
 #define NDT_FLAG_MASK 0x08
 #define ACK_FLAG_MASK 0x10
+#define ECE_FLAG_MASK 0x20
+#define CWR_FLAG_MASK 0x40
+/* Size of the options, in 32-bit words. */
+#define OPTIONS_SHIFT 12
 
 static int proto_ptc = -1;
 
@@ -34,6 +38,8 @@ static gint hf_ptc_fin_flag = -1;
 static gint hf_ptc_ack_flag = -1;
 static gint hf_ptc_rst_flag = -1;
 static gint hf_ptc_ndt_flag = -1;
+static gint hf_ptc_ece_flag = -1;
+static gint hf_ptc_cwr_flag = -1;
 static gint hf_ptc_seq = -1;
 static gint hf_ptc_ack = -1;
 static gint hf_ptc_window = -1;
@@ -84,6 +90,12 @@ void proto_register_ptc (void)
 		{ &hf_ptc_ndt_flag,
 		{ "NDT", "ptc.flags.ndt", FT_BOOLEAN, 16, NULL, NDT_FLAG_MASK,  NULL, HFILL }},
 
+		{ &hf_ptc_ece_flag,
+		{ "ECE", "ptc.flags.ece", FT_BOOLEAN, 16, NULL, ECE_FLAG_MASK,  NULL, HFILL }},
+
+		{ &hf_ptc_cwr_flag,
+		{ "CWR", "ptc.flags.cwr", FT_BOOLEAN, 16, NULL, CWR_FLAG_MASK,  NULL, HFILL }},
+
 		{ &hf_ptc_window,
 		{ "Window", "ptc.window", FT_UINT16, BASE_DEC, NULL, 0x0, NULL, HFILL }},
 
@@ -107,10 +119,10 @@ static void
 dissect_ptc(tvbuff_t *tvb, packet_info *pinfo, proto_tree *tree)
 {
 
-	gint offset = 0, payload_size;
+	gint offset = 0, payload_size, options_size;
 	guint16 iflags, srcport, dstport, window;
 	guint32 seq, ack;
-	char flags[20] = "";
+	char flags[28] = "";
 
 	if(check_col(pinfo->cinfo, COL_PROTOCOL))
 		col_set_str(pinfo->cinfo, COL_PROTOCOL, PROTO_TAG_PTC);
@@ -123,6 +135,7 @@ dissect_ptc(tvbuff_t *tvb, packet_info *pinfo, proto_tree *tree)
 	ack = tvb_get_ntohl(tvb, 8);
 	window = tvb_get_ntohs(tvb, 14);
 	iflags = tvb_get_ntohs(tvb, 12);
+	options_size = 4 * (iflags >> OPTIONS_SHIFT);
 
 	if( iflags & SYN_FLAG_MASK )
 		strcpy(flags, "SYN");
@@ -154,6 +167,20 @@ dissect_ptc(tvbuff_t *tvb, packet_info *pinfo, proto_tree *tree)
                 else
                         strcpy(flags, "NDT");
     	}
+    	if( iflags & ECE_FLAG_MASK )
+    	{
+                if( strlen(flags) > 0 )
+                        strcat(flags, ",ECE");
+                else
+                        strcpy(flags, "ECE");
+    	}
+    	if( iflags & CWR_FLAG_MASK )
+    	{
+                if( strlen(flags) > 0 )
+                        strcat(flags, ",CWR");
+                else
+                        strcpy(flags, "CWR");
+    	}
 
 
 	if(check_col(pinfo->cinfo, COL_INFO))
@@ -167,7 +194,7 @@ dissect_ptc(tvbuff_t *tvb, packet_info *pinfo, proto_tree *tree)
 		proto_item *ti = NULL;
 		proto_tree *ptc_tree = NULL;
         
-		ti = proto_tree_add_item(tree, proto_ptc, tvb, 0, PTC_HEADER_LEN, ENC_NA);
+		ti = proto_tree_add_item(tree, proto_ptc, tvb, 0, PTC_HEADER_LEN + options_size, ENC_NA);
 		ptc_tree = proto_item_add_subtree(ti, ett_ptc);
         
 		proto_tree_add_item(ptc_tree, hf_ptc_srcport, tvb, offset, 2, ENC_BIG_ENDIAN);
@@ -182,6 +209,8 @@ dissect_ptc(tvbuff_t *tvb, packet_info *pinfo, proto_tree *tree)
 		proto_tree_add_item(ptc_tree, hf_ptc_ack, tvb, offset, 4, ENC_BIG_ENDIAN);
 		offset += 4;
 
+		proto_tree_add_item(ptc_tree, hf_ptc_cwr_flag, tvb, offset, 2, ENC_BIG_ENDIAN);
+		proto_tree_add_item(ptc_tree, hf_ptc_ece_flag, tvb, offset, 2, ENC_BIG_ENDIAN);
 		proto_tree_add_item(ptc_tree, hf_ptc_ack_flag, tvb, offset, 2, ENC_BIG_ENDIAN);
 		proto_tree_add_item(ptc_tree, hf_ptc_ndt_flag, tvb, offset, 2, ENC_BIG_ENDIAN);
 		proto_tree_add_item(ptc_tree, hf_ptc_rst_flag, tvb, offset, 2, ENC_BIG_ENDIAN);
@@ -192,6 +221,9 @@ dissect_ptc(tvbuff_t *tvb, packet_info *pinfo, proto_tree *tree)
 	        proto_tree_add_item(ptc_tree, hf_ptc_window, tvb, offset, 2, ENC_BIG_ENDIAN);
 		offset += 2;
 
+		/* Options are not dissected yet. */
+		offset += options_size;
+
 		payload_size = tvb_length_remaining(tvb, offset);
 		if(payload_size > 0)
 			proto_tree_add_item(ptc_tree, hf_ptc_data, tvb, offset, payload_size, ENC_NA);
@@ -1,4 +1,8 @@
 from ptc_socket import Socket
-from constants import SHUT_RD, SHUT_WR, SHUT_RDWR, WAIT, NO_WAIT, ABORT
+from constants import SHUT_RD, SHUT_WR, SHUT_RDWR, WAIT, NO_WAIT, ABORT,\
+                      RAW_TRANSPORT, UDP_TRANSPORT, MEMORY_TRANSPORT,\
+                      SHM_TRANSPORT, RENO, CUBIC, LEDBAT
 
-__all__ = [Socket, SHUT_RD, SHUT_WR, SHUT_RDWR, WAIT, NO_WAIT, ABORT]
\ No newline at end of file
+__all__ = [Socket, SHUT_RD, SHUT_WR, SHUT_RDWR, WAIT, NO_WAIT, ABORT,
+           RAW_TRANSPORT, UDP_TRANSPORT, MEMORY_TRANSPORT, SHM_TRANSPORT,
+           RENO, CUBIC, LEDBAT]
\ No newline at end of file
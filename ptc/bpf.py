@@ -0,0 +1,115 @@
+import socket
+import struct
+
+
+# Classic BPF programs for the raw socket shared by PTC connections (see
+# PacketDemultiplexer). They run in the kernel on every datagram of the PTC
+# protocol and accept only those addressed to some local endpoint, so that
+# traffic for other processes never reaches Python. Offsets match the ones
+# used by PacketDecoder: the IP header comes first, its length taken from
+# the IHL, followed by the PTC header.
+
+SO_ATTACH_FILTER = 26
+SO_DETACH_FILTER = 27
+
+# Instruction classes, sizes and modes (see linux/filter.h).
+BPF_LD = 0x00
+BPF_LDX = 0x01
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+BPF_ABS = 0x20
+BPF_IND = 0x40
+BPF_MSH = 0xa0
+BPF_JEQ = 0x10
+BPF_K = 0x00
+
+INSTRUCTION = struct.Struct('HBBI')
+
+DESTINATION_ADDRESS_OFFSET = 16
+DESTINATION_PORT_OFFSET = 2
+
+ACCEPT = 0xffffffff
+REJECT = 0
+
+# The kernel refuses longer programs.
+MAX_INSTRUCTIONS = 4096
+MAX_JUMP = 255
+
+
+def load_header_length():
+    # X <- 4 * (IHL)
+    return (BPF_LDX | BPF_B | BPF_MSH, 0, 0, 0)
+
+
+def load_destination_address():
+    return (BPF_LD | BPF_W | BPF_ABS, 0, 0, DESTINATION_ADDRESS_OFFSET)
+
+
+def load_destination_port():
+    return (BPF_LD | BPF_H | BPF_IND, 0, 0, DESTINATION_PORT_OFFSET)
+
+
+def jump_if_equal(value, skip):
+    # Go on to the next instruction if A equals value. Otherwise, skip the
+    # given amount of instructions.
+    return (BPF_JMP | BPF_JEQ | BPF_K, 0, skip, value)
+
+
+def ret(value):
+    return (BPF_RET | BPF_K, 0, 0, value)
+
+
+NULL_ADDRESS = socket.inet_aton('0.0.0.0')
+
+
+def address_to_int(address):
+    return struct.unpack('!I', address)[0]
+
+
+def build_filter(endpoints):
+    # Build the program that accepts datagrams whose destination matches
+    # some of the given (address, port) pairs, with addresses packed as in
+    # the IP header. Endpoints bound to the null address match just by
+    # port. Returns a list of instructions, or None
+    # if the endpoints do not fit in a program.
+    ports = dict()
+    for address, port in endpoints:
+        addresses = ports.setdefault(port, set())
+        if address == NULL_ADDRESS:
+            addresses.add(None)
+        else:
+            addresses.add(address_to_int(address))
+    program = [load_header_length()]
+    for port in sorted(ports):
+        addresses = ports[port]
+        if None in addresses:
+            addresses = list()
+        else:
+            addresses = sorted(addresses)
+        # Port check, then one check per address. Jump offsets take a single
+        # byte.
+        skip = 2 * len(addresses) + 1
+        if skip > MAX_JUMP:
+            return None
+        program.append(load_destination_port())
+        if not addresses:
+            program.append(jump_if_equal(port, 1))
+            program.append(ret(ACCEPT))
+            continue
+        program.append(jump_if_equal(port, skip))
+        program.append(load_destination_address())
+        for address in addresses:
+            program.append(jump_if_equal(address, 1))
+            program.append(ret(ACCEPT))
+    program.append(ret(REJECT))
+    if len(program) > MAX_INSTRUCTIONS:
+        return None
+    return program
+
+
+def pack_filter(program):
+    return ''.join(INSTRUCTION.pack(*instruction)
+                   for instruction in program)
@@ -1,11 +1,25 @@
+import collections
+import sys
 import threading
 
+from reassembly import ReassemblyQueue
+import serialnum
+
 
 class DataBuffer(object):
+    # Data is kept as a deque of immutable chunks, as they were put, plus the
+    # offset of the first unread byte within the leftmost one. Neither put
+    # nor get copy more than the bytes they hand over, and get can return
+    # memoryviews over the chunks without copying at all.
     
-    def __init__(self, start_index=0):
-        self.buffer = str()
-        self.chunks = dict()
+    def __init__(self, start_index=0, reassembly_limit=None):
+        self.buffer = collections.deque()
+        self.offset = 0
+        self.length = 0
+        # Out-of-order chunks are indexed by their offset within the stream.
+        # This is the offset of last_index.
+        self.position = 0
+        self.chunks = ReassemblyQueue(limit=reassembly_limit)
         lock = threading.RLock()
         self.condition = threading.Condition(lock)
         self.start_index = start_index
@@ -13,49 +27,285 @@ class DataBuffer(object):
         
     def flush(self):
         with self.condition:
-            self.buffer = str()
-            self.chunks = dict()
+            self.buffer.clear()
+            self.offset = 0
+            self.length = 0
+            self.position = 0
+            self.chunks.clear()
             self.last_index = self.start_index
         
     def get_last_index(self):
         return self.last_index
     
+    def get_out_of_order_size(self):
+        with self.condition:
+            return self.chunks.get_size()
+    
+    def get_out_of_order_ranges(self):
+        # Sequence intervals of the out-of-order data held, lowest first.
+        with self.condition:
+            ranges = list()
+            for start, end in self.chunks.get_intervals():
+                seq_lo = serialnum.add(self.last_index, start - self.position)
+                seq_hi = serialnum.add(self.last_index, end - self.position)
+                ranges.append((seq_lo, seq_hi))
+            return ranges
+    
     def empty(self):
         with self.condition:
-            return len(self.buffer) == 0
+            return self.length == 0
         
-    def get(self, size):
+    def get(self, size, copy=True):
+        # Return up to size bytes, blocking while the buffer is empty. If
+        # copy is False, the data is returned as a memoryview, which refers
+        # to the stored chunk whenever it does not span more than one.
         with self.condition:
-            if not self.buffer:
+            if not self.length:
                 self.condition.wait()
-            data = self.buffer[:size]
-            self.buffer = self.buffer[size:]
+            size = min(size, self.length)
+            if size <= 0:
+                return str() if copy else memoryview(str())
+            chunk = self.buffer[0]
+            if self.offset + size <= len(chunk):
+                start = self.offset
+                if copy:
+                    data = chunk[start:start+size]
+                else:
+                    data = memoryview(chunk)[start:start+size]
+                self.consume(size)
+                return data
+            pieces = list()
+            remaining = size
+            while remaining > 0:
+                chunk = self.buffer[0]
+                piece = chunk[self.offset:self.offset+remaining]
+                pieces.append(piece)
+                remaining -= len(piece)
+                self.consume(len(piece))
+            data = ''.join(pieces)
+            if not copy:
+                data = memoryview(data)
             return data
+        
+    def get_segments(self, size, segment_size):
+        # Take up to size bytes at once without blocking, split in pieces of
+        # at most segment_size bytes. Pieces are returned as memoryviews, as
+        # get does when copy is False.
+        with self.condition:
+            size = min(size, self.length)
+            segments = list()
+            while size > 0:
+                segment = self.get(min(size, segment_size), copy=False)
+                segments.append(segment)
+                size -= len(segment)
+            return segments
+        
+    def consume(self, size):
+        # Drop size bytes from the head of the buffer. They must all belong
+        # to the leftmost chunk.
+        self.offset += size
+        self.length -= size
+        if self.offset == len(self.buffer[0]):
+            self.buffer.popleft()
+            self.offset = 0
 
     def put(self, data):
         if not data:
             return
+        data = self.to_string(data)
         with self.condition:
-            self.buffer += data
-            self.last_index += len(data)
+            self.append(data)
             self.merge_chunks()
             self.condition.notifyAll()
             
+    def append(self, data):
+        self.buffer.append(data)
+        self.length += len(data)
+        self.position += len(data)
+        self.last_index = serialnum.add(self.last_index, len(data))
+            
     def add_chunk(self, start, data):
+        # Returns False if the chunk had to be dropped as it would exceed the
+        # limit of out-of-order data.
         with self.condition:
-            if start <= self.last_index:
-                offset = self.last_index - start
+            if serialnum.leq(start, self.last_index):
+                offset = serialnum.sub(self.last_index, start)
                 self.put(data[offset:])
-            else:
-                self.chunks[start] = data
+                return True
+            position = self.position + serialnum.sub(start, self.last_index)
+            return self.chunks.add(position, self.to_string(data))
+                
+    def to_string(self, data):
+        # Payloads of received packets are memoryviews over the datagram
+        # buffer. Copy them once, as they are stored. Mutable data given by
+        # the user is copied as well.
+        if isinstance(data, memoryview):
+            return data.tobytes()
+        if not isinstance(data, str):
+            return str(data)
+        return data
             
     def merge_chunks(self):
-        indices = sorted(self.chunks.keys())
-        for start in indices:
-            data = self.chunks[start]
-            end = start + len(data)
-            if start <= self.last_index and end > self.last_index:
-                offset = self.last_index - start
-                self.buffer += data[offset:]
-                self.last_index = end
-                del self.chunks[start]    
\ No newline at end of file
+        for data in self.chunks.pop_from(self.position):
+            self.append(data)    
+
+
+class SendBuffer(object):
+    # Data written by the user and not yet acknowledged by the other end.
+    # Bytes handed out for sending stay here until acknowledged, so that
+    # retransmissions take them again by sequence number, with whatever
+    # segment boundaries suit them by then (see RetransmissionQueue).
+    # Chunks are kept as they were put, and handed out as memoryviews over
+    # them whenever a segment does not span more than one.
+    # At most max_size bytes are accepted: writers are expected to wait for
+    # room (see wait_for_space), which acknowledgements make.
+    
+    def __init__(self, start_index=0, max_size=None):
+        self.buffer = collections.deque()
+        self.max_size = max_size
+        # Offset of the first unacknowledged byte within the leftmost chunk,
+        # and its sequence number.
+        self.offset = 0
+        self.start_index = start_index
+        # Bytes held, and how many of them were already handed out.
+        self.length = 0
+        self.sent = 0
+        # Chunk holding the next byte to hand out, and its offset there.
+        self.cursor = 0
+        self.cursor_offset = 0
+        lock = threading.RLock()
+        self.condition = threading.Condition(lock)
+        
+    def flush(self):
+        with self.condition:
+            self.buffer.clear()
+            self.offset = 0
+            self.length = 0
+            self.sent = 0
+            self.cursor = 0
+            self.cursor_offset = 0
+            self.condition.notifyAll()
+            
+    def set_max_size(self, max_size):
+        with self.condition:
+            self.max_size = max_size
+            self.condition.notifyAll()
+            
+    def get_free_space(self):
+        with self.condition:
+            if self.max_size is None:
+                return sys.maxint
+            return max(0, self.max_size - self.length)
+        
+    def wait_for_space(self):
+        # Once full, wait until half of it is free: waking up writers for
+        # every few bytes acknowledged would have them write in tiny pieces.
+        with self.condition:
+            if self.get_free_space():
+                return
+            self.wait_until_below(self.max_size / 2)
+                
+    def wait_until_below(self, size):
+        # Block until at most size bytes are held.
+        with self.condition:
+            while self.length > size:
+                self.condition.wait()
+        
+    def has_unsent_data(self):
+        with self.condition:
+            return self.length > self.sent
+        
+    def get_unsent_size(self):
+        with self.condition:
+            return self.length - self.sent
+    
+    def get_unacknowledged_size(self):
+        with self.condition:
+            return self.sent
+        
+    def put(self, data):
+        if not data:
+            return
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        elif not isinstance(data, str):
+            data = str(data)
+        with self.condition:
+            self.buffer.append(data)
+            self.length += len(data)
+            
+    def get_segments(self, size, segment_size):
+        # Hand out up to size bytes not sent before, split in pieces of at
+        # most segment_size bytes, as memoryviews. They are kept until
+        # acknowledged.
+        with self.condition:
+            size = min(size, self.length - self.sent)
+            segments = list()
+            while size > 0:
+                segment = self.get_at_cursor(min(size, segment_size))
+                segments.append(segment)
+                size -= len(segment)
+            return segments
+        
+    def get_at_cursor(self, size):
+        self.sent += size
+        chunk = self.buffer[self.cursor]
+        start = self.cursor_offset
+        if start + size < len(chunk):
+            self.cursor_offset += size
+            return memoryview(chunk)[start:start+size]
+        if start + size == len(chunk):
+            self.cursor += 1
+            self.cursor_offset = 0
+            return memoryview(chunk)[start:]
+        pieces = list()
+        while size > 0:
+            chunk = self.buffer[self.cursor]
+            piece = chunk[self.cursor_offset:self.cursor_offset+size]
+            pieces.append(piece)
+            size -= len(piece)
+            self.cursor_offset += len(piece)
+            if self.cursor_offset == len(chunk):
+                self.cursor += 1
+                self.cursor_offset = 0
+        return memoryview(''.join(pieces))
+    
+    def get_range(self, seq, size):
+        # Return up to size bytes, already handed out, starting at sequence
+        # number seq, without consuming them.
+        with self.condition:
+            position = serialnum.sub(seq, self.start_index)
+            size = min(size, self.sent - position)
+            if position < 0 or size <= 0:
+                return memoryview(str())
+            position += self.offset
+            pieces = list()
+            for chunk in self.buffer:
+                if position >= len(chunk):
+                    position -= len(chunk)
+                    continue
+                if not pieces and position + size <= len(chunk):
+                    return memoryview(chunk)[position:position+size]
+                piece = chunk[position:position+size]
+                pieces.append(piece)
+                size -= len(piece)
+                position = 0
+                if size == 0:
+                    break
+            return memoryview(''.join(pieces))
+        
+    def acknowledge(self, ack):
+        # Drop the bytes before ack.
+        with self.condition:
+            size = min(serialnum.sub(ack, self.start_index), self.sent)
+            if size <= 0:
+                return
+            self.start_index = serialnum.add(self.start_index, size)
+            self.length -= size
+            self.sent -= size
+            self.offset += size
+            while self.buffer and self.offset >= len(self.buffer[0]) and\
+                  self.cursor > 0:
+                self.offset -= len(self.buffer.popleft())
+                self.cursor -= 1
+            self.condition.notifyAll()
@@ -1,21 +1,35 @@
 import threading
 
-from buffer import DataBuffer
-from seqnum import SequenceNumber
+from buffer import DataBuffer, SendBuffer
+from constants import REASSEMBLY_LIMIT, SEND_BUFFER_SIZE
+import serialnum
 
 
 class PTCControlBlock(object):
     
-    def __init__(self, send_seq, receive_seq, send_window, receive_window):
+    def __init__(self, send_seq, receive_seq, send_window, receive_window,
+                 send_buffer_size=SEND_BUFFER_SIZE,
+                 reassembly_limit=REASSEMBLY_LIMIT):
+        # Sequence numbers are plain ints (see serialnum).
+        send_seq = serialnum.normalize(send_seq)
+        receive_seq = serialnum.normalize(receive_seq)
         self.snd_wnd = send_window
-        self.snd_nxt = send_seq.clone()
-        self.snd_una = send_seq.clone()
-        self.rcv_nxt = receive_seq.clone()
+        self.snd_nxt = send_seq
+        self.snd_una = send_seq
+        self.rcv_nxt = receive_seq
         self.rcv_wnd = receive_window
-        self.snd_wl1 = receive_seq.clone()
-        self.snd_wl2 = send_seq.clone()
-        self.in_buffer = DataBuffer(start_index=receive_seq.clone())
-        self.out_buffer = DataBuffer(start_index=send_seq.clone())
+        self.snd_wl1 = receive_seq
+        self.snd_wl2 = send_seq
+        # Out-of-order data lies within the window we announce, which is
+        # never larger than this limit (see get_rcv_wnd).
+        if reassembly_limit is None:
+            reassembly_limit = receive_window
+        self.reassembly_limit = reassembly_limit
+        self.in_buffer = DataBuffer(start_index=receive_seq,
+                                    reassembly_limit=reassembly_limit)
+        # Holds outgoing data until acknowledged.
+        self.out_buffer = SendBuffer(start_index=send_seq,
+                                     max_size=send_buffer_size)
         self.lock = threading.RLock()
         
     def get_snd_nxt(self):
@@ -37,95 +51,134 @@ class PTCControlBlock(object):
         return self.rcv_nxt
     
     def get_rcv_wnd(self):
-        return self.rcv_wnd
+        # Room left in the receive buffer, but no more than the out-of-order
+        # data we can hold: anything the other end sends within the window
+        # can then be kept until the gaps before it are filled.
+        return min(self.rcv_wnd, self.reassembly_limit)
     
     def increment_snd_nxt(self):
         with self:
-            self.snd_nxt += 1
+            self.snd_nxt = serialnum.add(self.snd_nxt, 1)
             
     def increment_snd_una(self):
         with self:
-            self.snd_una += 1
+            self.snd_una = serialnum.add(self.snd_una, 1)
             
     def increment_rcv_nxt(self):
         with self:
-            self.rcv_nxt += 1
+            self.rcv_nxt = serialnum.add(self.rcv_nxt, 1)
         
     def process_incoming(self, packet, ignore_payload=False):
+        # Returns True if the packet carried data beyond RCV_NXT, leaving a
+        # gap before it.
         self.process_ack(packet)
         if not ignore_payload:
-            self.process_payload(packet)
+            return self.process_payload(packet)
+        return False
         
     def process_payload(self, packet):    
         if self.payload_is_accepted(packet):
             seq_lo, seq_hi = packet.get_seq_interval()
             payload = packet.get_payload()
-            lower = max(self.rcv_nxt, seq_lo)
-            upper = min(self.rcv_nxt + self.rcv_wnd, seq_hi)
+            lower = serialnum.maximum(self.rcv_nxt, seq_lo)
+            upper = serialnum.minimum(self.rcv_nxt + self.get_rcv_wnd(),
+                                      seq_hi)
             # Honor RCV_WND by dropping those bytes that go below it
             # or beyond it.
-            effective_payload = payload[lower-seq_lo:upper-seq_lo]
-            self.in_buffer.add_chunk(lower, effective_payload)
+            effective_payload = payload[serialnum.sub(lower, seq_lo):
+                                        serialnum.sub(upper, seq_lo)]
+            if not self.in_buffer.add_chunk(lower, effective_payload):
+                # No room to hold it out of order: handled just like data
+                # beyond the window, rather than as a gap to report.
+                return False
             if lower == self.rcv_nxt:
                 # We should advance rcv_nxt since the lower end of the chunk
                 # just added matches its old value. The buffer tracks this
                 # value as data is inserted and removed.
-                self.rcv_nxt = self.in_buffer.get_last_index()
+                last_index = self.in_buffer.get_last_index()
                 # Decrease window until data is removed from the buffer.
-                self.rcv_wnd = self.rcv_wnd - len(effective_payload)
+                # Out-of-order data just reassembled counts as well, so the
+                # right edge of the window stays put.
+                self.rcv_wnd -= serialnum.sub(last_index, self.rcv_nxt)
+                self.rcv_nxt = last_index
+            else:
+                # Out of order: there is a gap before it.
+                return True
+        return False
     
     def process_ack(self, packet):
         ack_number = packet.get_ack_number()
         if self.ack_is_accepted(ack_number):
             self.snd_una = ack_number
+            self.out_buffer.acknowledge(ack_number)
         if self.should_update_window(ack_number):
             self.update_window(packet)
         
     def ack_is_accepted(self, ack_number):
         # Accept only if  SND_UNA < ACK <= SND_NXT
-        return SequenceNumber.a_lt_b_leq_c(self.snd_una, ack_number,
-                                           self.snd_nxt)
+        return serialnum.a_lt_b_leq_c(self.snd_una, ack_number,
+                                      self.snd_nxt)
     
     def payload_is_accepted(self, packet):
         seq_lo, seq_hi = packet.get_seq_interval()
+        if seq_lo == seq_hi:
+            return False
         first_byte, last_byte = seq_lo, seq_hi-1
-        first_ok = SequenceNumber.a_leq_b_leq_c(self.rcv_nxt,
-                                                first_byte,
-                                                self.rcv_nxt+self.rcv_wnd)
-        last_ok = SequenceNumber.a_leq_b_leq_c(self.rcv_nxt, last_byte,
-                                               self.rcv_nxt+self.rcv_wnd)
-        return last_byte >= first_byte and (first_ok or last_ok)
+        rcv_wnd = self.get_rcv_wnd()
+        first_ok = serialnum.a_leq_b_leq_c(self.rcv_nxt, first_byte,
+                                           self.rcv_nxt+rcv_wnd)
+        last_ok = serialnum.a_leq_b_leq_c(self.rcv_nxt, last_byte,
+                                          self.rcv_nxt+rcv_wnd)
+        return first_ok or last_ok
     
     def should_update_window(self, ack_number):
         # TODO: add tests for this.
         # RFC 1122, p.94 (correction to RFC 793).
-        return SequenceNumber.a_leq_b_leq_c(self.snd_una, ack_number,
-                                            self.snd_nxt)
+        return serialnum.a_leq_b_leq_c(self.snd_una, ack_number,
+                                       self.snd_nxt)
     
     def update_window(self, packet):
         seq_number = packet.get_seq_number()
         ack_number = packet.get_ack_number()
-        if self.snd_wl1 < seq_number or \
-           (self.snd_wl1 == seq_number and self.snd_wl2 <= ack_number):
+        if serialnum.lt(self.snd_wl1, seq_number) or \
+           (self.snd_wl1 == seq_number and\
+            serialnum.leq(self.snd_wl2, ack_number)):
             self.snd_wnd = packet.get_window_size()
             self.snd_wl1 = seq_number
             self.snd_wl2 = ack_number
             
-    def usable_window_size(self):
-        upper_limit = self.snd_una + self.snd_wnd
+    def usable_window_size(self, cwnd=None):
+        # The congestion window, if given, further limits the data in flight.
+        window = self.snd_wnd
+        if cwnd is not None:
+            window = min(window, cwnd)
+        upper_limit = self.snd_una + window
         # If the upper window limit is below SND_NXT, we must return 0.
-        if SequenceNumber.a_leq_b_leq_c(self.snd_una, self.snd_nxt,
-                                        upper_limit):
-            return upper_limit - self.snd_nxt
+        if serialnum.a_leq_b_leq_c(self.snd_una, self.snd_nxt, upper_limit):
+            return serialnum.sub(upper_limit, self.snd_nxt)
         else:
             # TODO: add test!
             return 0
     
     def has_data_to_send(self):
-        return not self.out_buffer.empty()
+        return self.out_buffer.has_unsent_data()
 
     def to_out_buffer(self, data):
         self.out_buffer.put(data)    
+        
+    def get_out_buffer_space(self):
+        return self.out_buffer.get_free_space()
+    
+    def set_out_buffer_size(self, size):
+        self.out_buffer.set_max_size(size)
+    
+    def wait_for_out_buffer_space(self):
+        # Must not be called holding the control block lock, since room is
+        # only made as ACKs are processed.
+        self.out_buffer.wait_for_space()
+        
+    def wait_until_out_buffer_below(self, size):
+        self.out_buffer.wait_until_below(size)
     
     def from_in_buffer(self, size):
         data = self.in_buffer.get(size)
@@ -134,12 +187,32 @@ class PTCControlBlock(object):
             self.rcv_wnd += len(data)
         return data
     
-    def extract_from_out_buffer(self, size):
-        usable_window = self.usable_window_size()
-        size = min(size, usable_window)
-        data = self.out_buffer.get(size)
-        self.snd_nxt += len(data)
-        return data
+    def extract_segments_from_out_buffer(self, segment_size,
+                                         max_segments=None, cwnd=None):
+        # Take all the data the window allows at once, split in segments of
+        # at most segment_size bytes. Returns a list of (SEQ, payload) pairs,
+        # payloads being memoryviews over the out buffer, where the data stays
+        # until acknowledged.
+        with self:
+            size = self.usable_window_size(cwnd)
+            if max_segments is not None:
+                size = min(size, max_segments * segment_size)
+            segments = list()
+            seq_number = self.snd_nxt
+            for payload in self.out_buffer.get_segments(size, segment_size):
+                segments.append((seq_number, payload))
+                seq_number = serialnum.add(seq_number, len(payload))
+            self.snd_nxt = seq_number
+            return segments
+    
+    def get_sack_blocks(self):
+        # Data received beyond a gap, to let the sender know what it need
+        # not retransmit.
+        return self.in_buffer.get_out_of_order_ranges()
+    
+    def get_from_out_buffer(self, seq, size):
+        # Data already sent starting at seq, for retransmitting it.
+        return self.out_buffer.get_range(seq, size)
     
     def flush_buffers(self):
         self.in_buffer.flush()
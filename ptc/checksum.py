@@ -0,0 +1,61 @@
+import array
+import sys
+
+
+class IPChecksumAlgorithm(object):
+    # Internet checksum (RFC 1071). Words are summed in bulk through an array
+    # of unsigned shorts using the native byte order: the one's complement sum
+    # is byte-order independent, so only the folded 16-bit result has to be
+    # swapped on little-endian hosts. Incremental updates follow RFC 1624.
+
+    SWAP_BYTES = sys.byteorder == 'little'
+
+    @classmethod
+    def for_bytes(cls, message):
+        return cls(message)
+
+    @classmethod
+    def fold(cls, value):
+        while value >> 16:
+            value = (value & 0xffff) + (value >> 16)
+        return value
+
+    @classmethod
+    def word_sum(cls, message):
+        # One's complement sum of the 16-bit words of message, in network
+        # byte order.
+        if type(message) is not str:
+            message = cls.to_string(message)
+        if len(message) & 1:
+            message += '\0'
+        value = cls.fold(sum(array.array('H', message)))
+        if cls.SWAP_BYTES:
+            value = ((value & 0xff) << 8) | (value >> 8)
+        return value
+
+    @classmethod
+    def to_string(cls, message):
+        if isinstance(message, memoryview):
+            return message.tobytes()
+        return str(message)
+
+    @classmethod
+    def update_word(cls, checksum, old_word, new_word):
+        # RFC 1624, eqn. 3: HC' = ~(~HC + ~m + m'), where m and m' are the
+        # old and new values of the 16-bit field that changed, given as
+        # integers.
+        value = (~checksum & 0xffff) + (~old_word & 0xffff) + new_word
+        value = (value & 0xffff) + (value >> 16)
+        value = (value & 0xffff) + (value >> 16)
+        return ~value & 0xffff
+
+    @classmethod
+    def is_valid(cls, message):
+        # A message carrying its own checksum adds up to negative zero.
+        return cls.word_sum(message) == 0xffff
+
+    def __init__(self, message):
+        self.message = message
+
+    def value(self):
+        return ~self.word_sum(self.message) & 0xffff
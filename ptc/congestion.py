@@ -0,0 +1,265 @@
+import collections
+import sys
+import threading
+
+from constants import RENO, CUBIC, LEDBAT, CLOCK_TICK, INITIAL_WINDOW,\
+                      DUPLICATE_ACK_THRESHOLD, CUBIC_C, CUBIC_BETA,\
+                      LEDBAT_TARGET, LEDBAT_GAIN, LEDBAT_CURRENT_FILTER,\
+                      LEDBAT_BASE_HISTORY, LEDBAT_ALLOWED_INCREASE,\
+                      LEDBAT_MIN_CWND
+from exceptions import PTCError
+
+
+# Congestion control. The protocol reports ACKs, duplicate ACKs and
+# timeouts, and never has more than cwnd bytes in flight (on top of what
+# the receive window allows). Sizes are in bytes, and mss is the current
+# segment size.
+class CongestionControl(object):
+    # Slow start, loss recovery and the response to timeouts follow RFC 5681
+    # and RFC 6582 (NewReno). Subclasses decide how the window grows in
+    # congestion avoidance (grow) and how much it is cut on losses (reduce).
+    
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.cwnd = 0
+        self.ssthresh = sys.maxint
+        self.lock = threading.RLock()
+        
+    def reset(self, mss):
+        # Called once the MSS is known, e.g. on connection establishment.
+        with self.lock:
+            self.cwnd = min(10 * mss, max(2 * mss, INITIAL_WINDOW))
+            self.ssthresh = sys.maxint
+            
+    def get_cwnd(self):
+        with self.lock:
+            return self.cwnd
+            
+    def get_ssthresh(self):
+        with self.lock:
+            return self.ssthresh
+            
+    def process_ack(self, acked_bytes, flight_size, mss):
+        # New data acknowledged outside recovery. flight_size is the data in
+        # flight before this ACK. The window only grows while it is what
+        # limits sending, as it would otherwise grow without bound on
+        # connections held back by the receive window or the application.
+        with self.lock:
+            if 2 * flight_size < self.cwnd:
+                return
+            if self.cwnd < self.ssthresh:
+                self.cwnd += min(acked_bytes, mss)
+            else:
+                self.grow(acked_bytes, mss)
+                
+    def enter_recovery(self, flight_size, mss):
+        # Called on fast retransmit. The window is inflated by the segments
+        # that left the network, as told by the duplicate ACKs.
+        with self.lock:
+            self.ssthresh = self.reduce(flight_size, mss)
+            self.cwnd = self.ssthresh + DUPLICATE_ACK_THRESHOLD * mss
+            
+    def process_duplicate_ack(self, mss):
+        # A further duplicate ACK during recovery: one more segment left.
+        with self.lock:
+            self.cwnd += mss
+            
+    def process_partial_ack(self, acked_bytes, mss):
+        # Deflate the window by the data acknowledged, but let a new segment
+        # go out.
+        with self.lock:
+            self.cwnd = max(self.cwnd - acked_bytes + mss, mss)
+            
+    def exit_recovery(self, flight_size, mss):
+        # flight_size is the data in flight once the full ACK is processed.
+        # Avoid sending a burst if little is left in flight.
+        with self.lock:
+            self.cwnd = min(self.ssthresh, max(flight_size, mss) + mss)
+            
+    def process_timeout(self, flight_size, mss, first):
+        # The window falls back to a single segment. ssthresh is only
+        # lowered on the first timeout of a segment, as later ones no longer
+        # tell about the path.
+        with self.lock:
+            if first:
+                self.ssthresh = self.reduce(flight_size, mss)
+            self.cwnd = mss
+            
+    def process_ecn_echo(self, flight_size, mss):
+        # Congestion reported through ECN: the window is cut as on a loss,
+        # but nothing has to be retransmitted.
+        with self.lock:
+            self.ssthresh = self.reduce(flight_size, mss)
+            self.cwnd = self.ssthresh
+            
+    def process_rtt_sample(self, rtt):
+        # RTT measured, in seconds. Only delay-based algorithms care.
+        pass
+            
+    def grow(self, acked_bytes, mss):
+        raise NotImplementedError
+        
+    def reduce(self, flight_size, mss):
+        raise NotImplementedError
+
+
+class RenoCongestionControl(CongestionControl):
+    # Additive increase of about one segment per round trip, multiplicative
+    # decrease by half.
+    
+    def grow(self, acked_bytes, mss):
+        self.cwnd += max(1, mss * mss / self.cwnd)
+        
+    def reduce(self, flight_size, mss):
+        return max(flight_size / 2, 2 * mss)
+
+
+class CUBICCongestionControl(CongestionControl):
+    # CUBIC (RFC 9438). After a loss, the window follows a cubic function of
+    # the time elapsed, which quickly gets back close to where the loss
+    # happened (w_max), stays there for a while and then probes beyond it.
+    # This keeps growth independent of the RTT, which matters on paths with
+    # a large bandwidth-delay product. Wherever Reno would do better, its
+    # estimate (w_est) is used instead. Windows in these formulas are in
+    # segments and times in seconds.
+    
+    # Growth rate of the Reno estimate, so that it is as fair as Reno with
+    # the smaller decrease of CUBIC.
+    ALPHA = 3 * (1 - CUBIC_BETA) / (1 + CUBIC_BETA)
+    
+    def __init__(self, protocol):
+        CongestionControl.__init__(self, protocol)
+        self.w_max = 0
+        self.k = 0
+        self.w_est = 0
+        # Time when the current congestion avoidance epoch started, if one
+        # did.
+        self.epoch_start = None
+        
+    def reset(self, mss):
+        with self.lock:
+            CongestionControl.reset(self, mss)
+            self.w_max = 0
+            self.epoch_start = None
+            
+    def get_time(self):
+        return self.protocol.get_ticks() * CLOCK_TICK
+        
+    def get_rtt(self):
+        return self.protocol.rto_estimator.get_srtt() * CLOCK_TICK
+        
+    def w_cubic(self, t):
+        return CUBIC_C * (t - self.k) ** 3 + self.w_max
+        
+    def grow(self, acked_bytes, mss):
+        cwnd = float(self.cwnd) / mss
+        now = self.get_time()
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if cwnd < self.w_max:
+                self.k = ((self.w_max - cwnd) / CUBIC_C) ** (1.0 / 3)
+            else:
+                self.k = 0
+                self.w_max = cwnd
+            self.w_est = cwnd
+        t = now - self.epoch_start
+        acked_segments = float(acked_bytes) / mss
+        self.w_est += self.ALPHA * acked_segments / cwnd
+        if self.w_cubic(t) < self.w_est:
+            target = self.w_est
+        else:
+            # Aim at where the cubic function will be one RTT later, within
+            # [cwnd, 1.5 cwnd].
+            target = self.w_cubic(t + self.get_rtt())
+            target = min(max(target, cwnd), 1.5 * cwnd)
+        increase = (target - cwnd) / cwnd * acked_segments
+        self.cwnd = max(self.cwnd, int((cwnd + increase) * mss))
+        
+    def reduce(self, flight_size, mss):
+        cwnd = float(self.cwnd) / mss
+        if cwnd < self.w_max:
+            # Fast convergence: the loss came before reaching the previous
+            # maximum, so leave room for other flows.
+            self.w_max = cwnd * (1 + CUBIC_BETA) / 2
+        else:
+            self.w_max = cwnd
+        self.epoch_start = None
+        return max(int(flight_size * CUBIC_BETA), 2 * mss)
+
+
+class LEDBATCongestionControl(CongestionControl):
+    # Scavenger congestion control for background transfers, after LEDBAT
+    # (RFC 6817). Instead of growing until packets get lost, the window
+    # follows the queueing delay: the current delay minus the lowest one
+    # seen lately (the base delay, taken as the delay with empty queues).
+    # Below LEDBAT_TARGET, the window grows by up to a segment per round
+    # trip. Above it, the window shrinks in proportion, so these transfers
+    # get out of the way as soon as other traffic builds up a queue. Losses
+    # and timeouts are handled as in Reno.
+    # PTC segments carry no timestamps, so delays are RTT samples rather
+    # than one-way delays. Queueing on the way back counts as well.
+    
+    def __init__(self, protocol):
+        CongestionControl.__init__(self, protocol)
+        self.current_delays = collections.deque(
+            maxlen=LEDBAT_CURRENT_FILTER)
+        # Lowest delay of each of the last minutes, as (minute, delay).
+        self.base_delays = collections.deque(maxlen=LEDBAT_BASE_HISTORY)
+        
+    def reset(self, mss):
+        # No slow start: the window starts small and grows only as long as
+        # the path shows no queueing.
+        with self.lock:
+            CongestionControl.reset(self, mss)
+            self.cwnd = LEDBAT_MIN_CWND * mss
+            self.current_delays.clear()
+            self.base_delays.clear()
+            
+    def get_time(self):
+        return self.protocol.get_ticks() * CLOCK_TICK
+        
+    def process_rtt_sample(self, rtt):
+        with self.lock:
+            self.current_delays.append(rtt)
+            minute = int(self.get_time() / 60)
+            if self.base_delays and self.base_delays[-1][0] == minute:
+                if rtt < self.base_delays[-1][1]:
+                    self.base_delays[-1] = (minute, rtt)
+            else:
+                self.base_delays.append((minute, rtt))
+                
+    def get_queueing_delay(self):
+        # None until some delay is measured.
+        with self.lock:
+            if not self.current_delays:
+                return None
+            base_delay = min(delay for _, delay in self.base_delays)
+            return min(self.current_delays) - base_delay
+            
+    def process_ack(self, acked_bytes, flight_size, mss):
+        with self.lock:
+            queueing_delay = self.get_queueing_delay()
+            if queueing_delay is None:
+                return
+            off_target = (LEDBAT_TARGET - queueing_delay) / LEDBAT_TARGET
+            cwnd = self.cwnd +\
+                   LEDBAT_GAIN * off_target * acked_bytes * mss / self.cwnd
+            # Never far beyond what is actually in flight.
+            cwnd = min(cwnd, flight_size + LEDBAT_ALLOWED_INCREASE * mss)
+            self.cwnd = int(max(cwnd, LEDBAT_MIN_CWND * mss))
+            
+    def reduce(self, flight_size, mss):
+        return max(self.cwnd / 2, LEDBAT_MIN_CWND * mss)
+
+
+CONGESTION_CONTROLS = {
+    RENO: RenoCongestionControl,
+    CUBIC: CUBICCongestionControl,
+    LEDBAT: LEDBATCongestionControl,
+}
+
+
+def get_congestion_control(name):
+    if name not in CONGESTION_CONTROLS:
+        raise PTCError('unknown congestion control: %s' % name)
+    return CONGESTION_CONTROLS[name]
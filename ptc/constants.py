@@ -1,6 +1,13 @@
 # Protocol ID field of IP header
 PROTOCOL_NUMBER = 202
 
+# ECN codepoints (RFC 3168), in the two lower bits of the IP type of service
+# byte: not ECN-capable, ECN-capable (ECT(0)) and congestion experienced.
+ECN_MASK = 0x03
+NOT_ECT = 0x00
+ECT = 0x02
+CE = 0x03
+
 # Clock granularity in seconds
 CLOCK_TICK = 0.01
 
@@ -32,11 +39,59 @@ ABORT = 5   # Close immediately; abort the connection
 
 NULL_ADDRESS = '0.0.0.0'
 
+# Transports that can carry PTC datagrams: raw IP datagrams of protocol
+# PROTOCOL_NUMBER, which requires root privileges, UDP datagrams, memory,
+# for endpoints within the same process, or shared memory, for processes
+# on the same host.
+RAW_TRANSPORT = 'raw'
+UDP_TRANSPORT = 'udp'
+MEMORY_TRANSPORT = 'memory'
+SHM_TRANSPORT = 'shm'
+DEFAULT_TRANSPORT = RAW_TRANSPORT
+
+# UDP address and port where listening sockets receive PTC datagrams over
+# UDP. Processes listening on this port share it (SO_REUSEPORT), so the
+# kernel spreads connections among them. Connecting sockets use an
+# ephemeral port instead.
+UDP_ADDRESS = NULL_ADDRESS
+UDP_PORT = 20202
+
+# Directory holding the rings of the shared memory transport, and their
+# size in bytes.
+SHM_DIRECTORY = '/dev/shm'
+SHM_RING_SIZE = 1024*1024
+
+# Whether to verify the IP header checksum of incoming packets. The kernel
+# already drops corrupted datagrams, so this is off by default.
+VERIFY_CHECKSUM = False
+
 # Size in bytes of the buffer that holds incoming data
 RECEIVE_BUFFER_SIZE = 1024
 
-# Maximum segment size
-MSS = 2*1024*1024
+# Size in bytes of the buffer that holds outgoing data until acknowledged.
+# Once full, sending blocks (or, on non-blocking sockets, takes less data).
+SEND_BUFFER_SIZE = 64 * 1024
+
+# Maximum amount of out-of-order data, in bytes, held until the missing
+# segments arrive. The window we announce never goes beyond it. None stands
+# for the receive buffer size.
+REASSEMBLY_LIMIT = None
+
+# Largest amount of data that fits in a segment, since IP datagrams cannot
+# exceed 65535 bytes and the IP and PTC headers take 36. The actual maximum
+# is negotiated on connection establishment (see PathMTUDiscovery).
+MAX_MSS = 65535 - 36
+# Segment size that any path is assumed to carry, as TCP's default MSS.
+BASE_MSS = 536
+
+# Path MTU probing (RFC 4821). Once the segment size was reduced, a larger
+# one is probed after PMTU_PROBE_INTERVAL segments, as long as the sizes
+# left to try span more than PMTU_PROBE_GRANULARITY bytes. Timing out
+# PMTU_BLACK_HOLE_RETRANSMISSIONS times in a row on the same segment makes
+# the segment size fall back to BASE_MSS.
+PMTU_PROBE_INTERVAL = 16
+PMTU_PROBE_GRANULARITY = 32
+PMTU_BLACK_HOLE_RETRANSMISSIONS = 2
 
 # RTO estimation and retransmission constants
 # TODO: this is getting ugly. Better organization required.
@@ -46,4 +101,36 @@ INITIAL_RTO = 1 / CLOCK_TICK
 MAX_RTO = 60 / CLOCK_TICK
 ALPHA = 0.125
 BETA = 0.25
-K = 4
\ No newline at end of file
+K = 4
+
+# Duplicate ACKs in a row taken as a sign of a lost segment, which is then
+# retransmitted right away (see FastRecovery).
+DUPLICATE_ACK_THRESHOLD = 3
+
+# Congestion control algorithms available (see congestion). Each socket may
+# pick its own.
+RENO = 'reno'
+CUBIC = 'cubic'
+LEDBAT = 'ledbat'
+DEFAULT_CONGESTION_CONTROL = RENO
+
+# Initial congestion window, in bytes, as long as it takes between 2 and 10
+# segments (RFC 6928).
+INITIAL_WINDOW = 14600
+
+# CUBIC constants (RFC 9438): how fast the window grows and how much it is
+# cut on losses.
+CUBIC_C = 0.4
+CUBIC_BETA = 0.7
+
+# LEDBAT constants (RFC 6817), for background transfers: the queueing delay
+# aimed at, in seconds, how fast the window reacts to the distance from it,
+# the RTT samples taken as the current delay, the minutes of history kept
+# for the base delay, and the segments the window may go beyond the data in
+# flight and may be cut down to.
+LEDBAT_TARGET = 0.1
+LEDBAT_GAIN = 1
+LEDBAT_CURRENT_FILTER = 4
+LEDBAT_BASE_HISTORY = 10
+LEDBAT_ALLOWED_INCREASE = 1
+LEDBAT_MIN_CWND = 2
\ No newline at end of file
@@ -0,0 +1,226 @@
+import socket
+import struct
+import threading
+import traceback
+
+import bpf
+from constants import NULL_ADDRESS, VERIFY_CHECKSUM, DEFAULT_TRANSPORT
+from exceptions import ChecksumError
+from packet_utils import PacketDecoder
+from soquete import Soquete, get_transport
+
+
+class PacketDemultiplexer(object):
+    # Every PTC connection within a process shares a single socket of the
+    # transport it uses (one per local port, for transports that have
+    # them; see Soquete.get_port_for). A single thread reads incoming
+    # datagrams, peeks at their addresses and ports and hands them to the
+    # owning protocol. Endpoints are indexed by (local address, local port,
+    # remote address, remote port), with addresses packed as in the IP
+    # header. Listening endpoints have no remote address and port, and those
+    # bound to the null address take datagrams sent to any local address.
+    # The socket is given a BPF filter that lets through only the datagrams
+    # sent to registered local endpoints, so that the kernel drops those
+    # meant for other processes. If it cannot be attached, lookup still
+    # discards them here.
+
+    TIMEOUT = 0.5
+
+    ADDRESSES = struct.Struct('!B11x4s4s')
+    PORTS = struct.Struct('!HH')
+    PTC_HEADER_SIZE = 16
+
+    instances = dict()
+    instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, transport=DEFAULT_TRANSPORT, listening=True):
+        # The demultiplexer for endpoints using the given transport, either
+        # listening or connecting.
+        socket_class = get_transport(transport)
+        port = socket_class.get_port_for(listening)
+        key = (transport, port)
+        with cls.instance_lock:
+            if key not in cls.instances:
+                cls.instances[key] = cls(socket_class, port)
+            return cls.instances[key]
+
+    @classmethod
+    def pack_address(cls, address):
+        return socket.inet_aton(address)
+
+    def __init__(self, socket_class=Soquete, port=None):
+        if port is None:
+            self.socket = socket_class()
+        else:
+            self.socket = socket_class(port)
+        verify_checksum = VERIFY_CHECKSUM and socket_class.CARRIES_IP_HEADER
+        self.decoder = PacketDecoder(verify_checksum=verify_checksum)
+        self.delivers_packets = socket_class.DELIVERS_PACKETS
+        self.endpoints = dict()
+        self.keys = dict()
+        # Endpoints by local port and remote address and port, for
+        # datagrams whose destination address is unknown.
+        self.ports = dict()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.null_address = self.pack_address(NULL_ADDRESS)
+        self.filtering = True
+        self.local_endpoints = set()
+
+    def get_socket(self):
+        return self.socket
+
+    def register(self, protocol, local_address, local_port,
+                 remote_address=None, remote_port=None):
+        # Deliver to protocol the datagrams addressed to the given endpoint,
+        # replacing any previous registration of it.
+        local_address = self.pack_address(local_address)
+        if remote_address is not None:
+            remote_address = self.pack_address(remote_address)
+        key = (local_address, local_port, remote_address, remote_port)
+        with self.lock:
+            self.remove(protocol)
+            self.endpoints[key] = protocol
+            self.keys[protocol] = key
+            self.ports[key[1:]] = protocol
+            self.update_endpoints()
+            if self.thread is None:
+                self.start_receiving()
+
+    def unregister(self, protocol):
+        with self.lock:
+            self.remove(protocol)
+            self.update_endpoints()
+            if not self.endpoints:
+                # Let the thread see it has to exit.
+                self.socket.interrupt()
+
+    def remove(self, protocol):
+        key = self.keys.pop(protocol, None)
+        if key is None:
+            return
+        if self.endpoints.get(key) is protocol:
+            del self.endpoints[key]
+        if self.ports.get(key[1:]) is protocol:
+            del self.ports[key[1:]]
+        _, _, remote_address, remote_port = key
+        if remote_address is not None:
+            self.socket.forget(socket.inet_ntoa(remote_address), remote_port)
+
+    def update_endpoints(self):
+        # Let the transport know of changes in the set of local endpoints
+        # and attach a new filter for them.
+        local_endpoints = set(key[:2] for key in self.endpoints)
+        if local_endpoints == self.local_endpoints:
+            return
+        self.local_endpoints = local_endpoints
+        self.socket.set_local_endpoints(local_endpoints)
+        if not self.filtering:
+            return
+        program = bpf.build_filter(local_endpoints)
+        if program is None or not self.socket.attach_filter(program):
+            # Leave it all to lookup from now on.
+            self.filtering = False
+            self.socket.detach_filter()
+
+    def start_receiving(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def should_run(self):
+        # The thread exits when there are no endpoints left. It will be
+        # started again on the next registration.
+        with self.lock:
+            if not self.endpoints:
+                self.thread = None
+                return False
+            return True
+
+    def run(self):
+        while self.should_run():
+            try:
+                batch = self.socket.receive_batch(timeout=self.TIMEOUT)
+            except socket.timeout:
+                continue
+            try:
+                self.dispatch_batch(batch)
+            except Exception:
+                # A failure within some connection must not stop the others
+                # from receiving.
+                traceback.print_exc()
+
+    def lookup(self, packet_bytes):
+        # Find the protocol that owns packet_bytes without decoding it.
+        if len(packet_bytes) < self.ADDRESSES.size:
+            return None
+        version_and_length, source_address, destination_address =\
+            self.ADDRESSES.unpack_from(packet_bytes)
+        header_length = 4 * (version_and_length & 0xf)
+        if len(packet_bytes) < header_length + self.PTC_HEADER_SIZE:
+            return None
+        source_port, destination_port =\
+            self.PORTS.unpack_from(packet_bytes, header_length)
+        return self.find(destination_address, destination_port,
+                         source_address, source_port)
+    
+    def lookup_packet(self, packet):
+        # Same as lookup, for packet objects.
+        pack_address = self.pack_address
+        return self.find(pack_address(packet.get_destination_ip()),
+                         packet.get_destination_port(),
+                         pack_address(packet.get_source_ip()),
+                         packet.get_source_port())
+    
+    def find(self, destination_address, destination_port, source_address,
+             source_port):
+        if destination_address == self.null_address:
+            # No datagram is sent to the null address. The transport does
+            # not know the actual one.
+            return self.ports.get((destination_port, source_address,
+                                   source_port)) or\
+                   self.ports.get((destination_port, None, None))
+        endpoints = self.endpoints
+        return endpoints.get((destination_address, destination_port,
+                              source_address, source_port)) or\
+               endpoints.get((destination_address, destination_port,
+                              None, None)) or\
+               endpoints.get((self.null_address, destination_port,
+                              source_address, source_port)) or\
+               endpoints.get((self.null_address, destination_port,
+                              None, None))
+
+    def dispatch(self, packet_bytes):
+        # Returns whether some protocol owns packet_bytes.
+        protocol = self.lookup(packet_bytes)
+        if protocol is None:
+            return False
+        try:
+            packet = self.decoder.view(packet_bytes)
+        except ChecksumError:
+            return True
+        protocol.handle_incoming(packet)
+        return True
+    
+    def dispatch_batch(self, batch):
+        # Hand every protocol the packets of batch it owns at once, in the
+        # order they were received.
+        packets_by_protocol = dict()
+        for packet_bytes in batch:
+            if self.delivers_packets:
+                packet = packet_bytes
+                protocol = self.lookup_packet(packet)
+                if protocol is None:
+                    continue
+            else:
+                protocol = self.lookup(packet_bytes)
+                if protocol is None:
+                    continue
+                try:
+                    packet = self.decoder.view(packet_bytes)
+                except ChecksumError:
+                    continue
+            packets_by_protocol.setdefault(protocol, list()).append(packet)
+        for protocol, packets in packets_by_protocol.items():
+            protocol.handle_incoming_batch(packets)
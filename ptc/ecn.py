@@ -0,0 +1,104 @@
+import threading
+
+from constants import CE
+from packet import SYNFlag, ACKFlag, ECEFlag, CWRFlag
+import serialnum
+
+
+# Explicit congestion notification (RFC 3168).
+class ExplicitCongestionNotification(object):
+    # Routers with a queue building up may mark ECN-capable packets (ECT)
+    # as congestion experienced (CE) instead of dropping them. The receiver
+    # echoes the mark back by setting ECE on its ACKs until the sender
+    # answers with CWR, and the sender reduces its window just as it would
+    # on a loss, but without having to retransmit anything. This happens at
+    # most once per window of data: ECE arriving before everything sent by
+    # the time of the last reduction (up to recover) is acknowledged refers
+    # to the same congestion event.
+    # Both ends must agree on using ECN: the SYN carries ECE and CWR, and
+    # the SYN/ACK carries ECE alone if the other end offered it.
+    # Only new data is sent as ECN-capable: neither pure ACKs nor
+    # retransmissions are, as RFC 3168 requires. ECN is neither offered nor
+    # agreed on transports that do not carry the ECN bits.
+    
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.available = True
+        self.enabled = False
+        # Set on CE, cleared once the other end tells it reduced its window.
+        self.echo_pending = False
+        # Set on ECE, so that the next data segment sent carries CWR.
+        self.cwr_pending = False
+        self.recover = None
+        self.lock = threading.RLock()
+        
+    def is_enabled(self):
+        with self.lock:
+            return self.enabled
+            
+    def set_available(self, available):
+        with self.lock:
+            self.available = available
+            
+    def get_syn_flags(self, flags):
+        if ACKFlag not in flags:
+            with self.lock:
+                if self.available:
+                    return flags + [ECEFlag, CWRFlag]
+            return flags
+        with self.lock:
+            if self.enabled:
+                return flags + [ECEFlag]
+        return flags
+        
+    def negotiate(self, packet):
+        # Called with the SYN segment of the other end.
+        with self.lock:
+            if not self.available:
+                self.enabled = False
+            elif ACKFlag in packet:
+                self.enabled = ECEFlag in packet and CWRFlag not in packet
+            else:
+                self.enabled = ECEFlag in packet and CWRFlag in packet
+            self.echo_pending = False
+            self.cwr_pending = False
+            self.recover = None
+            
+    def process_incoming(self, packet):
+        with self.lock:
+            if not self.enabled:
+                return
+            if CWRFlag in packet:
+                self.echo_pending = False
+            if packet.get_ecn() == CE:
+                self.echo_pending = True
+                
+    def get_ack_flags(self, flags):
+        with self.lock:
+            if self.echo_pending and ACKFlag in flags and\
+               SYNFlag not in flags:
+                return flags + [ECEFlag]
+            return flags
+            
+    def take_cwr(self):
+        # Returns True if the next data segment should carry CWR, which goes
+        # only once.
+        with self.lock:
+            cwr_pending = self.cwr_pending
+            self.cwr_pending = False
+            return cwr_pending
+            
+    def process_echo(self, packet, snd_nxt):
+        # Returns True if the window should be reduced, i.e., if the packet
+        # tells about a new congestion event.
+        with self.lock:
+            if not self.enabled or ECEFlag not in packet or\
+               SYNFlag in packet:
+                return False
+            ack_number = packet.get_ack_number()
+            if self.recover is not None and\
+               not serialnum.gt(ack_number, self.recover):
+                return False
+            self.recover = snd_nxt
+            self.cwr_pending = True
+            return True
@@ -1,3 +1,13 @@
 class PTCError(Exception):
     
+    pass
+
+
+class ChecksumError(PTCError):
+    
+    pass
+
+
+class WouldBlockError(PTCError):
+    
     pass
\ No newline at end of file
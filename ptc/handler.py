@@ -2,13 +2,17 @@ from constants import CLOSED, SYN_RCVD, ESTABLISHED, SYN_SENT,\
                       LISTEN, FIN_WAIT1, FIN_WAIT2, CLOSE_WAIT,\
                       LAST_ACK, CLOSING
 from packet import SYNFlag, ACKFlag, FINFlag
+import serialnum
 
 
 class IncomingPacketHandler(object):
     
     def __init__(self, protocol):
         self.protocol = protocol
-        self.socket = self.protocol.socket
+        # While handling a batch, ACKs are just recorded and a single one
+        # is sent at the end.
+        self.delaying_acks = False
+        self.ack_pending = False
         
     def initialize_control_block_from(self, packet):
         self.protocol.initialize_control_block_from(packet)
@@ -18,11 +22,38 @@ class IncomingPacketHandler(object):
         return self.protocol.build_packet(*args, **kwargs)
     
     def set_state(self, state):
+        if state == CLOSED:
+            # The connection may be freed as soon as it is closed, so an ACK
+            # held back must go out before.
+            self.send_pending_ack()
         self.protocol.set_state(state)
         
     def send_ack(self):
+        if self.delaying_acks:
+            self.ack_pending = True
+            return
         ack_packet = self.build_packet()
-        self.socket.send(ack_packet)
+        self.protocol.socket.send(ack_packet)
+        
+    def send_pending_ack(self):
+        if self.ack_pending:
+            self.ack_pending = False
+            ack_packet = self.build_packet()
+            self.protocol.socket.send(ack_packet)
+        
+    def handle_batch(self, packets):
+        if len(packets) == 1:
+            self.handle(packets[0])
+            return
+        self.delaying_acks = True
+        self.ack_pending = False
+        try:
+            for packet in packets:
+                self.handle(packet)
+        finally:
+            self.delaying_acks = False
+        # This ACK covers every packet of the batch.
+        self.send_pending_ack()
 
     def handle(self, packet):
         state = self.protocol.state
@@ -35,6 +66,7 @@ class IncomingPacketHandler(object):
                 # Ignore packets not following protocol specification.
                 return
             with self.control_block:
+                self.protocol.ecn.process_incoming(packet)
                 self.protocol.acknowledge_packets_and_update_timers_with(packet)
                 if state == SYN_RCVD:
                     self.handle_incoming_on_syn_rcvd(packet)
@@ -59,19 +91,22 @@ class IncomingPacketHandler(object):
             destination_port = packet.get_source_port()
             self.protocol.set_destination_on_packet_builder(destination_ip,
                                                             destination_port)
-            syn_ack_packet = self.build_packet(flags=[SYNFlag, ACKFlag])
+            self.protocol.negotiate_options(packet)
+            syn_ack_packet = self.protocol.build_syn_packet(
+                flags=[SYNFlag, ACKFlag])
             # The next byte we send should be sequenced after the SYN flag.
             self.control_block.increment_snd_nxt()
-            self.socket.send(syn_ack_packet)
+            self.protocol.socket.send(syn_ack_packet)
             
     def handle_incoming_on_syn_sent(self, packet):
         if SYNFlag not in packet or ACKFlag not in packet:
             return
         ack_number = packet.get_ack_number()
         # +1 since the SYN flag is also sequenced.
-        expected_ack = 1 + self.protocol.iss
+        expected_ack = serialnum.add(self.protocol.iss, 1)
         if expected_ack == ack_number:
             self.initialize_control_block_from(packet)
+            self.protocol.negotiate_options(packet)
             self.protocol.\
             remove_from_retransmission_queue_packets_acked_by(packet)
             self.set_state(ESTABLISHED)
@@ -84,24 +119,41 @@ class IncomingPacketHandler(object):
             # This packet is acknowledging our SYN. We must increment SND_UNA
             # in order to reflect this.
             self.control_block.increment_snd_una()
+            # It may already carry data (e.g., if it overtook the plain ACK
+            # completing the handshake), so go on processing it.
+            self.handle_incoming_on_established(packet)
             
     def handle_incoming_fin(self, packet, next_state):
         seq_number = packet.get_seq_number()
         # SEQ number should be the one we are expecting.
         if seq_number == self.control_block.get_rcv_nxt():
-            self.set_state(next_state)
             self.protocol.read_stream_open = False
             # The FIN flag is also sequenced, and so we must increment the next
             # byte we expect to receive.
             self.control_block.increment_rcv_nxt()
-        # Send ACK (if the previous check fails, the ACK number will be
-        # automatically set to the proper one).
-        self.send_ack()
+            # ACK it before changing state: on CLOSED, the connection may be
+            # freed right away.
+            self.send_ack()
+            self.set_state(next_state)
+        else:
+            # Send ACK anyway: its ACK number will be the proper one.
+            self.send_ack()
         
     def process_on_control_block(self, packet):
+        # Returns True if the packet was already acknowledged here.
         ignore_payload = not self.protocol.read_stream_open
-        self.control_block.process_incoming(packet,
-                                            ignore_payload=ignore_payload)
+        out_of_order = self.control_block.process_incoming(
+            packet, ignore_payload=ignore_payload)
+        if out_of_order:
+            self.send_duplicate_ack()
+        return out_of_order
+    
+    def send_duplicate_ack(self):
+        # Data arriving out of order is acknowledged right away, even within
+        # a batch: the sender counts these duplicate ACKs to tell that a
+        # segment was lost (see FastRecovery).
+        ack_packet = self.build_packet()
+        self.protocol.socket.send(ack_packet)
         
     def send_ack_for_packet_only_if_it_has_payload(self, packet):
         # This is to avoid sending ACKs for plain ACK segments.
@@ -112,8 +164,9 @@ class IncomingPacketHandler(object):
         if FINFlag in packet:
             self.handle_incoming_fin(packet, next_state=CLOSE_WAIT)
         else:
-            self.process_on_control_block(packet)
-            if not self.control_block.has_data_to_send():
+            acknowledged = self.process_on_control_block(packet)
+            if not acknowledged and\
+               not self.control_block.has_data_to_send():
                 # If some data is about to be sent, then just piggyback the ACK
                 # there. It is not necessary to manually send an ACK.
                 self.send_ack_for_packet_only_if_it_has_payload(packet)
@@ -136,8 +189,8 @@ class IncomingPacketHandler(object):
                 # Same comment from above applies here as well.
                 should_send_ack = False
         # We might receive data, so we must process the packet accordingly.
-        self.process_on_control_block(packet)
-        if should_send_ack:
+        acknowledged = self.process_on_control_block(packet)
+        if should_send_ack and not acknowledged:
             # Finally, send an ACK (if this packet contains some data).
             self.send_ack_for_packet_only_if_it_has_payload(packet)
             
@@ -145,8 +198,8 @@ class IncomingPacketHandler(object):
         if FINFlag in packet:
             self.handle_incoming_fin(packet, next_state=CLOSED)
         else:
-            self.process_on_control_block(packet)
-            self.send_ack_for_packet_only_if_it_has_payload(packet)
+            if not self.process_on_control_block(packet):
+                self.send_ack_for_packet_only_if_it_has_payload(packet)
             
     def handle_incoming_on_close_wait(self, packet):
         # We should only process incoming ACKs and ignore everything else since
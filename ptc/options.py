@@ -0,0 +1,94 @@
+import struct
+
+
+# PTC header options. They are encoded as in TCP: a kind byte, followed,
+# except for END and NOP, by a length byte covering the whole option and the
+# option value. Options come right after the header, padded to a whole
+# number of 32-bit words, and the amount of words goes in the upper four
+# bits of the flags field.
+
+END = 0
+NOP = 1
+MSS = 2
+SACK_PERMITTED = 4
+SACK = 5
+
+KIND_AND_LENGTH = struct.Struct('!BB')
+MSS_OPTION = struct.Struct('!BBH')
+# Each SACK block is the sequence number of its first byte followed by the
+# one right after its last byte.
+SACK_BLOCK = struct.Struct('!II')
+
+WORD_SIZE = 4
+# At most 15 words fit in the flags field.
+MAX_SIZE = 15 * WORD_SIZE
+MAX_SACK_BLOCKS = (MAX_SIZE - KIND_AND_LENGTH.size) / SACK_BLOCK.size
+
+
+def pad(options):
+    return options + chr(END) * (-len(options) % WORD_SIZE)
+
+
+def find(options, kind):
+    # Return the offset and length of the value of the first option of the
+    # given kind, or None if there is none. options may be any buffer.
+    offset = 0
+    size = len(options)
+    while offset < size:
+        option_kind = struct.unpack_from('!B', options, offset)[0]
+        if option_kind == END:
+            break
+        if option_kind == NOP:
+            offset += 1
+            continue
+        if offset + KIND_AND_LENGTH.size > size:
+            break
+        _, length = KIND_AND_LENGTH.unpack_from(options, offset)
+        if length < KIND_AND_LENGTH.size or offset + length > size:
+            # Malformed: ignore the rest.
+            break
+        if option_kind == kind:
+            return offset + KIND_AND_LENGTH.size,\
+                   length - KIND_AND_LENGTH.size
+        offset += length
+    return None
+
+
+def encode_mss(mss):
+    return MSS_OPTION.pack(MSS, MSS_OPTION.size, mss)
+
+
+def decode_mss(options):
+    found = find(options, MSS)
+    if found is None or found[1] != 2:
+        return None
+    return struct.unpack_from('!H', options, found[0])[0]
+
+
+def encode_sack_permitted():
+    return KIND_AND_LENGTH.pack(SACK_PERMITTED, KIND_AND_LENGTH.size)
+
+
+def decode_sack_permitted(options):
+    found = find(options, SACK_PERMITTED)
+    return found is not None and found[1] == 0
+
+
+def encode_sack(blocks):
+    # Only the first MAX_SACK_BLOCKS blocks given fit in the header.
+    blocks = blocks[:MAX_SACK_BLOCKS]
+    length = KIND_AND_LENGTH.size + len(blocks) * SACK_BLOCK.size
+    return KIND_AND_LENGTH.pack(SACK, length) +\
+           ''.join(SACK_BLOCK.pack(seq_lo, seq_hi)
+                   for seq_lo, seq_hi in blocks)
+
+
+def decode_sack(options):
+    # Return the SACK blocks as a list of (first SEQ, next SEQ) pairs, empty
+    # if there are none.
+    found = find(options, SACK)
+    if found is None or found[1] % SACK_BLOCK.size != 0:
+        return list()
+    offset, length = found
+    return [SACK_BLOCK.unpack_from(options, offset + index)
+            for index in range(0, length, SACK_BLOCK.size)]
@@ -2,183 +2,140 @@ import random
 import struct
 import socket
 
-from constants import PROTOCOL_NUMBER, MAX_WND
-from seqnum import SequenceNumber
+from checksum import IPChecksumAlgorithm
+from constants import PROTOCOL_NUMBER, MAX_WND, NULL_ADDRESS, ECN_MASK
+import options
+import serialnum
 
 
-class IPChecksumAlgorithm(object):
-    # Naive, inefficient implementation of the Internet checksum algorithm.
+class PacketRepresentationMixin(object):
     
-    @classmethod
-    def for_bytes(cls, message):
-        return cls(message)
-        
-    def __init__(self, message):
-        self.message = message
-        
-    def has_odd_length(self, message):
-        return len(message) % 2 == 1
-        
-    def value(self):
-        message = self.message
-        value = 0
-        
-        if self.has_odd_length(message):
-            message += '\0'
-        
-        for i in range(0, len(message), 2):
-            word = (ord(message[i]) << 8) + (ord(message[i+1]))
-            value += word
-        
-        high_part = value >> 16
-        low_part = value & 0xffff
-        while high_part > 0:
-            value = high_part + low_part
-            high_part = value >> 16
-            low_part = value & 0xffff
-        
-        value = ~value & 0xffff
-        
-        return value
+    __slots__ = []
+    
+    def __repr__(self):
+        template = 'From: %s\nTo: %s\nSeq: %d\nAck: %d\nFlags: %s\nWindow: %s\nPayload: %s'
+        from_field = '(%s, %d)' % (self.get_source_ip(),
+                                   self.get_source_port())
+        destination_field = '(%s, %d)' % (self.get_destination_ip(),
+                                          self.get_destination_port())
+        flags = ', '.join(map(lambda flag: flag.name(), self.get_flags()))
+        if not flags:
+            flags = '<none>'
+        seq = self.get_seq_number()
+        ack = self.get_ack_number()
+        window = self.get_window_size()
+        payload = self.get_payload()
+        if isinstance(payload, memoryview):
+            payload = payload.tobytes()
+        if not payload:
+            payload = '<none>'
+        return template % (from_field, destination_field, seq, ack, flags,
+                           window, payload)
+    
+    def get_ecn(self):
+        # ECN codepoint of the IP header (see constants).
+        return self.get_type_of_service() & ECN_MASK
 
 
-class PTCNetworkPacket(object):
+class PTCPacket(PacketRepresentationMixin):
+    # A PTC segment together with its IP header, flattened into a single
+    # slotted object with plain-int fields. Retransmission queues may hold
+    # thousands of these per connection.
+    
+    __slots__ = ['source_ip', 'destination_ip', 'type_of_service',
+                 'id_number', 'source_port', 'destination_port',
+                 'seq_number', 'ack_number', 'flags', 'window_size',
+                 'options', 'payload', 'cached_bytes']
+    
+    # IP header fields that never change.
+    VERSION = 4
+    IP_HEADER_LENGTH = 5
+    IP_HEADER_SIZE = 4 * IP_HEADER_LENGTH
+    # Don't fragment.
+    FRAGMENTATION_WORD = 1 << 14
+    TIME_TO_LIVE = 255
+    PROTOCOL = PROTOCOL_NUMBER
+    CHECKSUM_OFFSET = 10
+    
+    HEADER_SIZE = 16
+    # The upper bits of the flags field hold the size of the options, in
+    # 32-bit words (see options).
+    FLAGS_MASK = 0x0fff
+    OPTIONS_SHIFT = 12
     
     def __init__(self):
-        self.source_ip = '0.0.0.0'
-        self.destination_ip = '0.0.0.0'
-        self.version = 4
-        self.header_length = 5
+        self.source_ip = NULL_ADDRESS
+        self.destination_ip = NULL_ADDRESS
         self.type_of_service = 0
-        self.total_length = 4*self.header_length
         self.id_number = random.randint(0, 2**16 - 1)
-        dont_fragment = 1
-        self.fragmentation_word = (dont_fragment << 14)
-        self.time_to_live = 255
-        self.protocol = PROTOCOL_NUMBER
-        self.payload = None
-        self.update_checksum()
+        self.source_port = 0
+        self.destination_port = 0
+        self.seq_number = 0
+        self.ack_number = 0
+        # Flags are kept as a bitmask.
+        self.flags = 0
+        self.window_size = 0
+        # Encoded options, already padded.
+        self.options = str()
+        self.payload = str()
+        # Serialized form of the whole datagram. It is built (and the checksum
+        # computed) lazily, the first time the bytes are requested, and reused
+        # until some field changes.
+        self.cached_bytes = None
+        
+    @classmethod
+    def from_template(cls, template, packet_bytes, payload, flags_bits, seq,
+                      ack, window, type_of_service=0):
+        # Build a packet out of a connection header template (see
+        # PacketTemplate) and the bytes it already produced. Fields are
+        # assigned directly since the serialized form is known in advance.
+        packet = cls.__new__(cls)
+        packet.source_ip = template.source_address
+        packet.destination_ip = template.destination_address
+        packet.type_of_service = type_of_service
+        packet.id_number = template.ID_NUMBER
+        packet.source_port = template.source_port
+        packet.destination_port = template.destination_port
+        packet.seq_number = seq
+        packet.ack_number = ack
+        packet.flags = flags_bits
+        packet.window_size = window
+        packet.options = str()
+        packet.payload = payload
+        packet.cached_bytes = packet_bytes
+        return packet
+        
+    def copy(self):
+        packet = self.__class__.__new__(self.__class__)
+        for slot in self.__slots__:
+            setattr(packet, slot, getattr(self, slot))
+        return packet
         
+    def __contains__(self, element):
+        return self.flags & getattr(element, 'BITS', 0) > 0
+    
     def get_source_ip(self):
         return self.source_ip
     
     def get_destination_ip(self):
-        return self.destination_ip    
-    
-    def get_version(self):
-        return self.version
-    
-    def get_header_length(self):
-        return self.header_length
+        return self.destination_ip
     
     def get_type_of_service(self):
         return self.type_of_service
     
-    def get_total_length(self):
-        return self.total_length
-    
     def get_id_number(self):
         return self.id_number
     
     def get_time_to_live(self):
-        return self.time_to_live
+        return self.TIME_TO_LIVE
     
-    def get_protocol(self):
-        return self.protocol
+    def get_length(self):
+        return self.IP_HEADER_SIZE + self.HEADER_SIZE + len(self.options) +\
+               len(self.payload)
     
     def get_checksum(self):
-        return self.checksum
-    
-    def get_fragmentation_word(self):
-        return self.fragmentation_word
-    
-    def get_payload(self):
-        return self.payload
-    
-    def set_source_ip(self, ip):
-        self.source_ip = ip
-        self.update_checksum()
-        
-    def set_destination_ip(self, ip):
-        self.destination_ip = ip
-        self.update_checksum()
-    
-    def set_version(self, version):
-        self.version = version
-        self.update_checksum()
-    
-    def set_header_length(self, length):
-        self.header_length = length
-        self.update_checksum()
-    
-    def set_type_of_service(self, type_of_service):
-        self.type_of_service = type_of_service
-        self.update_checksum()
-    
-    def add_length(self, length):
-        self.total_length += length
-        self.update_checksum()
-    
-    def set_id_number(self, id_number):
-        self.id_number = id_number
-        self.update_checksum()
-    
-    def set_time_to_live(self, time_to_live):
-        self.time_to_live = time_to_live
-        self.update_checksum()
-    
-    def set_protocol(self, protocol):
-        self.protocol = protocol
-        self.update_checksum()
-    
-    def set_fragmentation_word(self, fragmentation_word):
-        self.fragmentation_word = fragmentation_word
-        self.update_checksum()
-        
-    def set_payload(self, payload):
-        self.payload = payload
-        length = len(payload.get_bytes())
-        self.add_length(length)
-        self.payload.set_parent(self)
-    
-    def update_checksum(self):
-        self.checksum = 0
-        header_bytes = self.get_bytes()
-        updated_checksum = IPChecksumAlgorithm.for_bytes(header_bytes).value()
-        self.checksum = updated_checksum
-        
-    def get_bytes(self):
-        source_ip = socket.inet_aton(self.source_ip)
-        destination_ip = socket.inet_aton(self.destination_ip)        
-        header_length_plus_version = (self.version << 4) + self.header_length
-        payload_bytes = str()
-        if self.payload is not None:
-            payload_bytes = self.payload.get_bytes()
-        header_bytes = struct.pack('!BBHHHBBH4s4s', header_length_plus_version,
-                            self.type_of_service, self.total_length,
-                            self.id_number, self.fragmentation_word,
-                            self.time_to_live, self.protocol, self.checksum,
-                            source_ip, destination_ip)
-        return header_bytes + payload_bytes
-    
-
-class PTCTransportPacket(object):
-    
-    def __init__(self):
-        self.source_port = 0
-        self.destination_port = 0
-        self.seq_number = SequenceNumber(0)
-        self.ack_number = SequenceNumber(0)
-        self.window_size = 0
-        self.flags = set()
-        self.payload = str()
-        self.parent = None
-        
-    def __contains__(self, element):
-        flag_contained = element in PTCFlag.__subclasses__() and\
-                         element in self.get_flags()
-
-        return flag_contained   
+        return struct.unpack_from('!H', self.get_bytes(),
+                                  self.CHECKSUM_OFFSET)[0]
         
     def get_source_port(self):
         return self.source_port
@@ -190,10 +147,10 @@ class PTCTransportPacket(object):
         return self.seq_number
     
     def get_seq_interval(self):
-        seq_lo = self.seq_number.clone()
-        seq_hi = seq_lo + len(self.payload)
+        seq_lo = self.seq_number
+        seq_hi = serialnum.add(seq_lo, len(self.payload))
         return seq_lo, seq_hi
-
+    
     def get_ack_number(self):
         return self.ack_number
     
@@ -201,167 +158,247 @@ class PTCTransportPacket(object):
         return self.window_size
     
     def get_payload(self):
-        return self.payload
+        # Segments built in bulk keep their payload as a memoryview over the
+        # send buffer (see PacketTemplate.build_data_packets).
+        payload = self.payload
+        if isinstance(payload, memoryview):
+            return payload.tobytes()
+        return payload
+    
+    def get_payload_size(self):
+        return len(self.payload)
+    
+    def get_options(self):
+        return self.options
+    
+    def get_mss(self):
+        # MSS announced by the option, if present.
+        return options.decode_mss(self.options)
+    
+    def get_sack_permitted(self):
+        return options.decode_sack_permitted(self.options)
     
-    def get_parent(self):
-        return self.parent
+    def get_sack_blocks(self):
+        return options.decode_sack(self.options)
     
     def get_flags(self):
+        return PTCFlag.flags_for(self.flags)
+    
+    def get_flags_bits(self):
         return self.flags
     
     def add_flag(self, flag):
-        self.flags.add(flag)
+        self.flags |= flag.BITS
+        self.cached_bytes = None
         
     def add_flags(self, flags):
-        self.flags.update(flags)
+        self.flags |= PTCFlag.bits_for(flags)
+        self.cached_bytes = None
+        
+    def set_flags_bits(self, flags_bits):
+        self.flags = flags_bits
+        self.cached_bytes = None
+        
+    def set_source_ip(self, ip):
+        self.source_ip = ip
+        self.cached_bytes = None
+        
+    def set_destination_ip(self, ip):
+        self.destination_ip = ip
+        self.cached_bytes = None
+        
+    def set_type_of_service(self, type_of_service):
+        self.type_of_service = type_of_service
+        self.cached_bytes = None
+        
+    def set_id_number(self, id_number):
+        self.id_number = id_number
+        self.cached_bytes = None
     
     def set_source_port(self, port):
         self.source_port = port
+        self.cached_bytes = None
         
     def set_destination_port(self, port):
-        self.destination_port = port          
+        self.destination_port = port
+        self.cached_bytes = None
     
     def set_seq_number(self, seq_number):
-        self.seq_number = SequenceNumber(seq_number)
+        self.seq_number = serialnum.normalize(seq_number)
+        self.cached_bytes = None
         
     def set_ack_number(self, ack_number):
-        self.ack_number = SequenceNumber(ack_number)
+        self.ack_number = serialnum.normalize(ack_number)
+        self.cached_bytes = None
         
     def set_window_size(self, window_size):
         self.window_size = window_size % (MAX_WND+1)
-        
+        self.cached_bytes = None
+    
     def set_payload(self, data):
         self.payload = data
-        if self.parent is not None:
-            length_difference = len(data) - len(self.payload)
-            self.parent.add_length(length_difference)
+        self.cached_bytes = None
         
-    def set_parent(self, parent):
-        self.parent = parent
+    def set_options(self, options_bytes):
+        options_bytes = options.pad(options_bytes)
+        if len(options_bytes) > options.MAX_SIZE:
+            raise ValueError('options too long: %d bytes' % len(options_bytes))
+        self.options = options_bytes
+        self.cached_bytes = None
         
-    def has_payload(self):
-        return len(self.payload) > 0        
+    def get_ip_header_bytes(self, checksum=0):
+        source_ip = socket.inet_aton(self.source_ip)
+        destination_ip = socket.inet_aton(self.destination_ip)        
+        header_length_plus_version = (self.VERSION << 4) +\
+                                     self.IP_HEADER_LENGTH
+        return struct.pack('!BBHHHBBH4s4s', header_length_plus_version,
+                           self.type_of_service, self.get_length(),
+                           self.id_number, self.FRAGMENTATION_WORD,
+                           self.TIME_TO_LIVE, self.PROTOCOL, checksum,
+                           source_ip, destination_ip)
+    
+    def get_transport_header_bytes(self):
+        option_words = len(self.options) / options.WORD_SIZE
+        flags_word = self.flags | (option_words << self.OPTIONS_SHIFT)
+        return struct.pack('!HHLLHH', self.source_port,
+                                      self.destination_port, 
+                                      self.seq_number,
+                                      self.ack_number,
+                                      flags_word,
+                                      self.window_size) + self.options
+        
+    def get_transport_bytes(self):
+        return self.get_transport_header_bytes() + self.get_payload()
         
     def get_bytes(self):
-        flags_bytes = reduce(lambda value, flag: value ^ flag.get_bits(),
-                             self.flags, 0)
-        header_bytes = struct.pack('!HHLLHH', self.source_port,
-                                              self.destination_port, 
-                                              self.seq_number,
-                                              self.ack_number,
-                                              flags_bytes,
-                                              self.window_size)
-        
-        
-        return header_bytes + self.payload
+        if self.cached_bytes is None:
+            # As in RFC 791, the checksum covers the IP header only. This is
+            # also what the kernel fills in when sending through IP_HDRINCL
+            # sockets.
+            header_bytes = self.get_ip_header_bytes()
+            checksum = IPChecksumAlgorithm.for_bytes(header_bytes).value()
+            header_bytes = self.get_ip_header_bytes(checksum)
+            self.cached_bytes = header_bytes + self.get_transport_bytes()
+        return self.cached_bytes
     
+    def has_payload(self):
+        return len(self.payload) > 0
     
-class PTCPacket(object):
     
-    SEQ_SIZE = 2
-    ACK_SIZE = 2
+class PTCPacketView(PacketRepresentationMixin):
+    # Read-only, lazily parsed packet over a memoryview of the bytes received.
+    # Header fields are unpacked on demand and the payload is a zero-copy
+    # slice of the buffer, so that packets that are discarded early cost
+    # next to nothing. It provides the same getters as PTCPacket.
     
-    def __init__(self):
-        self.transport_packet = PTCTransportPacket()
-        self.network_packet = PTCNetworkPacket()
-        self.network_packet.set_payload(self.transport_packet)
+    __slots__ = ['buffer', 'transport_offset']
+    
+    def __init__(self, buffer):
+        self.buffer = buffer
+        ihl_byte = struct.unpack_from('!B', buffer, 0)[0]
+        self.transport_offset = 4 * (ihl_byte & 0x0f)
+        
+    def copy(self):
+        # A view over a private copy of the bytes, for packets that must
+        # outlive the buffer they were received on.
+        return self.__class__(memoryview(self.buffer.tobytes()))
         
     def __contains__(self, element):
-        return self.transport_packet.__contains__(element)
+        return self.get_flags_bits() & getattr(element, 'BITS', 0) > 0
+    
+    def get_ip_from_offset(self, offset):
+        ip_bytes = struct.unpack_from('!4s', self.buffer, offset)[0]
+        return socket.inet_ntoa(ip_bytes)
     
     def get_source_ip(self):
-        return self.network_packet.get_source_ip()
+        return self.get_ip_from_offset(12)
     
     def get_destination_ip(self):
-        return self.network_packet.get_destination_ip()
+        return self.get_ip_from_offset(16)
+    
+    def get_type_of_service(self):
+        return struct.unpack_from('!B', self.buffer, 1)[0]
     
     def get_length(self):
-        return self.network_packet.get_total_length()
-        
+        return struct.unpack_from('!H', self.buffer, 2)[0]
+    
     def get_source_port(self):
-        return self.transport_packet.get_source_port()
+        return struct.unpack_from('!H', self.buffer, self.transport_offset)[0]
     
     def get_destination_port(self):
-        return self.transport_packet.get_destination_port()
+        return struct.unpack_from('!H', self.buffer,
+                                  self.transport_offset + 2)[0]
         
     def get_seq_number(self):
-        return self.transport_packet.get_seq_number()
+        return struct.unpack_from('!L', self.buffer,
+                                  self.transport_offset + 4)[0]
     
     def get_seq_interval(self):
-        return self.transport_packet.get_seq_interval()
+        seq_lo = self.get_seq_number()
+        seq_hi = serialnum.add(seq_lo, self.get_payload_size())
+        return seq_lo, seq_hi
     
     def get_ack_number(self):
-        return self.transport_packet.get_ack_number()
+        return struct.unpack_from('!L', self.buffer,
+                                  self.transport_offset + 8)[0]
     
-    def get_window_size(self):
-        return self.transport_packet.get_window_size()
+    def get_flags_word(self):
+        return struct.unpack_from('!H', self.buffer,
+                                  self.transport_offset + 12)[0]
     
-    def get_payload(self):
-        return self.transport_packet.get_payload()
+    def get_flags_bits(self):
+        return self.get_flags_word() & PTCPacket.FLAGS_MASK
+    
+    def get_options_size(self):
+        option_words = self.get_flags_word() >> PTCPacket.OPTIONS_SHIFT
+        return options.WORD_SIZE * option_words
+    
+    def get_options(self):
+        start = self.transport_offset + PTCPacket.HEADER_SIZE
+        return self.buffer[start:start+self.get_options_size()]
+    
+    def get_mss(self):
+        return options.decode_mss(self.get_options())
+    
+    def get_sack_permitted(self):
+        return options.decode_sack_permitted(self.get_options())
+    
+    def get_sack_blocks(self):
+        return options.decode_sack(self.get_options())
     
     def get_flags(self):
-        return self.transport_packet.get_flags()
+        return PTCFlag.flags_for(self.get_flags_bits())
     
-    def add_flag(self, flag):
-        self.transport_packet.add_flag(flag)
-        
-    def add_flags(self, flags):
-        self.transport_packet.add_flags(flags)
-        
-    def set_source_ip(self, ip):
-        self.network_packet.set_source_ip(ip)
-        
-    def set_destination_ip(self, ip):
-        self.network_packet.set_destination_ip(ip)          
+    def get_window_size(self):
+        return struct.unpack_from('!H', self.buffer,
+                                  self.transport_offset + 14)[0]
     
-    def set_source_port(self, port):
-        self.transport_packet.set_source_port(port)
-        
-    def set_destination_port(self, port):
-        self.transport_packet.set_destination_port(port)
+    def get_payload_offset(self):
+        return self.transport_offset + PTCPacket.HEADER_SIZE +\
+               self.get_options_size()
     
-    def set_seq_number(self, seq_number):
-        self.transport_packet.set_seq_number(seq_number)
-        
-    def set_ack_number(self, ack_number):
-        self.transport_packet.set_ack_number(ack_number)
-        
-    def set_window_size(self, window_size):
-        self.transport_packet.set_window_size(window_size)
+    def get_payload(self):
+        return self.buffer[self.get_payload_offset():]
+    
+    def get_payload_size(self):
+        return len(self.buffer) - self.get_payload_offset()
     
-    def set_payload(self, data):
-        self.transport_packet.set_payload(data)
-        
     def get_bytes(self):
-        return self.network_packet.get_bytes()
+        return self.buffer
     
     def has_payload(self):
-        return self.transport_packet.has_payload()    
-    
-    def __repr__(self):
-        template = 'From: %s\nTo: %s\nSeq: %d\nAck: %d\nFlags: %s\nWindow: %s\nPayload: %s'
-        from_field = '(%s, %d)' % (self.get_source_ip(),
-                                   self.get_source_port())
-        destination_field = '(%s, %d)' % (self.get_destination_ip(),
-                                          self.get_destination_port())
-        flags = ', '.join(map(lambda flag: flag.name(), self.get_flags()))
-        if not flags:
-            flags = '<none>'
-        seq = self.get_seq_number()
-        ack = self.get_ack_number()
-        window = self.get_window_size()
-        payload = self.get_payload()
-        if not payload:
-            payload = '<none>'
-        return template % (from_field, destination_field, seq, ack, flags,
-                           window, payload)
+        return len(self.buffer) > self.get_payload_offset()
     
     
 class PTCFlag(object):
+    # Flags are classes identified by their bit within the flags field of
+    # the header. Packets store the bitmask only.
+    
+    BITS = 0
     
     @classmethod
-    def get_bits(self):
-        raise NotImplementedError
+    def get_bits(cls):
+        return cls.BITS
     
     @classmethod
     def __hash__(self):
@@ -375,37 +412,52 @@ class PTCFlag(object):
     def name(cls):
         return cls.__name__[:-4]   
     
+    @classmethod
+    def bits_for(cls, flags):
+        flags_bits = 0
+        for flag in flags:
+            flags_bits |= flag.BITS
+        return flags_bits
+    
+    @classmethod
+    def flags_for(cls, flags_bits):
+        return set(flag for flag in cls.__subclasses__()
+                   if flag.BITS & flags_bits > 0)
+    
 
 class FINFlag(PTCFlag):
     
-    @classmethod
-    def get_bits(self):
-        return 0x1
+    BITS = 0x1
     
 
 class SYNFlag(PTCFlag):
     
-    @classmethod
-    def get_bits(self):
-        return 0x2
+    BITS = 0x2
 
 
 class RSTFlag(PTCFlag):
     
-    @classmethod
-    def get_bits(self):
-        return 0x4
+    BITS = 0x4
     
     
 class NDTFlag(PTCFlag):
     
-    @classmethod
-    def get_bits(self):
-        return 0x8
+    BITS = 0x8
     
     
 class ACKFlag(PTCFlag):
     
-    @classmethod
-    def get_bits(self):
-        return 0x10            
\ No newline at end of file
+    BITS = 0x10
+    
+    
+class ECEFlag(PTCFlag):
+    # ECN echo: congestion was experienced (see
+    # ExplicitCongestionNotification).
+    
+    BITS = 0x20
+    
+    
+class CWRFlag(PTCFlag):
+    # Congestion window reduced, in response to ECE.
+    
+    BITS = 0x40
\ No newline at end of file
@@ -1,43 +1,163 @@
 import struct
 import socket
 
-from packet import PTCPacket, PTCFlag
+from checksum import IPChecksumAlgorithm
+from exceptions import ChecksumError
+from constants import MAX_WND, ECT
+from packet import PTCPacket, PTCPacketView, PTCFlag
+import serialnum
+
+
+class PacketTemplate(object):
+    # IP and PTC headers of a connection packed once. Addresses, ports,
+    # protocol and TTL never change within a connection, so building a
+    # segment just copies these bytes and patches SEQ, ACK, flags and window
+    # (plus total length and checksum when there is payload).
+    
+    # The IP ID is meaningless since DF is always set; the kernel fills in
+    # zero IDs anyway.
+    ID_NUMBER = 0
+    HEADER_SIZE = 36
+    TOTAL_LENGTH_OFFSET = 2
+    CHECKSUM_OFFSET = 10
+    SEQ_NUMBER_OFFSET = 24
+    
+    def __init__(self, source_address, source_port, destination_address,
+                 destination_port):
+        self.source_address = source_address
+        self.source_port = source_port
+        self.destination_address = destination_address
+        self.destination_port = destination_port
+        packet = PTCPacket()
+        packet.set_source_ip(source_address)
+        packet.set_destination_ip(destination_address)
+        packet.set_source_port(source_port)
+        packet.set_destination_port(destination_port)
+        packet.set_id_number(self.ID_NUMBER)
+        self.header = bytearray(packet.get_bytes())
+        self.checksum = packet.get_checksum()
+        # Same, for data segments sent as ECN-capable.
+        packet.set_type_of_service(ECT)
+        self.ect_header = bytearray(packet.get_bytes())
+        self.ect_checksum = packet.get_checksum()
+        
+    def build(self, payload=None, flags=None, seq=None, ack=None,
+              window=None, options=None):
+        if options:
+            # Only SYN segments and ACKs reporting out-of-order data (see
+            # PTCProtocol.build_sack_option) carry options, so these are built
+            # the usual way.
+            return self.build_with_options(payload, flags, seq, ack, window,
+                                           options)
+        seq = serialnum.normalize(seq or 0)
+        ack = serialnum.normalize(ack or 0)
+        window = (window or 0) % (MAX_WND+1)
+        flags_bits = PTCFlag.bits_for(flags or list())
+        if payload:
+            packet_bytes = self.get_data_bytes(payload)
+        else:
+            # Pure ACKs and window updates: the IP header, checksum included,
+            # is used untouched.
+            payload = str()
+            packet_bytes = bytearray(self.header)
+        struct.pack_into('!LLHH', packet_bytes, self.SEQ_NUMBER_OFFSET, seq,
+                         ack, flags_bits, window)
+        return PTCPacket.from_template(self, packet_bytes, payload, flags_bits,
+                                       seq, ack, window)
+    
+    def build_data_packets(self, segments, flags=None, ack=None,
+                           window=None, ect=False):
+        # Build a data segment for each (SEQ, payload) pair, all of them
+        # sharing the rest of the fields. Payloads may be memoryviews: they
+        # are copied just once, into the datagram. If ect is True, they are
+        # marked as ECN-capable.
+        ack = serialnum.normalize(ack or 0)
+        window = (window or 0) % (MAX_WND+1)
+        flags_bits = PTCFlag.bits_for(flags or list())
+        type_of_service = ECT if ect else 0
+        seq_number_offset = self.SEQ_NUMBER_OFFSET
+        from_template = PTCPacket.from_template
+        packets = list()
+        for seq, payload in segments:
+            packet_bytes = self.get_data_bytes(payload, ect)
+            struct.pack_into('!LLHH', packet_bytes, seq_number_offset, seq,
+                             ack, flags_bits, window)
+            packets.append(from_template(self, packet_bytes, payload,
+                                         flags_bits, seq, ack, window,
+                                         type_of_service))
+        return packets
+    
+    def get_data_bytes(self, payload, ect=False):
+        # Header followed by payload, with total length and checksum
+        # patched.
+        if ect:
+            header, checksum = self.ect_header, self.ect_checksum
+        else:
+            header, checksum = self.header, self.checksum
+        packet_bytes = header + payload
+        length = len(packet_bytes)
+        checksum = IPChecksumAlgorithm.update_word(checksum,
+                                                   self.HEADER_SIZE, length)
+        struct.pack_into('!H', packet_bytes, self.TOTAL_LENGTH_OFFSET, length)
+        struct.pack_into('!H', packet_bytes, self.CHECKSUM_OFFSET, checksum)
+        return packet_bytes
+    
+    def build_with_options(self, payload, flags, seq, ack, window, options):
+        packet = PTCPacket()
+        packet.set_source_ip(self.source_address)
+        packet.set_destination_ip(self.destination_address)
+        packet.set_source_port(self.source_port)
+        packet.set_destination_port(self.destination_port)
+        packet.set_id_number(self.ID_NUMBER)
+        packet.set_seq_number(seq or 0)
+        packet.set_ack_number(ack or 0)
+        packet.set_window_size(window or 0)
+        packet.add_flags(flags or list())
+        packet.set_options(options)
+        packet.set_payload(payload or str())
+        return packet
 
 
 class PacketBuilder(object):
+    
+    def __init__(self):
+        self.template = None
 
     def set_source_address(self, address):
         self.source_address = address
+        self.template = None
         
     def set_destination_port(self, port):
         self.destination_port = port
+        self.template = None
         
     def set_source_port(self, port):
         self.source_port = port
+        self.template = None
         
     def set_destination_address(self, address):
         self.destination_address = address                        
+        self.template = None
         
-    def build(self, payload=None, flags=None, seq=None, ack=None, window=None):
-        packet = PTCPacket()
-
-        packet.set_source_ip(self.source_address)
-        packet.set_destination_ip(self.destination_address)
-        packet.set_source_port(self.source_port)
-        packet.set_destination_port(self.destination_port)
-        
-        if payload is not None:
-            packet.set_payload(payload)
-        if flags is not None:
-            packet.add_flags(flags)
-        if seq is not None:
-            packet.set_seq_number(seq)
-        if ack is not None:
-            packet.set_ack_number(ack)
-        if window is not None:
-            packet.set_window_size(window)       
+    def get_template(self):
+        if self.template is None:
+            self.template = PacketTemplate(self.source_address,
+                                           self.source_port,
+                                           self.destination_address,
+                                           self.destination_port)
+        return self.template
         
-        return packet   
+    def build(self, payload=None, flags=None, seq=None, ack=None, window=None,
+              options=None):
+        template = self.get_template()
+        return template.build(payload=payload, flags=flags, seq=seq, ack=ack,
+                              window=window, options=options)
+    
+    def build_data_packets(self, segments, flags=None, ack=None,
+                           window=None, ect=False):
+        template = self.get_template()
+        return template.build_data_packets(segments, flags=flags, ack=ack,
+                                           window=window, ect=ect)
     
     
 class PacketDecoder(object):
@@ -45,6 +165,7 @@ class PacketDecoder(object):
     SOURCE_IP_OFFSET = 12
     DESTINATION_IP_OFFSET = 16
     IP_HEADER_LENGTH_OFFSET = 0
+    TYPE_OF_SERVICE_OFFSET = 1
     
     SOURCE_PORT_OFFSET = 0
     DESTINATION_PORT_OFFSET = 2
@@ -55,32 +176,55 @@ class PacketDecoder(object):
     
     PTC_HEADER_DWORDS = 4
     
+    def __init__(self, verify_checksum=False):
+        self.verify_checksum = verify_checksum
+    
     def decode(self, packet_bytes):
+        if self.verify_checksum and\
+           not self.checksum_is_valid_on(packet_bytes):
+            raise ChecksumError('invalid IP header checksum')
         packet = PTCPacket()        
         source_ip = self.decode_source_ip_on(packet_bytes)
         destination_ip = self.decode_destination_ip_on(packet_bytes)
+        type_of_service = self.decode_type_of_service_on(packet_bytes)
         
         transport_bytes = self.get_transport_packet_bytes_from(packet_bytes)
         source_port = self.decode_source_port_on(transport_bytes)
         destination_port = self.decode_destination_port_on(transport_bytes)
         seq_number = self.decode_seq_number_on(transport_bytes)
         ack_number = self.decode_ack_number_on(transport_bytes)
-        flags = self.decode_flags_on(transport_bytes)
+        flags_bits = self.get_flags_bits_on(transport_bytes)
         window_size = self.decode_window_size_on(transport_bytes)
+        options = self.decode_options_on(transport_bytes)
         data = self.decode_data_on(transport_bytes)
 
         packet.set_source_ip(source_ip)
         packet.set_destination_ip(destination_ip)        
+        packet.set_type_of_service(type_of_service)
         packet.set_source_port(source_port)
         packet.set_destination_port(destination_port)
         packet.set_seq_number(seq_number)
         packet.set_ack_number(ack_number)
-        packet.add_flags(flags)
+        packet.set_flags_bits(flags_bits)
         packet.set_window_size(window_size)
+        packet.set_options(options)
         packet.set_payload(data)
         
         return packet
     
+    def view(self, packet_bytes):
+        # Wrap the bytes in a lazily parsed PTCPacketView instead of decoding
+        # every field up front.
+        if self.verify_checksum and\
+           not self.checksum_is_valid_on(packet_bytes):
+            raise ChecksumError('invalid IP header checksum')
+        return PTCPacketView(memoryview(packet_bytes))
+    
+    def checksum_is_valid_on(self, packet_bytes):
+        ip_header_length = self.decode_ip_header_length_on(packet_bytes)
+        header_bytes = packet_bytes[:4*ip_header_length]
+        return IPChecksumAlgorithm.is_valid(header_bytes)
+    
     def decode_source_ip_on(self, packet_bytes):
         return self.decode_ip_from_offset(packet_bytes, self.SOURCE_IP_OFFSET)
     
@@ -88,8 +232,12 @@ class PacketDecoder(object):
         return self.decode_ip_from_offset(packet_bytes,
                                          self.DESTINATION_IP_OFFSET)
         
+    def decode_type_of_service_on(self, packet_bytes):
+        return struct.unpack_from('!B', packet_bytes,
+                                  self.TYPE_OF_SERVICE_OFFSET)[0]
+        
     def decode_ip_from_offset(self, packet_bytes, ip_offset):
-        ip_bytes = packet_bytes[ip_offset:ip_offset+4]
+        ip_bytes = struct.unpack_from('!4s', packet_bytes, ip_offset)[0]
         return socket.inet_ntoa(ip_bytes)
     
     def get_transport_packet_bytes_from(self, packet_bytes):
@@ -118,29 +266,38 @@ class PacketDecoder(object):
         
     def decode_flags_on(self, packet_bytes):
         flags_bits = self.get_flags_bits_on(packet_bytes)
-        flags = PTCFlag.__subclasses__()
-        packet_flags = filter(lambda flag: flag.get_bits() & flags_bits > 0,
-                              flags)
-        return packet_flags
+        return PTCFlag.flags_for(flags_bits)
     
-    def get_flags_bits_on(self, packet_bytes):
+    def get_flags_word_on(self, packet_bytes):
         return self.decode_short_from_offset(packet_bytes,
                                             self.FLAGS_OFFSET)
     
+    def get_flags_bits_on(self, packet_bytes):
+        return self.get_flags_word_on(packet_bytes) & PTCPacket.FLAGS_MASK
+    
+    def get_options_size_on(self, packet_bytes):
+        option_words = self.get_flags_word_on(packet_bytes) >>\
+                       PTCPacket.OPTIONS_SHIFT
+        return 4 * option_words
+    
+    def decode_options_on(self, packet_bytes):
+        start = 4 * self.PTC_HEADER_DWORDS
+        return packet_bytes[start:start+self.get_options_size_on(packet_bytes)]
+    
     def decode_data_on(self, packet_bytes):
-        return packet_bytes[4*self.PTC_HEADER_DWORDS:]
+        start = 4 * self.PTC_HEADER_DWORDS
+        return packet_bytes[start+self.get_options_size_on(packet_bytes):]
     
     def decode_ip_header_length_on(self, packet_bytes):
-        ihl_byte = packet_bytes[self.IP_HEADER_LENGTH_OFFSET]
-        header_length = struct.unpack('!B', ihl_byte)[0] & 0x0f
+        ihl_byte = struct.unpack_from('!B', packet_bytes,
+                                      self.IP_HEADER_LENGTH_OFFSET)[0]
+        header_length = ihl_byte & 0x0f
         return header_length
     
     def decode_short_from_offset(self, packet_bytes, offset):
-        number_bytes = packet_bytes[offset:offset+2]
-        number = struct.unpack('!H', number_bytes)[0]
+        number = struct.unpack_from('!H', packet_bytes, offset)[0]
         return number    
     
     def decode_long_from_offset(self, packet_bytes, offset):
-        number_bytes = packet_bytes[offset:offset+4]
-        number = struct.unpack('!L', number_bytes)[0]
+        number = struct.unpack_from('!L', packet_bytes, offset)[0]
         return number
\ No newline at end of file
@@ -0,0 +1,102 @@
+import threading
+
+from constants import MAX_MSS, BASE_MSS, PMTU_PROBE_INTERVAL,\
+                      PMTU_PROBE_GRANULARITY,\
+                      PMTU_BLACK_HOLE_RETRANSMISSIONS
+import serialnum
+
+
+# Packetization layer path MTU discovery, loosely following RFC 4821.
+class PathMTUDiscovery(object):
+    # Data segments are sent as large as the MSS negotiated on connection
+    # establishment allows (which already takes into account the MTU of the
+    # local route; see Soquete.get_mss_for). If a segment larger than
+    # BASE_MSS keeps timing out, the path is assumed to silently drop it for
+    # being too large (a black hole, e.g. when ICMP is filtered) and the
+    # segment size falls back to BASE_MSS.
+    # From then on, larger sizes are probed every now and then by a binary
+    # search between the current size and the largest one not known to
+    # fail. Probes are plain data segments of the size probed: if one is
+    # acknowledged, that size is taken; if it times out, it is split into
+    # segments of the current size before being retransmitted.
+
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.mss = MAX_MSS
+        # Sizes above this one are known not to go through.
+        self.search_high = MAX_MSS
+        # Size of the probe in flight, if any, and the sequence number that
+        # follows it.
+        self.probe_size = None
+        self.probe_end = None
+        self.segments_since_probe = 0
+        self.lock = threading.RLock()
+
+    def get_mss(self):
+        with self.lock:
+            return self.mss
+
+    def set_maximum(self, mss):
+        # Called with the MSS negotiated with the other end.
+        with self.lock:
+            self.mss = mss
+            self.search_high = mss
+            self.probe_size = None
+
+    def set_route_limit(self, mss):
+        # Called with a new limit imposed by the local route (e.g., after
+        # the kernel refused to send a datagram for being too large).
+        with self.lock:
+            self.mss = min(self.mss, mss)
+            self.search_high = min(self.search_high, mss)
+            if self.probe_size is not None and\
+               self.probe_size > self.search_high:
+                self.probe_size = None
+
+    def get_segment_size(self):
+        # Size of the next data segment: a probe, if one is due.
+        with self.lock:
+            if self.probe_size is None and\
+               self.segments_since_probe >= PMTU_PROBE_INTERVAL and\
+               self.search_high - self.mss > PMTU_PROBE_GRANULARITY:
+                return (self.mss + self.search_high + 1) / 2
+            return self.mss
+
+    def segments_sent(self, packets):
+        with self.lock:
+            for packet in packets:
+                size = packet.get_payload_size()
+                if size > self.mss:
+                    self.probe_size = size
+                    _, self.probe_end = packet.get_seq_interval()
+                    self.segments_since_probe = 0
+                elif self.probe_size is None and size == self.mss:
+                    # Only full segments count: there is no point in probing
+                    # while sending little data.
+                    self.segments_since_probe += 1
+
+    def process_ack(self, ack_number):
+        with self.lock:
+            if self.probe_size is not None and\
+               serialnum.leq(self.probe_end, ack_number):
+                self.mss = self.probe_size
+                self.probe_size = None
+
+    def process_timeout(self, size, retransmissions):
+        # Called when a segment carrying size bytes is about to be
+        # retransmitted for the given number of times in a row. Returns the
+        # size of the segments it should be retransmitted as.
+        with self.lock:
+            if size > self.mss:
+                # A lost probe, or a segment sent before lowering the size.
+                self.search_high = min(self.search_high, size - 1)
+                if self.probe_size is not None and\
+                   size >= self.probe_size:
+                    self.probe_size = None
+            elif size > BASE_MSS and\
+                 retransmissions >= PMTU_BLACK_HOLE_RETRANSMISSIONS:
+                self.search_high = size - 1
+                self.mss = BASE_MSS
+                self.probe_size = None
+                self.segments_since_probe = 0
+            return self.mss
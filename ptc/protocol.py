@@ -1,3 +1,5 @@
+import errno
+import socket
 import threading
 import random
 
@@ -7,64 +9,108 @@ from constants import CLOSED, ESTABLISHED, SYN_SENT,\
                       LISTEN, FIN_WAIT1, FIN_WAIT2,\
                       CLOSE_WAIT, LAST_ACK, CLOSING,\
                       SHUT_RD, SHUT_WR, SHUT_RDWR,\
-                      NO_WAIT,\
-                      MSS, MAX_SEQ, RECEIVE_BUFFER_SIZE,\
+                      NO_WAIT, DEFAULT_TRANSPORT,\
+                      MAX_MSS, MAX_SEQ, MAX_WND, RECEIVE_BUFFER_SIZE,\
+                      SEND_BUFFER_SIZE, REASSEMBLY_LIMIT, CLOCK_TICK,\
                       MAX_RETRANSMISSION_ATTEMPTS,\
-                      BOGUS_RTT_RETRANSMISSIONS
-from exceptions import PTCError
+                      BOGUS_RTT_RETRANSMISSIONS, DEFAULT_CONGESTION_CONTROL
+from congestion import get_congestion_control
+from demux import PacketDemultiplexer
+from ecn import ExplicitCongestionNotification
+from exceptions import PTCError, WouldBlockError
 from handler import IncomingPacketHandler
-from packet import ACKFlag, FINFlag, SYNFlag
+import options
+from packet import ACKFlag, FINFlag, SYNFlag, CWRFlag
 from packet_utils import PacketBuilder
-from rqueue import RetransmissionQueue
+from pmtu import PathMTUDiscovery
+from recovery import FastRecovery
+from rqueue import RetransmissionQueue, SentSegment
 from rto import RTOEstimator
-from seqnum import SequenceNumber
-from soquete import Soquete
-from thread import Clock, PacketSender, PacketReceiver
+from sack import SACKScoreboard
+import serialnum
+from thread import Clock, PacketSender
 from timer import RetransmissionTimer
 
 
 class PTCProtocol(object):
     
-    def __init__(self):
+    def __init__(self, transport=DEFAULT_TRANSPORT):
         self.state = CLOSED
         self.control_block = None
         self.packet_builder = PacketBuilder()
-        self.socket = Soquete()
+        # Incoming packets are handed over by the demultiplexer, whose
+        # socket is also used for sending. Which one depends on the
+        # transport and on whether we listen or connect, so it is picked
+        # when registering the endpoint.
+        self.transport = transport
+        self.demultiplexer = None
+        self.socket = None
+        self.address = None
+        self.port = None
+        self.destination_address = None
+        self.destination_port = None
+        # Largest segment we can take, announced on connection
+        # establishment. It depends on the route to the other end.
+        self.local_mss = MAX_MSS
         self.rcv_wnd = RECEIVE_BUFFER_SIZE
+        self.reassembly_limit = REASSEMBLY_LIMIT
+        self.send_buffer_size = SEND_BUFFER_SIZE
         self.iss = self.compute_iss()
         self.rqueue = RetransmissionQueue()
         self.read_stream_open = True
         self.write_stream_open = True
         self.packet_handler = IncomingPacketHandler(self)
         self.rto_estimator = RTOEstimator(self)
+        self.pmtu = PathMTUDiscovery(self)
+        self.fast_recovery = FastRecovery(self)
+        # SACK is used only if both ends permit it on connection
+        # establishment.
+        self.sack_enabled = False
+        self.scoreboard = SACKScoreboard(self)
+        self.ecn = ExplicitCongestionNotification(self)
+        self.set_congestion_control(DEFAULT_CONGESTION_CONTROL)
+        # Set when an ACK calls for retransmitting the earliest data not yet
+        # acknowledged, which the packet sender does next time it runs.
+        self.fast_retransmission_pending = False
         self.ticks = 0
         self.retransmissions = 0
         self.close_mode = NO_WAIT
         self.close_event = threading.Event()
+        # Packets received before the threads are started (e.g., between
+        # listen and accept) are held until then, just like the kernel would
+        # do on a socket of our own.
+        self.pending_packets = list()
+        self.handling_packets = False
+        self.incoming_lock = threading.RLock()
         self.initialize_threads()
         self.initialize_timers()
         
     def initialize_threads(self):
         self.packet_sender = PacketSender(self)
-        self.packet_receiver = PacketReceiver(self)
         self.clock = Clock(self)
     
     def initialize_timers(self):
         self.retransmission_timer = RetransmissionTimer(self)
         
     def start_threads(self):
-        self.packet_receiver.start()
         self.packet_sender.start()
         self.clock.start()
+        self.handle_pending_packets()
+        
+    def handle_pending_packets(self):
+        with self.incoming_lock:
+            self.handling_packets = True
+            pending_packets = self.pending_packets
+            self.pending_packets = list()
+            if pending_packets:
+                self.handle_incoming_batch(pending_packets)
         
     def stop_threads(self):
-        self.packet_receiver.stop()
         self.packet_sender.stop()
         self.packet_sender.notify()
         self.clock.stop()
         
     def join_threads(self):
-        self.packet_receiver.join()
         self.packet_sender.join()
         self.clock.join()
         
@@ -81,45 +127,96 @@ class PTCProtocol(object):
             self.connected_event.set()
     
     def compute_iss(self):
-        value = random.randint(0, MAX_SEQ)
-        return SequenceNumber(value)
+        return random.randint(0, MAX_SEQ)
         
     def initialize_control_block_from(self, packet):
         # +1 since the SYN flag is also sequenced. 
-        receive_seq = 1 + packet.get_seq_number()
-        send_seq = 1 + self.iss
+        receive_seq = serialnum.add(packet.get_seq_number(), 1)
+        send_seq = serialnum.add(self.iss, 1)
         send_window = packet.get_window_size()
         receive_window = self.rcv_wnd
         self.control_block = PTCControlBlock(send_seq, receive_seq,
-                                             send_window, receive_window)
+                                             send_window, receive_window,
+                                             self.send_buffer_size,
+                                             self.reassembly_limit)
     
     def is_connected(self):
         connected_states = [ESTABLISHED, FIN_WAIT1, FIN_WAIT2, CLOSE_WAIT,
                             CLOSING, LAST_ACK]
         return self.state in connected_states
         
+    def negotiate_mss(self, packet):
+        # Segments sent can be as large as both ends allow. Peers not
+        # announcing an MSS take segments of any size.
+        peer_mss = packet.get_mss()
+        if peer_mss is None:
+            peer_mss = MAX_MSS
+        self.pmtu.set_maximum(min(self.local_mss, peer_mss))
+        
+    def negotiate_options(self, packet):
+        # Called with the SYN segment of the other end.
+        self.negotiate_mss(packet)
+        self.sack_enabled = packet.get_sack_permitted()
+        self.ecn.negotiate(packet)
+        self.congestion_control.reset(self.pmtu.get_mss())
+        
     def build_packet(self, seq=None, ack=None, payload=None, flags=None,
-                     window=None):
+                     window=None, options=None):
         if seq is None:
             seq = self.control_block.get_snd_nxt()
         if flags is None:
             flags = [ACKFlag]
+        flags = self.ecn.get_ack_flags(flags)
         if ack is None and ACKFlag in flags:
             ack = self.control_block.get_rcv_nxt()
         if window is None:
             window = self.control_block.get_rcv_wnd()
+        if options is None and not payload:
+            options = self.build_sack_option()
         packet = self.packet_builder.build(payload=payload, flags=flags,
-                                           seq=seq, ack=ack, window=window)
+                                           seq=seq, ack=ack, window=window,
+                                           options=options)
         return packet
+    
+    def build_sack_option(self):
+        # Pure ACKs report the out-of-order data held, lowest blocks first
+        # since those are the most urgent holes to fill. Data segments are
+        # built in bulk and carry no options.
+        if not self.sack_enabled:
+            return None
+        blocks = self.control_block.get_sack_blocks()
+        if not blocks:
+            return None
+        return options.encode_sack(blocks)
+    
+    def get_syn_window(self):
+        # Window announced on our SYN, before there is a control block. See
+        # PTCControlBlock.get_rcv_wnd.
+        if self.reassembly_limit is None:
+            return self.rcv_wnd
+        return min(self.rcv_wnd, self.reassembly_limit)
+    
+    def build_syn_packet(self, flags, seq=None, window=None):
+        # SYN segments carry our MSS. SACK and ECN are offered on SYN and,
+        # only if the other end offered them, on SYN/ACK.
+        syn_options = options.encode_mss(self.local_mss)
+        if ACKFlag not in flags or self.sack_enabled:
+            syn_options += options.encode_sack_permitted()
+        flags = self.ecn.get_syn_flags(flags)
+        return self.build_packet(seq=seq, flags=flags, window=window,
+                                 options=syn_options)
 
     def send_and_queue(self, packet, is_retransmission=False):
         if is_retransmission:
             # Karn's algorithm: do not use retransmitted packets to update
-            # RTO estimations.
+            # RTO estimations. Retransmissions need not start where the
+            # tracked packet did, as their data may be regrouped (see
+            # RetransmissionQueue.regroup_head) or cut from SACK holes. Any
+            # of them up to the tracked packet makes its ACK ambiguous.
             if self.rto_estimator.is_tracking_packets():
                 tracked_packet = self.rto_estimator.get_tracked_packet()
                 tracked_seq = tracked_packet.get_seq_number()
-                if tracked_seq == packet.get_seq_number():
+                if serialnum.leq(packet.get_seq_number(), tracked_seq):
                     self.rto_estimator.untrack()
         else:
             # Only fresh packets will be tracked for their RTTs (Karn's
@@ -130,33 +227,78 @@ class PTCProtocol(object):
             # Retransmissions are not re-enqueued since they remain at the
             # head of the queue until they are acknowledged.
             self.rqueue.put(packet)
-            
+        self.start_retransmission_timer()
+        self.send_packets([packet])
+        
+    def send_and_queue_batch(self, packets):
+        # Same as send_and_queue for several fresh packets, doing the
+        # bookkeeping once for all of them.
+        if not self.rto_estimator.is_tracking_packets():
+            self.rto_estimator.track(packets[0])
+        self.rqueue.put_all(packets)
+        self.start_retransmission_timer()
+        self.send_packets(packets)
+        
+    def start_retransmission_timer(self):
         if not self.retransmission_timer.is_running():
             # Use current RTO estimation to time this packet.
             current_rto = self.rto_estimator.get_current_rto()
             self.retransmission_timer.start(current_rto)
             
-        self.socket.send(packet)
+    def send_packets(self, packets):
+        try:
+            if len(packets) == 1:
+                self.socket.send(packets[0])
+            else:
+                self.socket.send_batch(packets)
+        except socket.error, e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+            # The route got a smaller MTU. Packets stay queued and get split
+            # when retransmitted.
+            mss = self.socket.get_mss_for(self.destination_address)
+            self.pmtu.set_route_limit(mss)
         
     def set_destination_on_packet_builder(self, address, port):
         self.packet_builder.set_destination_address(address)
         self.packet_builder.set_destination_port(port)        
+        self.destination_address = address
+        self.destination_port = port
+        self.register_endpoint()
+        self.local_mss = self.socket.get_mss_for(address)
         
     def bind(self, address, port):
-        self.socket.bind(address, port)
         self.packet_builder.set_source_address(address)
         self.packet_builder.set_source_port(port)
+        self.address = address
+        self.port = port
+        
+    def register_endpoint(self):
+        # Packets are received once listening. Once the destination is
+        # known, only packets coming from it are.
+        if self.address is None:
+            return
+        if self.demultiplexer is None:
+            listening = self.destination_address is None
+            self.demultiplexer = PacketDemultiplexer.get_instance(
+                self.transport, listening)
+            self.socket = self.demultiplexer.get_socket()
+            self.ecn.set_available(self.socket.CARRIES_ECN)
+        self.demultiplexer.register(self, self.address, self.port,
+                                    self.destination_address,
+                                    self.destination_port)
     
     def listen(self):
         self.set_state(LISTEN)
+        self.register_endpoint()
         
     def connect_to(self, address, port):
         self.connected_event = threading.Event()
         self.set_destination_on_packet_builder(address, port)
         self.start_threads()
         
-        syn_packet = self.build_packet(seq=self.iss, flags=[SYNFlag],
-                                       window=self.rcv_wnd)
+        syn_packet = self.build_syn_packet(seq=self.iss, flags=[SYNFlag],
+                                           window=self.get_syn_window())
         self.set_state(SYN_SENT)
         self.send_and_queue(syn_packet)
         
@@ -170,12 +312,62 @@ class PTCProtocol(object):
         # Wait until client attempts to connect.
         self.connected_event.wait()        
         
-    def send(self, data):
+    def set_congestion_control(self, name):
+        # The packet sender and the demultiplexer use the congestion control
+        # under the control block lock, so it is swapped under it as well.
+        congestion_control = get_congestion_control(name)(self)
+        if self.control_block is None:
+            self.install_congestion_control(congestion_control)
+            return
         with self.control_block:
-            if not self.write_stream_open:
-                raise PTCError('write stream is closed')
-            self.control_block.to_out_buffer(data)
-            self.packet_sender.notify()
+            self.install_congestion_control(congestion_control)
+            
+    def install_congestion_control(self, congestion_control):
+        congestion_control.reset(self.pmtu.get_mss())
+        self.congestion_control = congestion_control
+        
+    def set_receive_buffer_size(self, size):
+        # The receive buffer size is the window announced on connection
+        # establishment, so it cannot change afterwards. Without window
+        # scaling, it cannot go beyond MAX_WND either.
+        if self.control_block is not None:
+            raise PTCError('receive buffer size must be set before connecting')
+        self.rcv_wnd = min(size, MAX_WND)
+        
+    def set_send_buffer_size(self, size):
+        self.send_buffer_size = size
+        if self.control_block is not None:
+            self.control_block.set_out_buffer_size(size)
+        
+    def send(self, data, block=True):
+        # Take as much data as fits in the send buffer and return how much
+        # that was. If block is True, wait for room until all of it is taken.
+        taken = 0
+        while True:
+            with self.control_block:
+                if self.state == CLOSED:
+                    # Freed while waiting for room, e.g. after too many
+                    # retransmissions.
+                    raise PTCError('connection closed')
+                if not self.write_stream_open:
+                    raise PTCError('write stream is closed')
+                size = self.control_block.get_out_buffer_space()
+                if size > 0 and taken < len(data):
+                    chunk = data[taken:taken+size]
+                    self.control_block.to_out_buffer(chunk)
+                    taken += len(chunk)
+                    self.packet_sender.notify()
+            if taken == len(data) or not block:
+                break
+            self.control_block.wait_for_out_buffer_space()
+        if taken == 0 and len(data) > 0:
+            raise WouldBlockError('send buffer is full')
+        return taken
+    
+    def drain(self, low_water=0):
+        # Wait until at most low_water bytes are left in the send buffer,
+        # either unsent or not yet acknowledged.
+        self.control_block.wait_until_out_buffer_below(low_water)
         
     def receive(self, size):
         data = self.control_block.from_in_buffer(size)
@@ -198,10 +390,59 @@ class PTCProtocol(object):
             # First, pass this packet to the RTO estimator in order to update
             # its values if appropriate (that is, if the packet is acknowledging
             # the packet tracked by it).
-            self.rto_estimator.process_ack(packet)
+            sampled_rtt = self.rto_estimator.process_ack(packet)
+            if sampled_rtt is not None:
+                self.congestion_control.process_rtt_sample(
+                    sampled_rtt * CLOCK_TICK)
+            self.pmtu.process_ack(ack_number)
+            self.update_scoreboard_with(packet, ack_number)
+            acked_bytes = serialnum.sub(ack_number,
+                                        self.control_block.get_snd_una())
+            flight_size = self.rqueue.get_byte_count()
+            in_recovery = self.fast_recovery.is_in_recovery()
             # Then, remove enqueued packets and stop/restart the retransmission
             # timer as required.
             self.remove_from_retransmission_queue_packets_acked_by(packet)
+            mss = self.pmtu.get_mss()
+            if self.fast_recovery.process_ack(ack_number):
+                # A partial ACK: the data following it was lost as well.
+                self.fast_retransmission_pending = True
+                self.congestion_control.process_partial_ack(acked_bytes, mss)
+            elif in_recovery:
+                self.congestion_control.exit_recovery(
+                    self.rqueue.get_byte_count(), mss)
+            else:
+                self.congestion_control.process_ack(acked_bytes, flight_size,
+                                                    mss)
+            snd_nxt = self.control_block.get_snd_nxt()
+            if self.ecn.process_echo(packet, snd_nxt) and\
+               not self.fast_recovery.is_in_recovery():
+                # Congestion reported by the network: the window is reduced
+                # as on a loss, unless recovery already did.
+                self.congestion_control.process_ecn_echo(
+                    self.rqueue.get_byte_count(), mss)
+        elif not self.rqueue.empty():
+            snd_una = self.control_block.get_snd_una()
+            snd_wnd = self.control_block.get_snd_wnd()
+            self.update_scoreboard_with(packet, snd_una)
+            if self.fast_recovery.is_duplicate_ack(packet, snd_una, snd_wnd):
+                snd_nxt = self.control_block.get_snd_nxt()
+                mss = self.pmtu.get_mss()
+                if self.fast_recovery.process_duplicate_ack(snd_una,
+                                                            snd_nxt):
+                    self.fast_retransmission_pending = True
+                    self.congestion_control.enter_recovery(
+                        self.rqueue.get_byte_count(), mss)
+                elif self.fast_recovery.is_in_recovery():
+                    self.congestion_control.process_duplicate_ack(mss)
+                    if self.scoreboard.has_holes(snd_una):
+                        # Further losses reported while recovering.
+                        self.fast_retransmission_pending = True
+                    
+    def update_scoreboard_with(self, packet, snd_una):
+        if self.sack_enabled:
+            self.scoreboard.update(packet.get_sack_blocks(), snd_una,
+                                   self.control_block.get_snd_nxt())
 
     def remove_from_retransmission_queue_packets_acked_by(self, packet):
         # Only ACK numbers greater than SND_UNA and less than SND_NXT are
@@ -252,11 +493,27 @@ class PTCProtocol(object):
                 if self.retransmissions > BOGUS_RTT_RETRANSMISSIONS:
                     self.rto_estimator.clear_rtt()
                 self.retransmissions += 1
-                # Back off RTO and then retransmit the earliest packet not yet
-                # acknowledged.
+                self.fast_retransmission_pending = False
+                self.fast_recovery.process_timeout(
+                    self.control_block.get_snd_nxt())
+                # The other end may drop out-of-order data at will, so what
+                # it reported cannot be relied upon any longer.
+                self.scoreboard.clear()
+                self.congestion_control.process_timeout(
+                    self.rqueue.get_byte_count(), self.pmtu.get_mss(),
+                    first=self.retransmissions == 1)
+                # Back off RTO and then retransmit the earliest data not yet
+                # acknowledged, in segments as large as the path allows.
                 self.rto_estimator.back_off_rto()
-                packet = self.rqueue.head()
-                self.send_and_queue(packet, is_retransmission=True)
+                head = self.rqueue.head()
+                head_size = serialnum.sub(head.seq_hi, head.seq_lo)
+                segment_size = self.pmtu.process_timeout(head_size,
+                                                         self.retransmissions)
+                for segment in self.rqueue.regroup_head(segment_size):
+                    packet = self.build_retransmission(segment)
+                    self.send_and_queue(packet, is_retransmission=True)
+            elif self.fast_retransmission_pending:
+                self.fast_retransmit()
             
             if self.write_stream_open or \
                self.control_block.has_data_to_send():
@@ -269,19 +526,86 @@ class PTCProtocol(object):
                 #   * Every outgoing byte was successfully acknowledged.
                 self.attempt_to_send_FIN()
 
+    def fast_retransmit(self):
+        # Retransmit the data deemed lost without waiting for the timer,
+        # which starts over for it. Unlike on timeouts, RTO is not backed
+        # off: the network is still delivering segments.
+        self.fast_retransmission_pending = False
+        if self.rqueue.empty():
+            return
+        segments = self.get_segments_to_fast_retransmit()
+        for segment in segments:
+            packet = self.build_retransmission(segment)
+            self.send_and_queue(packet, is_retransmission=True)
+        if segments:
+            current_rto = self.rto_estimator.get_current_rto()
+            self.retransmission_timer.restart(current_rto)
+            
+    def get_segments_to_fast_retransmit(self):
+        # The holes of the SACK scoreboard, if it has anything to go by.
+        # Otherwise, the earliest data not yet acknowledged.
+        mss = self.pmtu.get_mss()
+        holes = None
+        if self.sack_enabled:
+            snd_una = self.control_block.get_snd_una()
+            holes = self.scoreboard.take_holes(snd_una)
+        if holes is None:
+            return self.rqueue.regroup_head(mss)
+        segments = list()
+        for seq_lo, seq_hi in holes:
+            while seq_lo != seq_hi:
+                size = min(mss, serialnum.sub(seq_hi, seq_lo))
+                segment_end = serialnum.add(seq_lo, size)
+                segments.append(SentSegment(seq_lo, segment_end, 0))
+                seq_lo = segment_end
+        return segments
+        
+    def build_retransmission(self, segment):
+        # Build again the segment of the retransmission queue given, taking
+        # its data from the out buffer.
+        if segment.flags & SYNFlag.get_bits():
+            return self.build_syn_packet(seq=segment.seq_lo, flags=[SYNFlag],
+                                         window=self.get_syn_window())
+        if segment.flags & FINFlag.get_bits():
+            return self.build_packet(seq=segment.seq_lo,
+                                     flags=[ACKFlag, FINFlag])
+        size = serialnum.sub(segment.seq_hi, segment.seq_lo)
+        payload = self.control_block.get_from_out_buffer(segment.seq_lo, size)
+        return self.build_packet(payload=payload, seq=segment.seq_lo)
+    
     def attempt_to_send_data(self):
-        window_closed = False
-        while self.control_block.has_data_to_send() and not window_closed:
-            seq_number = self.control_block.get_snd_nxt()
-            to_send = self.control_block.extract_from_out_buffer(MSS)
-            if not to_send:
-                # Control block returned nothing, which hints that the window
-                # is closed. Thus, we have nothing else to do until further
-                # ACKs arrive.
-                window_closed = True
-            else:
-                packet = self.build_packet(payload=to_send, seq=seq_number)
-                self.send_and_queue(packet)
+        # Carve everything the windows allow into segments in one go and
+        # send them as a batch. If either window is closed, there is nothing
+        # else to do until further ACKs arrive.
+        mss = self.pmtu.get_mss()
+        segment_size = self.pmtu.get_segment_size()
+        cwnd = self.congestion_control.get_cwnd()
+        segments = list()
+        if segment_size > mss:
+            # A probe goes first (see PathMTUDiscovery).
+            segments = self.control_block.extract_segments_from_out_buffer(
+                segment_size, max_segments=1, cwnd=cwnd)
+        segments += self.control_block.extract_segments_from_out_buffer(
+            mss, cwnd=cwnd)
+        if not segments:
+            return
+        flags = self.ecn.get_ack_flags([ACKFlag])
+        packets = list()
+        if self.ecn.take_cwr():
+            # Only the first segment tells about the window reduction.
+            packets = self.build_data_packets(segments[:1],
+                                              flags + [CWRFlag])
+            segments = segments[1:]
+        packets += self.build_data_packets(segments, flags)
+        self.pmtu.segments_sent(packets)
+        self.send_and_queue_batch(packets)
+                
+    def build_data_packets(self, segments, flags):
+        # New data is sent as ECN-capable, retransmissions are not.
+        return self.packet_builder.build_data_packets(
+            segments, flags=flags, ack=self.control_block.get_rcv_nxt(),
+            window=self.control_block.get_rcv_wnd(),
+            ect=self.ecn.is_enabled())
                 
     def attempt_to_send_FIN(self):
         state_allows_closing = self.state in [ESTABLISHED, CLOSE_WAIT]
@@ -295,7 +619,23 @@ class PTCProtocol(object):
             self.send_and_queue(fin_packet)
     
     def handle_incoming(self, packet):
-        self.packet_handler.handle(packet)
+        self.handle_incoming_batch([packet])
+        
+    def handle_incoming_batch(self, packets):
+        # Packets are views over receive buffers that get reused, so they
+        # are copied if they cannot be handled right away.
+        with self.incoming_lock:
+            if not self.handling_packets:
+                for packet in packets:
+                    self.pending_packets.append(packet.copy())
+                return
+        control_block = self.control_block
+        if control_block is None:
+            self.packet_handler.handle_batch(packets)
+        else:
+            # Take the control block lock just once for the whole batch.
+            with control_block:
+                self.packet_handler.handle_batch(packets)
         self.packet_sender.notify()
     
     def shutdown(self, how):
@@ -323,6 +663,11 @@ class PTCProtocol(object):
         self.join_threads()
             
     def free(self):
+        if self.demultiplexer is not None:
+            self.demultiplexer.unregister(self)
+        # Writers waiting for room are woken up as buffers are flushed, and
+        # must find the connection closed by then.
+        self.set_state(CLOSED)
         if self.control_block is not None:
             self.control_block.flush_buffers()
         self.stop_threads()
@@ -331,5 +676,4 @@ class PTCProtocol(object):
         self.connected_event.set()
         # And, similarly, this will unlock the main thread if close is called
         # and free is later invoked by some other thread, for whatever reason.
-        self.close_event.set()
-        self.set_state(CLOSED)
\ No newline at end of file
+        self.close_event.set()
\ No newline at end of file
@@ -2,16 +2,17 @@ import random
 import threading
 
 from constants import NULL_ADDRESS, SHUT_RD, SHUT_WR, SHUT_RDWR,\
-                      WAIT, NO_WAIT, ABORT
+                      WAIT, NO_WAIT, ABORT, DEFAULT_TRANSPORT
 from exceptions import PTCError
 from protocol import PTCProtocol
 
 
 class Socket(object):
     
-    def __init__(self):
-        self.protocol = PTCProtocol()
+    def __init__(self, transport=DEFAULT_TRANSPORT):
+        self.protocol = PTCProtocol(transport)
         self.sockname = None
+        self.blocking = True
 
     def bind(self, address_tuple=None):
         if address_tuple is None:
@@ -77,9 +78,32 @@ class Socket(object):
         if not self.is_connected():
             raise PTCError('socket not connected')
     
+    def setblocking(self, flag):
+        # Only sending honors this: non-blocking sockets take as much data as
+        # fits in the send buffer and raise WouldBlockError if none does.
+        self.blocking = bool(flag)
+        
+    def set_receive_buffer_size(self, size):
+        self.protocol.set_receive_buffer_size(size)
+        
+    def set_send_buffer_size(self, size):
+        self.protocol.set_send_buffer_size(size)
+        
+    def set_congestion_control(self, name):
+        # Pick the congestion control algorithm: RENO, CUBIC or LEDBAT, which
+        # makes a background transfer using only spare capacity. On a
+        # connected socket, the new one starts over from the initial window.
+        self.protocol.set_congestion_control(name)
+    
     def send(self, data):
         self._check_socket_connected()
-        self.protocol.send(data)
+        return self.protocol.send(data, block=self.blocking)
+    
+    def drain(self, low_water=0):
+        # Block until at most low_water bytes written are left to be sent or
+        # acknowledged.
+        self._check_socket_connected()
+        self.protocol.drain(low_water)
  
     def recv(self, size):
         self._check_socket_connected()       
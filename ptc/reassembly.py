@@ -0,0 +1,116 @@
+import bisect
+
+
+class ReassemblyQueue(object):
+    # Out-of-order data waiting for the gaps before it to be filled. It is
+    # kept as disjoint, non-adjacent intervals sorted by their start. Each
+    # interval holds its data as a list of pieces: incoming data is trimmed
+    # to the gaps it fills and stored bytes are never copied again.
+    # Positions are offsets within the stream rather than sequence numbers,
+    # so that the ordering (and thus bisect) is not broken by wraparound.
+
+    def __init__(self, limit=None):
+        self.starts = list()
+        self.ends = list()
+        self.pieces = list()
+        self.size = 0
+        # Maximum amount of bytes held. None means no limit.
+        self.limit = limit
+
+    def get_size(self):
+        return self.size
+
+    def empty(self):
+        return len(self.starts) == 0
+
+    def get_intervals(self):
+        # (start, end) pairs of the data held, in position order.
+        return zip(self.starts, self.ends)
+
+    def clear(self):
+        self.starts = list()
+        self.ends = list()
+        self.pieces = list()
+        self.size = 0
+
+    def add(self, start, data):
+        # Store data, which begins at the given position. Bytes already held
+        # are dropped from it. Returns False if the data was rejected since
+        # storing it would exceed the limit.
+        end = start + len(data)
+        if end <= start:
+            return True
+        # Intervals in [first, last) overlap or are adjacent to the new one.
+        first = bisect.bisect_left(self.ends, start)
+        last = bisect.bisect_right(self.starts, end)
+        gaps = self.get_gaps_within(start, end, first, last)
+        new_bytes = sum(gap_hi - gap_lo for gap_lo, gap_hi in gaps)
+        if self.limit is not None and self.size + new_bytes > self.limit:
+            return False
+        if first < last and self.starts[first] <= start:
+            # Extend the pieces of the interval preceding the new data in
+            # place.
+            pieces = self.pieces[first]
+        else:
+            pieces = list()
+        lo, hi = start, end
+        if first < last:
+            lo = min(lo, self.starts[first])
+            hi = max(hi, self.ends[last-1])
+        # Interleave the gaps, filled with new data, and the pieces of the
+        # intervals found.
+        gaps.reverse()
+        for index in range(first, last):
+            while gaps and gaps[-1][0] < self.starts[index]:
+                gap_lo, gap_hi = gaps.pop()
+                pieces.append(data[gap_lo-start:gap_hi-start])
+            if pieces is not self.pieces[index]:
+                pieces.extend(self.pieces[index])
+        while gaps:
+            gap_lo, gap_hi = gaps.pop()
+            pieces.append(data[gap_lo-start:gap_hi-start])
+        self.starts[first:last] = [lo]
+        self.ends[first:last] = [hi]
+        self.pieces[first:last] = [pieces]
+        self.size += new_bytes
+        return True
+
+    def get_gaps_within(self, start, end, first, last):
+        # Portions of [start, end) not covered by the intervals in
+        # [first, last).
+        gaps = list()
+        position = start
+        for index in range(first, last):
+            interval_start = self.starts[index]
+            if interval_start > position:
+                gaps.append((position, interval_start))
+            position = max(position, self.ends[index])
+        if position < end:
+            gaps.append((position, end))
+        return gaps
+
+    def pop_from(self, position):
+        # Remove the data that follows the given position right away and
+        # return it as a list of pieces. Data before the position is
+        # discarded.
+        while self.starts and self.starts[0] <= position:
+            start = self.starts.pop(0)
+            end = self.ends.pop(0)
+            pieces = self.pieces.pop(0)
+            self.size -= end - start
+            if end > position:
+                return self.trim(pieces, position - start)
+        return list()
+
+    def trim(self, pieces, size):
+        # Drop the first size bytes of the given pieces.
+        if size == 0:
+            return pieces
+        trimmed = list()
+        for piece in pieces:
+            if size >= len(piece):
+                size -= len(piece)
+                continue
+            trimmed.append(piece[size:])
+            size = 0
+        return trimmed
@@ -0,0 +1,73 @@
+import threading
+
+from constants import DUPLICATE_ACK_THRESHOLD
+from packet import SYNFlag, FINFlag
+import serialnum
+
+
+# Fast retransmit and fast recovery, following NewReno (RFC 6582).
+class FastRecovery(object):
+    # The receiver sends a duplicate ACK for every segment arriving out of
+    # order, so that several of them in a row mean that the segment at
+    # SND_UNA was most likely lost while later ones got through. After
+    # DUPLICATE_ACK_THRESHOLD of them, that segment is retransmitted right
+    # away instead of waiting for the retransmission timer, and recovery
+    # starts. Until everything sent so far (up to recover) is acknowledged,
+    # each ACK that covers only part of it (a partial ACK) points at another
+    # lost segment, which is retransmitted at once as well.
+    
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.duplicate_acks = 0
+        self.in_recovery = False
+        # SND_NXT when recovery last started or the timer last expired. No
+        # recovery starts again until an ACK goes beyond it.
+        self.recover = None
+        self.lock = threading.RLock()
+        
+    def is_in_recovery(self):
+        with self.lock:
+            return self.in_recovery
+            
+    def is_duplicate_ack(self, packet, snd_una, snd_wnd):
+        # As defined in RFC 5681: it acknowledges nothing new, carries
+        # neither data nor SYN/FIN and leaves the window unchanged. It is
+        # up to the caller to check that there is data in flight.
+        return packet.get_ack_number() == snd_una and\
+               not packet.has_payload() and\
+               packet.get_window_size() == snd_wnd and\
+               SYNFlag not in packet and FINFlag not in packet
+               
+    def process_duplicate_ack(self, snd_una, snd_nxt):
+        # Returns True if the segment at SND_UNA should be retransmitted.
+        with self.lock:
+            self.duplicate_acks += 1
+            if self.in_recovery or\
+               self.duplicate_acks != DUPLICATE_ACK_THRESHOLD:
+                return False
+            if self.recover is not None and\
+               not serialnum.lt(self.recover, snd_una):
+                # Still recovering from an earlier loss.
+                return False
+            self.in_recovery = True
+            self.recover = snd_nxt
+            return True
+            
+    def process_ack(self, ack_number):
+        # Called for ACKs acknowledging new data. Returns True if it is a
+        # partial ACK, so that the segment it points at should be
+        # retransmitted.
+        with self.lock:
+            self.duplicate_acks = 0
+            if not self.in_recovery:
+                return False
+            if serialnum.lt(ack_number, self.recover):
+                return True
+            self.in_recovery = False
+            return False
+            
+    def process_timeout(self, snd_nxt):
+        with self.lock:
+            self.duplicate_acks = 0
+            self.in_recovery = False
+            self.recover = snd_nxt
@@ -0,0 +1,117 @@
+import ctypes
+import mmap
+import os
+import struct
+
+
+class SharedMemoryRing(object):
+    # Single-producer, single-consumer ring of datagrams over a memory-mapped
+    # file, meant to be shared by two processes. The file starts with a
+    # header holding the total amount of bytes ever written (tail), the
+    # amount ever read (head) and whether the consumer is waiting for
+    # datagrams. The tail is written by the producer only and the head by
+    # the consumer only. Datagrams are
+    # stored as records made of their length and their bytes, padded to
+    # ALIGNMENT. A record never wraps around: if it does not fit at the end,
+    # a WRAP marker is left there and it goes at the start.
+
+    HEAD = struct.Struct('=Q')
+    TAIL = struct.Struct('=Q')
+    WAITING = struct.Struct('=I')
+    LENGTH = struct.Struct('=I')
+    HEAD_OFFSET = 0
+    TAIL_OFFSET = 8
+    WAITING_OFFSET = 16
+    HEADER_SIZE = 64
+    ALIGNMENT = 4
+    WRAP = 0xffffffff
+
+    @classmethod
+    def open(cls, path, capacity):
+        # Map the ring at path, creating the file if needed.
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0600)
+        try:
+            size = cls.HEADER_SIZE + capacity
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            memory = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        return cls(memory, capacity)
+
+    def __init__(self, memory, capacity):
+        self.memory = memory
+        self.capacity = capacity
+        self.address = ctypes.addressof(ctypes.c_char.from_buffer(memory)) +\
+                       self.HEADER_SIZE
+
+    def close(self):
+        self.memory.close()
+
+    def get_head(self):
+        return self.HEAD.unpack_from(self.memory, self.HEAD_OFFSET)[0]
+
+    def get_tail(self):
+        return self.TAIL.unpack_from(self.memory, self.TAIL_OFFSET)[0]
+
+    def empty(self):
+        return self.get_head() == self.get_tail()
+
+    def is_waiting(self):
+        return self.WAITING.unpack_from(self.memory,
+                                        self.WAITING_OFFSET)[0] != 0
+
+    def set_waiting(self, waiting):
+        self.WAITING.pack_into(self.memory, self.WAITING_OFFSET,
+                               1 if waiting else 0)
+
+    def get_record_size(self, length):
+        size = self.LENGTH.size + length
+        return size + (-size % self.ALIGNMENT)
+
+    def put(self, data):
+        # Producer side. data is either a str or a bytearray. Returns False
+        # if there is no room for it, in which case it is dropped.
+        head = self.get_head()
+        tail = self.get_tail()
+        offset = tail % self.capacity
+        size = self.get_record_size(len(data))
+        skip = 0
+        if offset + size > self.capacity:
+            skip = self.capacity - offset
+        if size + skip > self.capacity - (tail - head):
+            return False
+        if skip:
+            self.LENGTH.pack_into(self.memory, self.HEADER_SIZE + offset,
+                                  self.WRAP)
+            tail += skip
+            offset = 0
+        self.LENGTH.pack_into(self.memory, self.HEADER_SIZE + offset,
+                              len(data))
+        if isinstance(data, bytearray):
+            data = (ctypes.c_char * len(data)).from_buffer(data)
+        ctypes.memmove(self.address + offset + self.LENGTH.size, data,
+                       len(data))
+        # The record becomes visible to the consumer only now.
+        self.TAIL.pack_into(self.memory, self.TAIL_OFFSET, tail + size)
+        return True
+
+    def get_into(self, address):
+        # Consumer side. Copy the next datagram to the given memory address
+        # and return its length, or None if the ring is empty.
+        head = self.get_head()
+        if head == self.get_tail():
+            return None
+        offset = head % self.capacity
+        length = self.LENGTH.unpack_from(self.memory,
+                                         self.HEADER_SIZE + offset)[0]
+        if length == self.WRAP:
+            head += self.capacity - offset
+            offset = 0
+            length = self.LENGTH.unpack_from(self.memory,
+                                             self.HEADER_SIZE)[0]
+        ctypes.memmove(address, self.address + offset + self.LENGTH.size,
+                       length)
+        head += self.get_record_size(length)
+        self.HEAD.pack_into(self.memory, self.HEAD_OFFSET, head)
+        return length
@@ -1,61 +1,143 @@
+import collections
 import threading
 
+from packet import SYNFlag, FINFlag
+import serialnum
+
+
+# A segment sent and not yet acknowledged: its sequence interval and the
+# control flags (SYN, FIN) it carried.
+SentSegment = collections.namedtuple('SentSegment',
+                                     ['seq_lo', 'seq_hi', 'flags'])
+
 
 class RetransmissionQueue(object):
+    # Segments are sent, and thus enqueued, in sequence number order. A
+    # cumulative ACK therefore covers a prefix of the queue, which is popped
+    # from the left until the first segment not covered.
+    # Only sequence ranges are kept: their data stays in the send buffer
+    # until acknowledged, and retransmissions are built from it again (see
+    # regroup_head).
+    
+    CONTROL_FLAGS = SYNFlag.get_bits() | FINFlag.get_bits()
     
     def __init__(self):
-        self.queue = list()
+        self.queue = collections.deque()
+        # Payload bytes held, for flight size accounting.
+        self.bytes = 0
         self.lock = threading.RLock()
         
     def empty(self):
         with self.lock:
             return len(self.queue) == 0
-
+            
+    def get_segment_count(self):
+        with self.lock:
+            return len(self.queue)
+            
+    def get_byte_count(self):
+        with self.lock:
+            return self.bytes
+            
     def head(self):
         with self.lock:
             if self.empty():
                 raise RuntimeError('retransmission queue is empty')
             return self.queue[0]
-
+            
+    def segment_for(self, packet):
+        seq_lo, seq_hi = packet.get_seq_interval()
+        flags = packet.get_flags_bits() & self.CONTROL_FLAGS
+        return SentSegment(seq_lo, seq_hi, flags)
+        
     def put(self, packet):
         with self.lock:
-            self.queue.append(packet)
-
-    def remove_acknowledged_by(self, ack_packet, snd_una, snd_nxt):
+            self.queue.append(self.segment_for(packet))
+            self.bytes += packet.get_payload_size()
+            
+    def put_all(self, packets):
+        with self.lock:
+            for packet in packets:
+                self.queue.append(self.segment_for(packet))
+                self.bytes += packet.get_payload_size()
+                
+    def regroup_head(self, size):
+        # Segments to retransmit when the head times out, each carrying at
+        # most size bytes. A head larger than that is split. Otherwise, it
+        # is merged with the data segments that follow it, up to size
+        # bytes, so that small writes are retransmitted together. The queue
+        # is updated to hold the new segments.
         with self.lock:
-            new_queue = list()
-            acknowledged_packets = list()
-            for packet in self.queue:
-                ack = ack_packet.get_ack_number()
-                # Check that ack >= seq_lo and ack >= seq_hi simultaneously,
-                # considering that any of these values may have wrapped.
-                if self.ack_covers_packet(ack, packet, snd_una, snd_nxt):
-                    acknowledged_packets.append(packet)
-                else:
-                    new_queue.append(packet)
-            self.queue = new_queue
-            return acknowledged_packets
+            head = self.queue[0]
+            if head.flags:
+                return [head]
+            head_size = serialnum.sub(head.seq_hi, head.seq_lo)
+            if head_size >= size:
+                end = head.seq_hi
+                self.queue.popleft()
+            else:
+                end = self.merge_data_segments(head.seq_lo, size)
+            segments = list()
+            seq_lo = head.seq_lo
+            while seq_lo != end:
+                seq_hi = serialnum.add(seq_lo,
+                                       min(size, serialnum.sub(end, seq_lo)))
+                segments.append(SentSegment(seq_lo, seq_hi, 0))
+                seq_lo = seq_hi
+            self.queue.extendleft(reversed(segments))
+            return segments
+            
+    def merge_data_segments(self, seq_lo, size):
+        # Pop the data segments right from the head that fit in size bytes
+        # from seq_lo, trimming the one that does not entirely. Returns
+        # where the last one popped ends.
+        end = serialnum.add(seq_lo, size)
+        limit = seq_lo
+        while self.queue:
+            segment = self.queue[0]
+            if segment.flags or segment.seq_lo != limit:
+                break
+            if serialnum.leq(segment.seq_hi, end):
+                self.queue.popleft()
+                limit = segment.seq_hi
+                continue
+            self.queue[0] = segment._replace(seq_lo=end)
+            limit = end
+            break
+        return limit
         
-    def ack_covers_packet(self, ack, packet, snd_una, snd_nxt):
-        # Private method to correctly compare the ACK against the SEQs.
-        _, seq_hi = packet.get_seq_interval()
-        if snd_nxt > snd_una:
-            # When SND_NXT > SND_UNA, there is no wrap-around.
-            # Thus, the ACK provided covers the packet iff
-            # ack > seq_hi = sequence number of the last byte.
-            return ack >= seq_hi
-        else:
-            # When SND_NXT <= SND_UNA, SND_NXT has wrapped around.
-            # So, we have two possibilities:
-            #   * seq_hi and ack have also wrapped around, and thus
-            #     we should have seq_hi <= ack <= snd_nxt
-            #   * or just ack wrapped around, which means that it is
-            #     already greater than seq_hi. 
-            return (seq_hi <= ack <= snd_nxt) or\
-                    snd_nxt < seq_hi
+    def remove_acknowledged_by(self, ack_packet, snd_una, snd_nxt):
+        with self.lock:
+            acknowledged_segments = list()
+            ack = ack_packet.get_ack_number()
+            if not serialnum.a_leq_b_leq_c(snd_una, ack, snd_nxt):
+                return acknowledged_segments
+            while self.queue and\
+                  self.ack_covers_segment(ack, self.queue[0], snd_una,
+                                          snd_nxt):
+                segment = self.queue.popleft()
+                self.bytes -= serialnum.sub(segment.seq_hi, segment.seq_lo)
+                acknowledged_segments.append(segment)
+            if self.queue and not self.queue[0].flags and\
+               serialnum.lt(self.queue[0].seq_lo, ack):
+                # Partially acknowledged: only the rest of it will ever be
+                # retransmitted.
+                head = self.queue[0]
+                self.bytes -= serialnum.sub(ack, head.seq_lo)
+                self.queue[0] = head._replace(seq_lo=ack)
+            return acknowledged_segments
             
+    def ack_covers_segment(self, ack, segment, snd_una, snd_nxt):
+        # Private method to correctly compare the ACK against the SEQs.
+        # The segment is covered iff seq_hi <= ACK, seq_hi being the
+        # sequence number following its last byte, and
+        # SND_UNA <= ACK <= SND_NXT. Serial arithmetic takes care of wrapped
+        # values.
+        return serialnum.leq(segment.seq_hi, ack) and\
+               serialnum.a_leq_b_leq_c(snd_una, ack, snd_nxt)
+               
     def __enter__(self, *args, **kwargs):
         return self.lock.__enter__(*args, **kwargs)
-    
+        
     def __exit__(self, *args, **kwargs):
-        return self.lock.__exit__(*args, **kwargs)
\ No newline at end of file
+        return self.lock.__exit__(*args, **kwargs)
@@ -1,7 +1,7 @@
 import threading
 
 from constants import INITIAL_RTO, MAX_RTO, ALPHA, BETA, K
-from seqnum import SequenceNumber
+import serialnum
 
 
 # RTO estimation following RFC 6298, but naively implemented.
@@ -19,6 +19,10 @@ class RTOEstimator(object):
         with self.lock:
             return self.rto
         
+    def get_srtt(self):
+        with self.lock:
+            return self.srtt
+        
     def get_tracked_packet(self):
         with self.lock:
             return self.tracked_packet
@@ -48,14 +52,17 @@ class RTOEstimator(object):
             self.srtt = 0
 
     def process_ack(self, ack_packet):
+        # Returns the RTT sampled, in ticks, if this ACK gave one.
         with self.lock:
             if not self.tracking:
-                return
+                return None
             if self.ack_covers_tracked_packet(ack_packet.get_ack_number()):
                 sampled_rtt = self.protocol.get_ticks() - self.rtt_start_time
                 self.update_rtt_estimation_with(sampled_rtt)
                 self.update_rto()
                 self.untrack()
+                return sampled_rtt
+            return None
                 
     def update_rtt_estimation_with(self, sampled_rtt):
         if self.srtt == 0:
@@ -75,4 +82,4 @@ class RTOEstimator(object):
     def ack_covers_tracked_packet(self, ack_number):
         iss = self.protocol.iss
         seq_number = self.tracked_packet.get_seq_number() 
-        return SequenceNumber.a_leq_b_leq_c(iss, seq_number, ack_number)
\ No newline at end of file
+        return serialnum.a_leq_b_leq_c(iss, seq_number, ack_number)
\ No newline at end of file
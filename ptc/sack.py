@@ -0,0 +1,94 @@
+import threading
+
+import serialnum
+
+
+# Sender side of selective acknowledgments (RFC 2018), with loss recovery
+# loosely following RFC 6675.
+class SACKScoreboard(object):
+    # The other end reports, along with its cumulative ACK, the blocks of
+    # data it got beyond SND_UNA. They are kept here as disjoint intervals
+    # sorted by sequence number. Once recovery starts (see FastRecovery),
+    # the gaps between SND_UNA and the highest byte reported (the holes) are
+    # taken as lost and retransmitted as soon as they are known, several of
+    # them in a single round trip if need be, rather than one segment per
+    # partial ACK. Each hole is retransmitted once: high_rxt marks where
+    # retransmissions went so far.
+    
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.blocks = list()
+        self.high_rxt = None
+        self.lock = threading.RLock()
+        
+    def clear(self):
+        with self.lock:
+            self.blocks = list()
+            self.high_rxt = None
+            
+    def get_blocks(self):
+        with self.lock:
+            return list(self.blocks)
+            
+    def get_sacked_bytes(self):
+        with self.lock:
+            return sum(serialnum.sub(seq_hi, seq_lo)
+                       for seq_lo, seq_hi in self.blocks)
+                       
+    def update(self, blocks, snd_una, snd_nxt):
+        # Add the blocks reported by an ACK, snd_una being SND_UNA once it is
+        # processed. Whatever is no longer above it is dropped. Blocks
+        # reaching beyond SND_NXT are bogus and thus ignored.
+        with self.lock:
+            window = serialnum.sub(snd_nxt, snd_una)
+            intervals = list()
+            for seq_lo, seq_hi in self.blocks + list(blocks):
+                if serialnum.leq(seq_hi, snd_una):
+                    continue
+                lo = 0
+                if serialnum.gt(seq_lo, snd_una):
+                    lo = serialnum.sub(seq_lo, snd_una)
+                hi = serialnum.sub(seq_hi, snd_una)
+                if lo < hi <= window:
+                    intervals.append((lo, hi))
+            intervals.sort()
+            merged = list()
+            for lo, hi in intervals:
+                if merged and lo <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+                else:
+                    merged.append((lo, hi))
+            self.blocks = [(serialnum.add(snd_una, lo),
+                            serialnum.add(snd_una, hi)) for lo, hi in merged]
+            if self.high_rxt is not None and\
+               serialnum.leq(self.high_rxt, snd_una):
+                self.high_rxt = None
+                
+    def get_holes(self, snd_una):
+        # Holes not yet retransmitted, as (SEQ, next SEQ) pairs. None if
+        # nothing above SND_UNA was reported nor retransmitted, so that there
+        # is no telling what was lost.
+        with self.lock:
+            if not self.blocks:
+                return None if self.high_rxt is None else list()
+            start = snd_una
+            if self.high_rxt is not None:
+                start = serialnum.maximum(start, self.high_rxt)
+            holes = list()
+            for seq_lo, seq_hi in self.blocks:
+                if serialnum.lt(start, seq_lo):
+                    holes.append((start, seq_lo))
+                start = serialnum.maximum(start, seq_hi)
+            return holes
+            
+    def has_holes(self, snd_una):
+        return bool(self.get_holes(snd_una))
+        
+    def take_holes(self, snd_una):
+        # Same as get_holes, but the holes returned are taken as
+        # retransmitted.
+        with self.lock:
+            holes = self.get_holes(snd_una)
+            if holes:
+                self.high_rxt = holes[-1][1]
+            return holes
@@ -1,9 +1,10 @@
-import copy
-
 from constants import MAX_SEQ
 
 
 class SequenceNumber(object):
+    # Object wrapper kept for compatibility. The protocol itself works on
+    # plain ints through the functions in serialnum, which also accept
+    # instances of this class.
 
     @classmethod  
     def validate_moduli(cls, a, b):
@@ -106,6 +107,12 @@ class SequenceNumber(object):
     def __index__(self):
         return self.value
     
+    def __and__(self, other):
+        return self.value & int(other)
+    
+    def __rand__(self, other):
+        return self.__and__(other)
+    
     def operate_with(self, other, operation):
         other = self.get_seqnum_from(other)
         value = operation(self.value, other.value)
@@ -118,4 +125,4 @@ class SequenceNumber(object):
         return other
     
     def clone(self):
-        return copy.copy(self)
\ No newline at end of file
+        return self.__class__(self.value, modulus=self.modulus)
\ No newline at end of file
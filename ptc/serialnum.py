@@ -0,0 +1,64 @@
+from constants import MAX_SEQ
+
+
+# Serial number arithmetic (RFC 1982) on plain ints. Sequence numbers are
+# kept reduced modulo MAX_SEQ+1, a power of two, and so reducing is just
+# masking. Intervals are tested by comparing distances from their lower end,
+# which also works for operands not yet reduced (e.g., rcv_nxt + rcv_wnd).
+
+MODULUS = MAX_SEQ + 1
+MASK = MAX_SEQ
+HALF = MODULUS >> 1
+
+
+def normalize(a):
+    return int(a) & MASK
+
+
+def add(a, n):
+    return (a + n) & MASK
+
+
+def sub(a, b):
+    # Distance from b up to a.
+    return (a - b) & MASK
+
+
+def lt(a, b):
+    return 0 < ((b - a) & MASK) < HALF
+
+
+def leq(a, b):
+    return ((b - a) & MASK) < HALF
+
+
+def gt(a, b):
+    return 0 < ((a - b) & MASK) < HALF
+
+
+def geq(a, b):
+    return ((a - b) & MASK) < HALF
+
+
+def maximum(a, b):
+    return b if lt(a, b) else a
+
+
+def minimum(a, b):
+    return a if lt(a, b) else b
+
+
+def a_lt_b_lt_c(a, b, c):
+    return 0 < ((b - a) & MASK) < ((c - a) & MASK)
+
+
+def a_leq_b_lt_c(a, b, c):
+    return ((b - a) & MASK) < ((c - a) & MASK)
+
+
+def a_lt_b_leq_c(a, b, c):
+    return 0 < ((b - a) & MASK) <= ((c - a) & MASK)
+
+
+def a_leq_b_leq_c(a, b, c):
+    return ((b - a) & MASK) <= ((c - a) & MASK)
@@ -1,45 +1,562 @@
+import atexit
+import collections
+import ctypes
+import errno
+import fcntl
+import os
+import select
+import shutil
 import socket
+import struct
+import threading
 
-from ptc.packet_utils import PacketDecoder
-from constants import PROTOCOL_NUMBER, NULL_ADDRESS
+import bpf
+from constants import PROTOCOL_NUMBER, NULL_ADDRESS, MAX_MSS,\
+                      RAW_TRANSPORT, UDP_TRANSPORT, MEMORY_TRANSPORT,\
+                      SHM_TRANSPORT, UDP_ADDRESS, UDP_PORT, SHM_DIRECTORY,\
+                      SHM_RING_SIZE
+from exceptions import PTCError
+from packet import PTCPacket
+from ring import SharedMemoryRing
+
+
+# Not exposed by the socket module in older Python versions.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
 
 
 class Soquete(object):
+    # Raw socket for PTC datagrams. A single one is shared by every
+    # connection in the process (see PacketDemultiplexer). This is the
+    # default transport; any other must provide the same methods and hand
+    # datagrams over with their IP header (or as packet objects, see
+    # DELIVERS_PACKETS), so that the rest of the stack is not aware of it.
     
     MAX_SIZE = 65535
+    # Maximum number of datagrams read at once by receive_batch.
+    BATCH_SIZE = 32
+    # Whether received datagrams carry the IP header sent by the other end,
+    # and thus its checksum.
+    CARRIES_IP_HEADER = True
+    # Whether receive_batch returns packet objects instead of bytes.
+    DELIVERS_PACKETS = False
+    # Whether the ECN bits of the type of service byte reach the other end,
+    # so that ECN can be used.
+    CARRIES_ECN = True
+    # Bytes taken by headers in every datagram sent.
+    OVERHEAD = PTCPacket.IP_HEADER_SIZE + PTCPacket.HEADER_SIZE
+    
+    @classmethod
+    def get_port_for(cls, listening):
+        # Local port the transport should be bound to for listening or
+        # connecting endpoints. Raw sockets have no ports, so all of them
+        # share a single transport.
+        return None
     
     def __init__(self):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_RAW, PROTOCOL_NUMBER)
         self.socket.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
+        self.buffers = [bytearray(self.MAX_SIZE)
+                        for _ in range(self.BATCH_SIZE)]
+        
+    def attach_filter(self, program):
+        # Have the kernel drop the datagrams rejected by the given BPF
+        # program. Returns whether it could be attached.
+        filter_bytes = ctypes.create_string_buffer(bpf.pack_filter(program))
+        # struct sock_fprog: number of instructions and pointer to them.
+        fprog = struct.pack('HL', len(program),
+                            ctypes.addressof(filter_bytes))
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, bpf.SO_ATTACH_FILTER,
+                                   fprog)
+        except socket.error:
+            return False
+        return True
+    
+    def detach_filter(self):
+        try:
+            self.socket.setsockopt(socket.SOL_SOCKET, bpf.SO_DETACH_FILTER, 0)
+        except socket.error:
+            pass
+        
+    def get_mss_for(self, address):
+        # Largest segment that can be sent to address as a single datagram,
+        # as far as the local route tells. The kernel keeps the path MTU
+        # learned from ICMP messages in the route, so it is asked through a
+        # UDP socket connected to address (which sends nothing).
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.connect((address, 9))
+            mtu = probe.getsockopt(socket.IPPROTO_IP, IP_MTU)
+        except socket.error:
+            return MAX_MSS
+        finally:
+            probe.close()
+        return min(mtu, self.MAX_SIZE) - self.OVERHEAD
+    
+    def forget(self, address, port):
+        # Called when the connection with the given remote endpoint is gone.
+        pass
+    
+    def interrupt(self):
+        # Make a pending receive_batch return (raising socket.timeout) as
+        # soon as possible.
+        pass
+    
+    def set_local_endpoints(self, endpoints):
+        # Called with the (address, port) pairs, with addresses packed, of
+        # the endpoints registered whenever they change.
+        pass
         
     def close(self):
         self.socket.close()  
         
-    def bind(self, address, port):
-        self.address = address
-        self.port = port
-        self.socket.bind((self.address, self.port))
-        
     def send(self, packet):
         data = packet.get_bytes()
         dst_address = packet.get_destination_ip()
         dst_port = packet.get_destination_port()
         self.socket.sendto(data, (dst_address, dst_port))
+    
+    def send_batch(self, packets):
+        # Send several packets at once. Datagram sockets take one system
+        # call per datagram anyway.
+        for packet in packets:
+            self.send(packet)
+    
+    def receive_batch(self, timeout=None):
+        # Wait for datagrams to arrive and then read every one already
+        # queued, up to BATCH_SIZE, without blocking. They are read into
+        # preallocated buffers and returned as memoryviews over them: these
+        # are only valid until the next call.
+        readable, _, _ = select.select([self.socket], [], [], timeout)
+        if not readable:
+            raise socket.timeout
+        # MSG_DONTWAIT requires the socket itself to be in blocking mode.
+        self.socket.settimeout(None)
+        views = list()
+        for index, buffer in enumerate(self.buffers):
+            try:
+                size = self.receive_into(index)
+            except socket.error, e:
+                if e.errno in [errno.EAGAIN, errno.EWOULDBLOCK]:
+                    break
+                raise
+            if size is not None:
+                views.append(memoryview(buffer)[:size])
+        return views
+    
+    def receive_into(self, index):
+        # Read the next datagram into the buffer at the given index without
+        # blocking and return its size, or None if it must be ignored.
+        size, _ = self.socket.recvfrom_into(self.buffers[index], 0,
+                                            socket.MSG_DONTWAIT)
+        return size
+    
+    
+class UDPSoquete(Soquete):
+    # UDP socket carrying PTC datagrams without their IP header, which
+    # needs no privileges. The header is rebuilt on reception in front of
+    # the PTC header, with the source address the datagram came from and
+    # the address the socket is bound to as destination. When bound to the
+    # null address, the destination is unknown and PacketDemultiplexer
+    # looks endpoints up by port.
+    # Datagrams are sent to UDP_PORT unless the other end was seen sending
+    # from a different port (e.g., an ephemeral one, if it connected to us).
+    # Reading the type of service byte of received datagrams takes recvmsg,
+    # which Python 2 lacks, so ECN is not used.
+    
+    CARRIES_IP_HEADER = False
+    CARRIES_ECN = False
+    OVERHEAD = Soquete.OVERHEAD + 8
+    
+    IP_HEADER = struct.Struct('!BBHHHBBH4s4s')
+    LENGTH = struct.Struct('!H')
+    PORT = struct.Struct('!H')
+    ADDRESS = struct.Struct('!4s')
+    LENGTH_OFFSET = 2
+    SOURCE_ADDRESS_OFFSET = 12
+    HEADER_SIZE = PTCPacket.IP_HEADER_SIZE
+    
+    @classmethod
+    def get_port_for(cls, listening):
+        return UDP_PORT if listening else 0
+    
+    def __init__(self, port):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if port != 0:
+            self.socket.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        self.socket.bind((UDP_ADDRESS, port))
+        # Never fragment, so that sending more than the path MTU fails (see
+        # PathMTUDiscovery).
+        self.socket.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER,
+                               IP_PMTUDISC_DO)
+        # UDP ports of the other ends, by their address and PTC port.
+        self.peers = dict()
+        header = self.IP_HEADER.pack(
+            (PTCPacket.VERSION << 4) + PTCPacket.IP_HEADER_LENGTH, 0, 0, 0,
+            PTCPacket.FRAGMENTATION_WORD, PTCPacket.TIME_TO_LIVE,
+            PTCPacket.PROTOCOL, 0, socket.inet_aton(NULL_ADDRESS),
+            socket.inet_aton(UDP_ADDRESS))
+        self.buffers = list()
+        self.datagram_views = list()
+        for _ in range(self.BATCH_SIZE):
+            buffer = bytearray(self.MAX_SIZE)
+            buffer[:self.HEADER_SIZE] = header
+            self.buffers.append(buffer)
+            self.datagram_views.append(memoryview(buffer)[self.HEADER_SIZE:])
         
-    def receive(self, timeout=None):
-        should_stop = False
-        if timeout is not None and timeout > 0:
-            self.socket.settimeout(timeout)
-        else:
-            self.socket.settimeout(None)
-        while not should_stop:
-            packet_bytes, _ = self.socket.recvfrom(self.MAX_SIZE)
-            packet = PacketDecoder().decode(packet_bytes)
-            if self.is_for_me(packet):
-                should_stop = True
-        return packet
-                
-    def is_for_me(self, packet):
+    def attach_filter(self, program):
+        # The program expects an IP header in front. Besides, the kernel
+        # already delivers only the datagrams sent to our UDP port.
+        return False
+    
+    def detach_filter(self):
+        pass
+    
+    def forget(self, address, port):
+        self.peers.pop((address, port), None)
+        
+    def send(self, packet):
         address = packet.get_destination_ip()
-        port = packet.get_destination_port()
-        return (self.address == NULL_ADDRESS or address == self.address) and port == self.port
\ No newline at end of file
+        port = self.peers.get((address, packet.get_destination_port()),
+                              UDP_PORT)
+        data = memoryview(packet.get_bytes())[self.HEADER_SIZE:]
+        self.socket.sendto(data, (address, port))
+        
+    def receive_into(self, index):
+        buffer = self.buffers[index]
+        size, (address, port) = self.socket.recvfrom_into(
+            self.datagram_views[index], 0, socket.MSG_DONTWAIT)
+        if size < PTCPacket.HEADER_SIZE:
+            return None
+        ptc_port = self.PORT.unpack_from(buffer, self.HEADER_SIZE)[0]
+        self.peers[(address, ptc_port)] = port
+        size += self.HEADER_SIZE
+        self.LENGTH.pack_into(buffer, self.LENGTH_OFFSET, size)
+        self.ADDRESS.pack_into(buffer, self.SOURCE_ADDRESS_OFFSET,
+                               socket.inet_aton(address))
+        return size
+    
+    
+class MemorySoquete(Soquete):
+    # Transport between endpoints of the same process. Packets sent are
+    # queued as they are, neither serialized nor copied (they are not
+    # modified once built), and handed to the demultiplexer thread, which
+    # delivers them to their destination endpoint. Packets for unknown
+    # endpoints are dropped, as in a network.
+    # Waiting on a condition with a timeout polls in Python 2, which would
+    # delay every packet, so the receiver waits on a pipe used as doorbell
+    # instead. It is rung only while the receiver is waiting.
+    
+    CARRIES_IP_HEADER = False
+    DELIVERS_PACKETS = True
+    
+    def __init__(self):
+        self.packets = collections.deque()
+        self.lock = threading.Lock()
+        self.waiting = False
+        self.doorbell, self.bell = os.pipe()
+        for fd in [self.doorbell, self.bell]:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        
+    def get_mss_for(self, address):
+        # Packets are not even serialized.
+        return MAX_MSS
+        
+    def attach_filter(self, program):
+        return False
+    
+    def detach_filter(self):
+        pass
+        
+    def close(self):
+        os.close(self.doorbell)
+        os.close(self.bell)
+    
+    def send(self, packet):
+        self.send_batch([packet])
+            
+    def send_batch(self, packets):
+        with self.lock:
+            self.packets.extend(packets)
+            self.wake_up()
+            
+    def interrupt(self):
+        with self.lock:
+            self.wake_up()
+            
+    def wake_up(self):
+        # Must be called with the lock held.
+        if self.waiting:
+            self.waiting = False
+            try:
+                os.write(self.bell, '\0')
+            except OSError, e:
+                # A full pipe will wake up the receiver anyway.
+                if e.errno != errno.EAGAIN:
+                    raise
+            
+    def receive_batch(self, timeout=None):
+        # Return up to BATCH_SIZE packets, waiting at most timeout seconds
+        # for them to be sent if none are queued.
+        with self.lock:
+            waiting = self.waiting = not self.packets and timeout != 0
+        if waiting:
+            select.select([self.doorbell], [], [], timeout)
+            try:
+                os.read(self.doorbell, 4096)
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    raise
+        with self.lock:
+            self.waiting = False
+            if not self.packets:
+                raise socket.timeout
+            packets = self.packets
+            batch = [packets.popleft()
+                     for _ in range(min(len(packets), self.BATCH_SIZE))]
+        return batch
+    
+    
+class SharedMemorySoquete(Soquete):
+    # Transport between processes of the same host through shared memory.
+    # Each process receives on a directory of its own under SHM_DIRECTORY,
+    # which holds one ring (see SharedMemoryRing) per process sending to it,
+    # named after the sender's pid, and a FIFO used as doorbell. Senders
+    # find the directory through a symbolic link named after the
+    # destination port, made while some endpoint is bound to it (addresses
+    # are not taken into account).
+    # Datagrams, with their IP header as built by the sender, are copied
+    # into the ring and from there into the receive buffers, with no system
+    # calls in between. The doorbell is rung, by writing the pid of the
+    # sender to it, only when the receiver is waiting on it and the first
+    # time a sender writes. Datagrams that do not fit in a ring are dropped.
+    # The rings of senders that exited are unmapped and removed once the
+    # receiver runs out of datagrams.
+    
+    PID = struct.Struct('=I')
+    DOORBELL = 'doorbell'
+    
+    @classmethod
+    def get_directory_for(cls, pid):
+        return os.path.join(SHM_DIRECTORY, 'ptc-%d' % pid)
+    
+    @classmethod
+    def get_link_for(cls, port):
+        return os.path.join(SHM_DIRECTORY, 'ptc-port-%d' % port)
+    
+    def __init__(self):
+        self.pid = os.getpid()
+        self.directory = self.get_directory_for(self.pid)
+        # A directory left by a process that had the same pid is stale.
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.mkdir(self.directory, 0700)
+        doorbell_path = os.path.join(self.directory, self.DOORBELL)
+        os.mkfifo(doorbell_path, 0600)
+        # Opened for writing as well so that it never reaches EOF.
+        self.doorbell = os.open(doorbell_path, os.O_RDWR | os.O_NONBLOCK)
+        self.ports = set()
+        # Receiving side: rings by sender pid.
+        self.inboxes = dict()
+        # Sending side: rings and doorbells by destination directory, and
+        # the directory of each destination port.
+        self.outboxes = dict()
+        self.directories = dict()
+        self.lock = threading.Lock()
+        self.buffers = [bytearray(self.MAX_SIZE)
+                        for _ in range(self.BATCH_SIZE)]
+        self.addresses = [ctypes.addressof((ctypes.c_char * self.MAX_SIZE).
+                                           from_buffer(buffer))
+                          for buffer in self.buffers]
+        self.closed = False
+        atexit.register(self.close)
+        
+    def get_mss_for(self, address):
+        # Rings take datagrams of any size.
+        return MAX_MSS
+        
+    def attach_filter(self, program):
+        return False
+    
+    def detach_filter(self):
+        pass
+    
+    def set_local_endpoints(self, endpoints):
+        ports = set(port for _, port in endpoints)
+        for port in ports - self.ports:
+            # Replace atomically any link left by some other process.
+            link = self.get_link_for(port)
+            temporary_link = '%s.%d' % (link, self.pid)
+            if os.path.lexists(temporary_link):
+                os.unlink(temporary_link)
+            os.symlink(self.directory, temporary_link)
+            os.rename(temporary_link, link)
+        for port in self.ports - ports:
+            self.remove_link(port)
+        self.ports = ports
+        
+    def remove_link(self, port):
+        link = self.get_link_for(port)
+        try:
+            if os.readlink(link) == self.directory:
+                os.unlink(link)
+        except OSError:
+            pass
+        
+    def forget(self, address, port):
+        with self.lock:
+            self.directories.pop(port, None)
+        
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            for port in self.ports:
+                self.remove_link(port)
+            for ring, doorbell in self.outboxes.values():
+                ring.close()
+                os.close(doorbell)
+            for ring in self.inboxes.values():
+                ring.close()
+            os.close(self.doorbell)
+            shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def get_outbox_for(self, port):
+        # Ring and doorbell for sending to port, or None if nobody is bound
+        # to it. The first boolean tells whether the ring is new.
+        directory = self.directories.get(port)
+        if directory is None:
+            try:
+                directory = os.readlink(self.get_link_for(port))
+            except OSError:
+                return None, False
+            self.directories[port] = directory
+        outbox = self.outboxes.get(directory)
+        if outbox is not None:
+            return outbox, False
+        try:
+            doorbell_path = os.path.join(directory, self.DOORBELL)
+            doorbell = os.open(doorbell_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            # The receiver is gone.
+            del self.directories[port]
+            return None, False
+        ring_path = os.path.join(directory, str(self.pid))
+        ring = SharedMemoryRing.open(ring_path, SHM_RING_SIZE)
+        outbox = self.outboxes[directory] = (ring, doorbell)
+        return outbox, True
+    
+    def send(self, packet):
+        self.send_batch([packet])
+        
+    def send_batch(self, packets):
+        # Packets of a batch go to the same destination, so the doorbell is
+        # rung at most once, after writing all of them.
+        with self.lock:
+            port = packets[0].get_destination_port()
+            outbox, new = self.get_outbox_for(port)
+            if outbox is None:
+                return
+            ring, doorbell = outbox
+            for packet in packets:
+                if not ring.put(packet.get_bytes()):
+                    break
+            if new or ring.is_waiting():
+                ring.set_waiting(False)
+                self.ring(doorbell)
+                
+    def ring(self, doorbell):
+        try:
+            os.write(doorbell, self.PID.pack(self.pid))
+        except OSError, e:
+            # A full pipe will wake up the receiver anyway. If it is gone,
+            # the datagram is lost.
+            if e.errno not in [errno.EAGAIN, errno.EPIPE]:
+                raise
+            
+    def answer_doorbell(self):
+        # Map the rings of the senders that rang for the first time.
+        try:
+            data = os.read(self.doorbell, 4096)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        for offset in range(0, len(data) - len(data) % self.PID.size,
+                            self.PID.size):
+            pid = self.PID.unpack_from(data, offset)[0]
+            if pid not in self.inboxes:
+                ring_path = os.path.join(self.directory, str(pid))
+                self.inboxes[pid] = SharedMemoryRing.open(ring_path,
+                                                          SHM_RING_SIZE)
+                
+    def forget_senders(self):
+        # Unmap the rings of the senders that exited, once drained.
+        for pid, ring in self.inboxes.items():
+            if ring.empty() and not self.is_alive(pid):
+                del self.inboxes[pid]
+                ring.close()
+                try:
+                    os.unlink(os.path.join(self.directory, str(pid)))
+                except OSError:
+                    pass
+                
+    def is_alive(self, pid):
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno != errno.ESRCH
+        return True
+                
+    def drain_rings(self):
+        views = list()
+        index = 0
+        for ring in self.inboxes.values():
+            while index < self.BATCH_SIZE:
+                size = ring.get_into(self.addresses[index])
+                if size is None:
+                    break
+                views.append(memoryview(self.buffers[index])[:size])
+                index += 1
+        return views
+    
+    def receive_batch(self, timeout=None):
+        self.answer_doorbell()
+        views = self.drain_rings()
+        if views:
+            return views
+        # Check the rings once more after announcing that we are about to
+        # wait, since datagrams written in between would not ring the
+        # doorbell. The timeout bounds the delay if the announcement is
+        # seen late.
+        for ring in self.inboxes.values():
+            ring.set_waiting(True)
+        views = self.drain_rings()
+        if not views:
+            readable, _, _ = select.select([self.doorbell], [], [], timeout)
+            if not readable:
+                self.forget_senders()
+                raise socket.timeout
+            self.answer_doorbell()
+            views = self.drain_rings()
+        for ring in self.inboxes.values():
+            ring.set_waiting(False)
+        return views
+    
+    
+TRANSPORTS = {
+    RAW_TRANSPORT: Soquete,
+    UDP_TRANSPORT: UDPSoquete,
+    MEMORY_TRANSPORT: MemorySoquete,
+    SHM_TRANSPORT: SharedMemorySoquete,
+}
+
+
+def get_transport(name):
+    if name not in TRANSPORTS:
+        raise PTCError('unknown transport: %s' % name)
+    return TRANSPORTS[name]
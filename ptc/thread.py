@@ -1,5 +1,4 @@
 import threading
-import socket
 import time
 
 from constants import CLOCK_TICK
@@ -40,18 +39,6 @@ class Clock(PTCThread):
         self.protocol.tick()
     
         
-class PacketReceiver(PTCThread):
-    
-    TIMEOUT = 0.5
-    
-    def do_run(self):
-        try:
-            packet = self.protocol.socket.receive(timeout=self.TIMEOUT)
-            self.protocol.handle_incoming(packet)
-        except socket.timeout:
-            pass
-        
-        
 class PacketSender(PTCThread):
     
     def __init__(self, protocol):
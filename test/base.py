@@ -70,6 +70,7 @@ class PTCTestCase(unittest.TestCase):
         self.end_event = threading.Event()
         self.threads = list()
         self.patch_socket()
+        self.patch_demultiplexer()
         self.patch_threads()
         self.set_up_packet_builder()
         self.set_up()
@@ -79,6 +80,7 @@ class PTCTestCase(unittest.TestCase):
         self.end_event.set()
         self.join_threads()
         self.restore_socket()
+        self.restore_demultiplexer()
         self.restore_threads()
         
     def set_up_packet_builder(self):
@@ -117,31 +119,40 @@ class PTCTestCase(unittest.TestCase):
     def patch_socket(self):
         def custom_send(_self, packet):
             self.network.send(packet)
-
-        def custom_receive(_self, timeout=None):
-            address = _self.address
-            port = _self.port
-            return self.network.receive_for(address, port, timeout=timeout)
-        
-        def custom_bind(_self, address, port):
-            _self.address = address
-            _self.port = port
         
         def dummy_method(_self, *args, **kwargs):
             pass
         
         socket_class = ptc.soquete.Soquete
         self.socket_send = getattr(socket_class, 'send')
-        self.socket_receive = getattr(socket_class, 'receive')
-        self.socket_bind = getattr(socket_class, 'bind')
         self.socket_close = getattr(socket_class, 'close')
         self.socket_init = getattr(socket_class, '__init__')
+        self.socket_attach_filter = getattr(socket_class, 'attach_filter')
+        self.socket_detach_filter = getattr(socket_class, 'detach_filter')
+        self.socket_get_mss_for = getattr(socket_class, 'get_mss_for')
         
         setattr(socket_class, 'send', custom_send)
-        setattr(socket_class, 'receive', custom_receive)
-        setattr(socket_class, 'bind', custom_bind)
         setattr(socket_class, 'close', dummy_method)
+        setattr(socket_class, 'attach_filter', dummy_method)
+        setattr(socket_class, 'detach_filter', dummy_method)
+        # Routes to the test addresses take segments of any size.
+        setattr(socket_class, 'get_mss_for',
+                lambda _self, address: ptc.constants.MAX_MSS)
         delattr(socket_class, '__init__')
+        
+    def patch_demultiplexer(self):
+        # Packets are handed to the demultiplexer by the network (see
+        # Network.send), so its receiving thread is never started. A fresh
+        # instance is used on every test.
+        def dummy_method(_self, *args, **kwargs):
+            pass
+        
+        demultiplexer_class = ptc.demux.PacketDemultiplexer
+        self.demultiplexer_start = getattr(demultiplexer_class,
+                                           'start_receiving')
+        setattr(demultiplexer_class, 'start_receiving', dummy_method)
+        demultiplexer_class.instances = dict()
+        self.network.demultiplexer = demultiplexer_class.get_instance()
     
     def patch_threads(self):
         def custom_run(_self):
@@ -168,10 +179,17 @@ class PTCTestCase(unittest.TestCase):
     def restore_socket(self):
         socket_class = ptc.soquete.Soquete
         setattr(socket_class, 'send', self.socket_send)
-        setattr(socket_class, 'receive', self.socket_receive)
-        setattr(socket_class, 'bind', self.socket_bind)
         setattr(socket_class, 'close', self.socket_close)
         setattr(socket_class, '__init__', self.socket_init)
+        setattr(socket_class, 'attach_filter', self.socket_attach_filter)
+        setattr(socket_class, 'detach_filter', self.socket_detach_filter)
+        setattr(socket_class, 'get_mss_for', self.socket_get_mss_for)
+        
+    def restore_demultiplexer(self):
+        demultiplexer_class = ptc.demux.PacketDemultiplexer
+        setattr(demultiplexer_class, 'start_receiving',
+                self.demultiplexer_start)
+        demultiplexer_class.instances = dict()
 
     def restore_threads(self):
         thread_class = ptc.thread.PTCThread
@@ -228,11 +246,14 @@ class PTCTestCase(unittest.TestCase):
 
 class ConnectedSocketTestCase(PTCTestCase):
     
-    DEFAULT_ISS = ptc.seqnum.SequenceNumber(20)
-    DEFAULT_IRS = ptc.seqnum.SequenceNumber(10)
+    DEFAULT_ISS = 20
+    DEFAULT_IRS = 10
     DEFAULT_IW = 10
     DEFAULT_DATA = 'data' * 5
     DEFAULT_TIMEOUT = 1
+    # Well below the initial RTO, so that nothing is retransmitted because
+    # of the timer.
+    TIMEOUT = 0.3
     
     def set_up(self):
         src_address, src_port = self.DEFAULT_DST_ADDRESS, self.DEFAULT_DST_PORT
@@ -249,6 +270,25 @@ class ConnectedSocketTestCase(PTCTestCase):
     def tear_down(self):
         self.socket.protocol.free()    
 
+    def build_ack(self, ack, blocks=None):
+        # SACK blocks, if any, are given relative to DEFAULT_ISS.
+        options = None
+        if blocks is not None:
+            blocks = [(self.DEFAULT_ISS + lo, self.DEFAULT_ISS + hi)
+                      for lo, hi in blocks]
+            options = ptc.options.encode_sack(blocks)
+        return self.packet_builder.build(flags=[ptc.packet.ACKFlag],
+                                         seq=self.DEFAULT_IRS, ack=ack,
+                                         window=self.DEFAULT_IW,
+                                         options=options)
+                                         
+    def send_segments(self, data, size):
+        # Send data in segments of the given size and receive them all.
+        self.socket.protocol.pmtu.set_maximum(size)
+        self.socket.send(data)
+        return [self.receive(self.DEFAULT_TIMEOUT)
+                for _ in range(len(data) / size)]
+
     def get_connected_socket(self, src_address, src_port, dst_address,
                              dst_port, iss, irs, send_window, receive_window):
         ptc_socket = ptc.Socket()
@@ -265,12 +305,76 @@ class ConnectedSocketTestCase(PTCTestCase):
         return ptc_socket        
     
 
+class TransportTestCase(unittest.TestCase):
+    
+    # Data exchange between actual PTC sockets over the transport named by
+    # TRANSPORT, which subclasses set.
+    
+    TRANSPORT = None
+    ADDRESS = '127.0.0.1'
+    SERVER_PORT = 6677
+    DATA = 'data sent through PTC' * 100
+    TIMEOUT = 5
+    
+    @classmethod
+    def close_transports(cls, timeout):
+        demultiplexer_class = ptc.demux.PacketDemultiplexer
+        for demultiplexer in demultiplexer_class.instances.values():
+            # Its thread exits once every endpoint is gone.
+            thread = demultiplexer.thread
+            if thread is not None:
+                thread.join(timeout)
+            demultiplexer.get_socket().close()
+        demultiplexer_class.instances = dict()
+    
+    def setUp(self):
+        if self.TRANSPORT is None:
+            self.skipTest('no transport given')
+        ptc.demux.PacketDemultiplexer.instances = dict()
+        
+    def tearDown(self):
+        self.close_transports(self.TIMEOUT)
+    
+    def run_server(self, received, ready):
+        with ptc.Socket(transport=self.TRANSPORT) as server:
+            server.bind((self.ADDRESS, self.SERVER_PORT))
+            server.listen()
+            ready.set()
+            server.accept(timeout=self.TIMEOUT)
+            data = str()
+            while len(data) < len(self.DATA):
+                data += server.recv(len(self.DATA))
+            received.append(data)
+            server.send(data[::-1])
+    
+    def test_data_exchange(self):
+        received = list()
+        ready = threading.Event()
+        thread = threading.Thread(target=self.run_server,
+                                  args=(received, ready))
+        thread.setDaemon(True)
+        thread.start()
+        ready.wait(self.TIMEOUT)
+        with ptc.Socket(transport=self.TRANSPORT) as client:
+            client.connect((self.ADDRESS, self.SERVER_PORT),
+                           timeout=self.TIMEOUT)
+            client.send(self.DATA)
+            data = str()
+            while len(data) < len(self.DATA):
+                data += client.recv(len(self.DATA))
+        thread.join(self.TIMEOUT)
+        
+        self.assertEqual([self.DATA], received)
+        self.assertEqual(self.DATA[::-1], data)
+    
+
 class Network(object):
     
     def __init__(self):
         self.channels = collections.defaultdict(Queue.Queue)
         self.channels_lock = threading.Lock()
         self.is_closed = False
+        self.demultiplexer = None
         
     def close(self):
         for channel in self.channels.values():
@@ -288,6 +392,12 @@ class Network(object):
         return self.get_channel_for(address, port)
         
     def send(self, packet):
+        # Packets for registered endpoints go through the demultiplexer, as
+        # they would when read from the raw socket. The rest are queued for
+        # the tests to receive.
+        if self.demultiplexer is not None and\
+           self.demultiplexer.dispatch(packet.get_bytes()):
+            return
         channel = self.get_channel_for_destination(packet)
         channel.put(packet)
         
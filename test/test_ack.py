@@ -2,7 +2,7 @@ import socket
 
 from base import ConnectedSocketTestCase
 
-from ptc.packet import ACKFlag
+from ptc.packet import ACKFlag, PTCPacketView
 
 
 class ACKTest(ConnectedSocketTestCase):
@@ -130,4 +130,25 @@ class ACKTest(ConnectedSocketTestCase):
         self.assertEquals(size, new_window)
         self.assertEquals(expected_ack, wnd_packet.get_ack_number())
         self.assertEquals(0, len(wnd_packet.get_payload()))
-        self.assertEquals(data, received_data)
\ No newline at end of file
+        self.assertEquals(data, received_data)
+        
+    def test_sending_single_ack_for_batch(self):
+        size = 10
+        data = self.DEFAULT_DATA[:size]
+        offsets = [0, 4, 7, size]
+        packets = list()
+        for start, end in zip(offsets, offsets[1:]):
+            packet = self.packet_builder.build(payload=data[start:end],
+                                               flags=[ACKFlag],
+                                               seq=self.DEFAULT_IRS + start,
+                                               ack=self.DEFAULT_ISS)
+            packet_bytes = memoryview(packet.get_bytes())
+            packets.append(PTCPacketView(packet_bytes))
+        self.socket.protocol.handle_incoming_batch(packets)
+        ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        ack_number = ack_packet.get_ack_number()
+        
+        self.assertIn(ACKFlag, ack_packet)
+        self.assertEqual(ack_number, self.DEFAULT_IRS + size)
+        self.assertRaises(socket.timeout, self.receive, self.DEFAULT_TIMEOUT)
+        self.assertEqual(data, self.socket.recv(size))
@@ -0,0 +1,77 @@
+import socket
+import unittest
+
+from ptc import bpf
+from ptc.packet import PTCPacket, PTCPacketView
+from ptc.soquete import Soquete
+
+
+class BPFFilterTest(unittest.TestCase):
+
+    # Filters can be attached to any socket, so they are tried on a pair of
+    # Unix datagram sockets carrying PTC datagrams. These are seen by the
+    # filter just like the ones received by the raw socket.
+
+    def setUp(self):
+        self.sender, receiver = socket.socketpair(socket.AF_UNIX,
+                                                  socket.SOCK_DGRAM)
+        receiver.settimeout(0.1)
+        self.socket = Soquete.__new__(Soquete)
+        self.socket.socket = receiver
+
+    def tearDown(self):
+        self.sender.close()
+        self.socket.socket.close()
+
+    def attach(self, endpoints):
+        endpoints = [(socket.inet_aton(address), port)
+                     for address, port in endpoints]
+        program = bpf.build_filter(endpoints)
+        if not self.socket.attach_filter(program):
+            self.skipTest('BPF filters not supported')
+
+    def send(self, address, port):
+        packet = PTCPacket()
+        packet.set_source_ip('10.0.0.100')
+        packet.set_destination_ip(address)
+        packet.set_source_port(5555)
+        packet.set_destination_port(port)
+        packet.set_payload('payload')
+        self.sender.send(packet.get_bytes())
+
+    def receive_all(self):
+        received = list()
+        while True:
+            try:
+                packet_bytes = self.socket.socket.recv(1024)
+            except socket.timeout:
+                return received
+            packet = PTCPacketView(memoryview(packet_bytes))
+            received.append((packet.get_destination_ip(),
+                             packet.get_destination_port()))
+
+    def test_datagrams_for_other_endpoints_dropped(self):
+        self.attach([('10.0.0.1', 80), ('10.0.0.2', 80),
+                     ('0.0.0.0', 90)])
+        destinations = [('10.0.0.1', 80), ('10.0.0.3', 80),
+                        ('10.0.0.1', 81), ('10.0.0.2', 80),
+                        ('10.0.0.4', 90)]
+        for address, port in destinations:
+            self.send(address, port)
+
+        self.assertEqual([('10.0.0.1', 80), ('10.0.0.2', 80),
+                          ('10.0.0.4', 90)],
+                         self.receive_all())
+
+    def test_empty_filter_drops_everything(self):
+        self.attach([])
+        self.send('10.0.0.1', 80)
+
+        self.assertEqual([], self.receive_all())
+
+    def test_too_many_addresses_do_not_fit(self):
+        endpoints = [(socket.inet_aton('10.0.%d.%d' % (i / 256, i % 256)), 80)
+                     for i in range(200)]
+
+        self.assertIsNone(bpf.build_filter(endpoints))
+        self.assertIsNotNone(bpf.build_filter(endpoints[:100]))
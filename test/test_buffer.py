@@ -1,7 +1,7 @@
 import threading
 import unittest
 
-from ptc.buffer import DataBuffer
+from ptc.buffer import DataBuffer, SendBuffer
 
 
 class BufferTest(unittest.TestCase):
@@ -79,4 +79,105 @@ class BufferTest(unittest.TestCase):
         thread1.join()
         thread2.join()
         thread3.join()
-        thread4.join()
\ No newline at end of file
+        thread4.join()
+        
+    def test_zero_copy_reads(self):
+        second_chunk = 'second chunk'
+        self.buffer.put(self.data)
+        self.buffer.put(second_chunk)
+        
+        data1 = self.buffer.get(10, copy=False)
+        data2 = self.buffer.get(len(self.data), copy=False)
+        data3 = self.buffer.get(len(self.data))
+        
+        self.assertIsInstance(data1, memoryview)
+        self.assertEqual(self.data[:10], data1.tobytes())
+        self.assertEqual(self.data[10:] + second_chunk[:10], data2.tobytes())
+        self.assertEqual(second_chunk[10:], data3)
+        self.assertTrue(self.buffer.empty())
+        
+    def test_large_put_read_in_segments(self):
+        data = ''.join(chr(i % 256) for i in range(10000))
+        self.buffer.put(bytearray(data))
+        
+        segments = list()
+        while not self.buffer.empty():
+            segments.append(self.buffer.get(1000))
+        
+        self.assertEqual(10, len(segments))
+        self.assertEqual(data, ''.join(segments))
+        self.assertEqual(self.DEFAULT_START_INDEX + len(data),
+                         self.buffer.get_last_index())
+
+
+class SendBufferTest(unittest.TestCase):
+    
+    DEFAULT_START_INDEX = 15672
+    DEFAULT_DATA = 'data' * 10
+    
+    def setUp(self):
+        self.data = self.DEFAULT_DATA
+        self.buffer = SendBuffer(start_index=self.DEFAULT_START_INDEX)
+        
+    def test_data_kept_until_acknowledged(self):
+        self.buffer.put(self.data)
+        segments = self.buffer.get_segments(len(self.data), 16)
+        
+        self.assertEqual([16, 16, 8], [len(segment) for segment in segments])
+        self.assertFalse(self.buffer.has_unsent_data())
+        self.assertEqual(len(self.data),
+                         self.buffer.get_unacknowledged_size())
+        
+        self.buffer.acknowledge(self.DEFAULT_START_INDEX + 10)
+        data = self.buffer.get_range(self.DEFAULT_START_INDEX + 10, 100)
+        
+        self.assertEqual(self.data[10:], data.tobytes())
+        self.assertEqual(len(self.data) - 10,
+                         self.buffer.get_unacknowledged_size())
+        
+    def test_range_spanning_several_chunks(self):
+        second_chunk = 'second chunk'
+        self.buffer.put(self.data)
+        self.buffer.put(second_chunk)
+        self.buffer.get_segments(len(self.data) + 5, 1000)
+        start = self.DEFAULT_START_INDEX + len(self.data) - 5
+        
+        data = self.buffer.get_range(start, 100)
+        
+        # Only bytes already handed out are returned.
+        self.assertEqual(self.data[-5:] + second_chunk[:5], data.tobytes())
+        self.assertTrue(self.buffer.has_unsent_data())
+        
+    def test_acknowledged_data_not_returned(self):
+        self.buffer.put(self.data)
+        self.buffer.get_segments(len(self.data), len(self.data))
+        self.buffer.acknowledge(self.DEFAULT_START_INDEX + len(self.data))
+        
+        data = self.buffer.get_range(self.DEFAULT_START_INDEX, 10)
+        
+        self.assertEqual(0, len(data))
+        self.assertEqual(0, self.buffer.get_unacknowledged_size())
+        
+    def test_acknowledgement_makes_room(self):
+        self.buffer.set_max_size(len(self.data))
+        self.buffer.put(self.data)
+        self.buffer.get_segments(len(self.data), len(self.data))
+        thread = threading.Thread(target=self.buffer.wait_for_space)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(0.1)
+        
+        self.assertEqual(0, self.buffer.get_free_space())
+        self.assertTrue(thread.is_alive())
+        
+        # Writers wait until half of the buffer is free.
+        self.buffer.acknowledge(self.DEFAULT_START_INDEX + 10)
+        thread.join(0.1)
+        
+        self.assertTrue(thread.is_alive())
+        
+        self.buffer.acknowledge(self.DEFAULT_START_INDEX + 20)
+        thread.join(1)
+        
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(20, self.buffer.get_free_space())
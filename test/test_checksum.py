@@ -0,0 +1,98 @@
+import random
+import struct
+import unittest
+
+from ptc.checksum import IPChecksumAlgorithm
+from ptc.exceptions import ChecksumError
+from ptc.packet import PTCPacket
+from ptc.packet_utils import PacketDecoder
+
+
+class ChecksumTest(unittest.TestCase):
+
+    # Example from the Wikipedia article on the IPv4 header checksum.
+    HEADER = 'E\x00\x00s\x00\x00@\x00@\x11\x00\x00'
+    HEADER += '\xc0\xa8\x00\x01\xc0\xa8\x00\xc7'
+    HEADER_CHECKSUM = 0xb861
+
+    def reference_value(self, message):
+        if len(message) % 2 == 1:
+            message += '\0'
+        value = 0
+        for i in range(0, len(message), 2):
+            value += (ord(message[i]) << 8) + ord(message[i+1])
+        while value >> 16:
+            value = (value & 0xffff) + (value >> 16)
+        return ~value & 0xffff
+
+    def get_random_bytes(self, size):
+        return ''.join(chr(random.randint(0, 255)) for _ in range(size))
+
+    def get_packet(self):
+        packet = PTCPacket()
+        packet.set_source_ip('192.168.0.101')
+        packet.set_destination_ip('192.168.0.102')
+        packet.set_source_port(55221)
+        packet.set_destination_port(22)
+        packet.set_payload('payload')
+        return packet
+
+    def test_known_header_checksum(self):
+        value = IPChecksumAlgorithm.for_bytes(self.HEADER).value()
+
+        self.assertEqual(self.HEADER_CHECKSUM, value)
+
+    def test_checksum_matches_reference_implementation(self):
+        for size in [0, 1, 2, 19, 20, 36, 1499, 1500]:
+            message = self.get_random_bytes(size)
+            value = IPChecksumAlgorithm.for_bytes(message).value()
+
+            self.assertEqual(self.reference_value(message), value)
+
+    def test_checksum_of_buffers(self):
+        value = IPChecksumAlgorithm.for_bytes(bytearray(self.HEADER)).value()
+        self.assertEqual(self.HEADER_CHECKSUM, value)
+
+        value = IPChecksumAlgorithm.for_bytes(memoryview(self.HEADER)).value()
+        self.assertEqual(self.HEADER_CHECKSUM, value)
+
+    def set_checksum_on(self, header, checksum):
+        checksum_offset = 10
+        return header[:checksum_offset] + struct.pack('!H', checksum) +\
+               header[checksum_offset+2:]
+
+    def test_incremental_update(self):
+        ttl_offset = 8
+        header = self.set_checksum_on(self.HEADER, self.HEADER_CHECKSUM)
+        old_word = struct.unpack('!H', header[ttl_offset:ttl_offset+2])[0]
+        new_word = (32 << 8) | (old_word & 0xff)
+        new_header = header[:ttl_offset] + struct.pack('!H', new_word) +\
+                     header[ttl_offset+2:]
+
+        value = IPChecksumAlgorithm.update_word(self.HEADER_CHECKSUM,
+                                                old_word, new_word)
+        new_header = self.set_checksum_on(new_header, value)
+
+        self.assertTrue(IPChecksumAlgorithm.is_valid(header))
+        self.assertTrue(IPChecksumAlgorithm.is_valid(new_header))
+
+    def test_checksum_computed_on_serialization(self):
+        packet = self.get_packet()
+        packet.set_id_number(4321)
+        packet.set_type_of_service(0x10)
+        packet_bytes = packet.get_bytes()
+        header_bytes = packet_bytes[:packet.IP_HEADER_SIZE]
+        checksum = packet.get_checksum()
+
+        self.assertTrue(IPChecksumAlgorithm.is_valid(header_bytes))
+        self.assertEqual(header_bytes, packet.get_ip_header_bytes(checksum))
+
+    def test_decoder_verifies_checksum(self):
+        packet_bytes = self.get_packet().get_bytes()
+        decoder = PacketDecoder(verify_checksum=True)
+
+        packet = decoder.decode(packet_bytes)
+        self.assertEqual('payload', packet.get_payload())
+
+        corrupted_bytes = packet_bytes[:8] + '\x01' + packet_bytes[9:]
+        self.assertRaises(ChecksumError, decoder.decode, corrupted_bytes)
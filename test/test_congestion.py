@@ -0,0 +1,256 @@
+import socket
+import unittest
+
+from base import ConnectedSocketTestCase
+from ptc.congestion import RenoCongestionControl, CUBICCongestionControl,\
+                           LEDBATCongestionControl, get_congestion_control
+from ptc.constants import RENO, CUBIC, LEDBAT, LEDBAT_TARGET,\
+                          LEDBAT_MIN_CWND, LEDBAT_CURRENT_FILTER,\
+                          LEDBAT_BASE_HISTORY
+from ptc.exceptions import PTCError
+from ptc.packet import ACKFlag
+
+
+class CUBICWithClock(CUBICCongestionControl):
+
+    RTT = 0.5
+    
+    def __init__(self):
+        CUBICCongestionControl.__init__(self, None)
+        self.time = 0
+        
+    def get_time(self):
+        return self.time
+        
+    def get_rtt(self):
+        return self.RTT
+
+
+class LEDBATWithClock(LEDBATCongestionControl):
+
+    def __init__(self):
+        LEDBATCongestionControl.__init__(self, None)
+        self.time = 0
+        
+    def get_time(self):
+        return self.time
+
+
+class CongestionControlTestMixin(object):
+
+    MSS = 1000
+    
+    def round_trip(self):
+        # Every segment of a full window gets acknowledged.
+        cwnd = self.congestion_control.get_cwnd()
+        for _ in range(cwnd / self.MSS):
+            self.congestion_control.process_ack(self.MSS, cwnd, self.MSS)
+        return float(self.congestion_control.get_cwnd()) / self.MSS
+
+
+class RenoCongestionControlTest(CongestionControlTestMixin,
+                                unittest.TestCase):
+                                
+    def setUp(self):
+        self.congestion_control = RenoCongestionControl(None)
+        self.congestion_control.reset(self.MSS)
+        
+    def set_window(self, segments):
+        # Leave slow start with a window of the given size.
+        self.congestion_control.enter_recovery(2 * segments * self.MSS,
+                                               self.MSS)
+        self.congestion_control.exit_recovery(segments * self.MSS, self.MSS)
+        
+    def test_initial_window(self):
+        self.assertEqual(10 * self.MSS, self.congestion_control.get_cwnd())
+        
+        self.congestion_control.reset(9000)
+        
+        self.assertEqual(2 * 9000, self.congestion_control.get_cwnd())
+        
+    def test_slow_start_doubles_window_per_round_trip(self):
+        self.assertEqual(20, self.round_trip())
+        
+    def test_window_grows_only_while_limiting(self):
+        self.congestion_control.process_ack(self.MSS, self.MSS, self.MSS)
+        
+        self.assertEqual(10 * self.MSS, self.congestion_control.get_cwnd())
+        
+    def test_congestion_avoidance_adds_a_segment_per_round_trip(self):
+        self.set_window(10)
+        
+        self.assertAlmostEqual(11, self.round_trip(), delta=0.1)
+        
+    def test_fast_recovery(self):
+        self.congestion_control.enter_recovery(20 * self.MSS, self.MSS)
+        
+        self.assertEqual(10 * self.MSS, self.congestion_control.get_ssthresh())
+        self.assertEqual(13 * self.MSS, self.congestion_control.get_cwnd())
+        
+        self.congestion_control.process_duplicate_ack(self.MSS)
+        self.congestion_control.process_partial_ack(4 * self.MSS, self.MSS)
+        
+        self.assertEqual(11 * self.MSS, self.congestion_control.get_cwnd())
+        
+        self.congestion_control.exit_recovery(2 * self.MSS, self.MSS)
+        
+        self.assertEqual(3 * self.MSS, self.congestion_control.get_cwnd())
+        
+    def test_timeout_falls_back_to_one_segment(self):
+        self.congestion_control.process_timeout(20 * self.MSS, self.MSS,
+                                                first=True)
+        self.congestion_control.process_timeout(self.MSS, self.MSS,
+                                                first=False)
+                                                
+        self.assertEqual(self.MSS, self.congestion_control.get_cwnd())
+        self.assertEqual(10 * self.MSS, self.congestion_control.get_ssthresh())
+        
+    def test_unknown_algorithm(self):
+        self.assertIs(CUBICCongestionControl, get_congestion_control(CUBIC))
+        self.assertRaises(PTCError, get_congestion_control, 'unknown')
+
+
+class CUBICCongestionControlTest(CongestionControlTestMixin,
+                                 unittest.TestCase):
+                                 
+    def setUp(self):
+        self.congestion_control = CUBICWithClock()
+        self.congestion_control.reset(self.MSS)
+        
+    def run_round_trips(self, count):
+        windows = list()
+        for _ in range(count):
+            windows.append(self.round_trip())
+            self.congestion_control.time += CUBICWithClock.RTT
+        return windows
+        
+    def test_smaller_decrease_than_reno(self):
+        self.congestion_control.enter_recovery(20 * self.MSS, self.MSS)
+        
+        self.assertEqual(14 * self.MSS, self.congestion_control.get_ssthresh())
+        
+    def test_window_levels_off_around_last_maximum(self):
+        self.congestion_control.cwnd = 20 * self.MSS
+        self.congestion_control.enter_recovery(20 * self.MSS, self.MSS)
+        self.congestion_control.exit_recovery(14 * self.MSS, self.MSS)
+        windows = self.run_round_trips(12)
+        
+        # Back near 20 segments quickly, faster than Reno would...
+        self.assertTrue(windows[2] - windows[1] > 1)
+        self.assertTrue(19 < windows[4] < 20.5)
+        # ...then stays there for a while...
+        self.assertTrue(windows[5] - windows[4] < 1)
+        # ...and finally probes for more.
+        self.assertTrue(windows[-1] > 25)
+
+
+class LEDBATCongestionControlTest(CongestionControlTestMixin,
+                                  unittest.TestCase):
+                                  
+    BASE_DELAY = 0.05
+    
+    def setUp(self):
+        self.congestion_control = LEDBATWithClock()
+        self.congestion_control.reset(self.MSS)
+        self.congestion_control.cwnd = 10 * self.MSS
+        
+    def sample_delays(self, *delays):
+        for delay in delays:
+            self.congestion_control.process_rtt_sample(delay)
+            
+    def sample_current_delay(self, delay):
+        # Enough samples for older ones to be left out of the current delay.
+        self.sample_delays(*[delay] * LEDBAT_CURRENT_FILTER)
+        
+    def test_window_kept_until_delay_measured(self):
+        self.assertEqual(10, self.round_trip())
+        
+    def test_window_grows_without_queueing(self):
+        self.sample_delays(self.BASE_DELAY)
+        
+        self.assertAlmostEqual(11, self.round_trip(), delta=0.1)
+        
+    def test_window_grows_slower_near_target(self):
+        self.sample_delays(self.BASE_DELAY)
+        self.sample_current_delay(self.BASE_DELAY + LEDBAT_TARGET / 2)
+        
+        self.assertAlmostEqual(10.5, self.round_trip(), delta=0.1)
+        
+    def test_window_shrinks_beyond_target(self):
+        self.sample_delays(self.BASE_DELAY)
+        self.sample_current_delay(self.BASE_DELAY + 2 * LEDBAT_TARGET)
+        
+        self.assertAlmostEqual(9, self.round_trip(), delta=0.1)
+        
+        self.sample_current_delay(self.BASE_DELAY + 10 * LEDBAT_TARGET)
+        for _ in range(5):
+            self.round_trip()
+            
+        self.assertEqual(LEDBAT_MIN_CWND * self.MSS,
+                         self.congestion_control.get_cwnd())
+                         
+    def test_base_delay_from_recent_minutes(self):
+        self.sample_delays(self.BASE_DELAY)
+        self.congestion_control.time += 60
+        self.sample_current_delay(2 * self.BASE_DELAY)
+        
+        self.assertAlmostEqual(self.BASE_DELAY,
+                               self.congestion_control.get_queueing_delay())
+                               
+        # Once the oldest minute goes out of the history, the base delay
+        # is the lowest among the rest.
+        for _ in range(LEDBAT_BASE_HISTORY):
+            self.congestion_control.time += 60
+            self.sample_delays(2 * self.BASE_DELAY)
+            
+        self.assertAlmostEqual(0, self.congestion_control.get_queueing_delay())
+        
+    def test_window_bounded_by_data_in_flight(self):
+        self.sample_delays(self.BASE_DELAY)
+        self.congestion_control.process_ack(self.MSS, 2 * self.MSS, self.MSS)
+        
+        self.assertEqual(3 * self.MSS, self.congestion_control.get_cwnd())
+        
+    def test_loss_halves_window(self):
+        self.congestion_control.enter_recovery(10 * self.MSS, self.MSS)
+        
+        self.assertEqual(5 * self.MSS, self.congestion_control.get_ssthresh())
+        self.assertIs(LEDBATCongestionControl, get_congestion_control(LEDBAT))
+
+
+class CongestionWindowTest(ConnectedSocketTestCase):
+
+    def test_data_in_flight_limited_by_cwnd(self):
+        self.socket.protocol.pmtu.set_maximum(2)
+        self.socket.protocol.congestion_control.cwnd = 4
+        self.socket.send(self.DEFAULT_DATA[:10])
+        packets = [self.receive(self.DEFAULT_TIMEOUT) for _ in range(2)]
+        
+        self.assertEqual(4, sum(len(packet.get_payload())
+                                for packet in packets))
+        self.assertRaises(socket.timeout, self.receive, 0.3)
+        
+        # Slow start lets one more segment go after this ACK.
+        ack_packet = self.packet_builder.build(flags=[ACKFlag],
+                                               seq=self.DEFAULT_IRS,
+                                               ack=self.DEFAULT_ISS + 4,
+                                               window=self.DEFAULT_IW)
+        self.send(ack_packet)
+        packets = [self.receive(self.DEFAULT_TIMEOUT) for _ in range(3)]
+        
+        self.assertEqual([self.DEFAULT_ISS + 4, self.DEFAULT_ISS + 6,
+                          self.DEFAULT_ISS + 8],
+                         [packet.get_seq_number() for packet in packets])
+                         
+    def test_algorithm_chosen_per_socket(self):
+        self.socket.set_congestion_control(CUBIC)
+        
+        self.assertIsInstance(self.socket.protocol.congestion_control,
+                              CUBICCongestionControl)
+        self.assertRaises(PTCError, self.socket.set_congestion_control,
+                          'unknown')
+                          
+        self.socket.set_congestion_control(RENO)
+        
+        self.assertIsInstance(self.socket.protocol.congestion_control,
+                              RenoCongestionControl)
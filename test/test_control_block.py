@@ -1,6 +1,7 @@
 from base import PTCTestCase
 from ptc import constants
-from ptc.packet import ACKFlag
+from ptc.buffer import DataBuffer
+from ptc.packet import ACKFlag, PTCPacketView
 from ptc.cblock import PTCControlBlock
 from ptc.seqnum import SequenceNumber
 
@@ -51,7 +52,8 @@ class ControlBlockTest(PTCTestCase):
     def test_extraction_of_outgoing_data(self):
         data = self.DEFAULT_DATA
         self.control_block.to_out_buffer(data)
-        to_send = self.control_block.extract_from_out_buffer(self.MSS)
+        [(_, to_send)] = self.control_block.extract_segments_from_out_buffer(
+            self.MSS, max_segments=1)
         snd_nxt = self.control_block.get_snd_nxt()
         snd_una = self.control_block.get_snd_una()
         usable_window_size = self.control_block.usable_window_size()
@@ -60,7 +62,8 @@ class ControlBlockTest(PTCTestCase):
         self.assertEquals(self.DEFAULT_ISS + len(to_send), snd_nxt)
         self.assertEquals(self.DEFAULT_IW - len(to_send), usable_window_size)
         
-        to_send = self.control_block.extract_from_out_buffer(self.MSS)
+        [(_, to_send)] = self.control_block.extract_segments_from_out_buffer(
+            self.MSS, max_segments=1)
         snd_nxt = self.control_block.get_snd_nxt()
         snd_una = self.control_block.get_snd_una()
         usable_window_size = self.control_block.usable_window_size()
@@ -76,8 +79,11 @@ class ControlBlockTest(PTCTestCase):
         mss = len(data) / 2
         self.control_block.to_out_buffer(data)
         
-        to_send = self.control_block.extract_from_out_buffer(mss)
-        to_send += self.control_block.extract_from_out_buffer(mss)
+        segments = self.control_block.extract_segments_from_out_buffer(
+            mss, max_segments=1)
+        segments += self.control_block.extract_segments_from_out_buffer(
+            mss, max_segments=1)
+        to_send = ''.join(payload.tobytes() for _, payload in segments)
         snd_nxt = self.control_block.get_snd_nxt()
         snd_una = self.control_block.get_snd_una()
         usable_window_size = self.control_block.usable_window_size()
@@ -86,6 +92,26 @@ class ControlBlockTest(PTCTestCase):
         self.assertEquals(0, usable_window_size)
         self.assertEquals(self.DEFAULT_IW, len(to_send))
 
+    def test_extraction_of_segments_in_bulk(self):
+        data = self.DEFAULT_DATA * self.DEFAULT_IW
+        self.control_block.to_out_buffer(data)
+        segments = self.control_block.extract_segments_from_out_buffer(
+            self.MSS)
+        seq_numbers = [seq_number for seq_number, _ in segments]
+        payloads = [payload for _, payload in segments]
+        snd_nxt = self.control_block.get_snd_nxt()
+        
+        self.assertEquals(self.DEFAULT_ISS + self.DEFAULT_IW, snd_nxt)
+        self.assertEquals(0, self.control_block.usable_window_size())
+        self.assertEquals(data[:self.DEFAULT_IW],
+                          ''.join(payload.tobytes() for payload in payloads))
+        self.assertTrue(all(len(payload) <= self.MSS
+                            for payload in payloads))
+        self.assertIsInstance(payloads[0], memoryview)
+        self.assertEquals(self.DEFAULT_ISS + self.MSS, seq_numbers[1])
+        self.assertEquals([], self.control_block.
+                              extract_segments_from_out_buffer(self.MSS))
+        
     def test_reception_of_valid_ack(self):
         size = 100
         ack_number = self.DEFAULT_ISS + size
@@ -403,4 +429,110 @@ class ControlBlockTest(PTCTestCase):
         self.assertEquals(self.DEFAULT_IRS + size, rcv_nxt)
         self.assertEquals(payload[:rcv_size], data1)
         self.assertEquals(payload[rcv_size:], data2)
-                
\ No newline at end of file
+        
+    def test_reception_of_new_data_from_packet_view(self):
+        size = 100
+        payload = self.DEFAULT_DATA[:size]
+        packet = self.packet_builder.build(flags=[ACKFlag],
+                                           seq=self.DEFAULT_IRS,
+                                           ack=self.DEFAULT_ISS,
+                                           payload=payload)
+        view = PTCPacketView(memoryview(packet.get_bytes()))
+        
+        self.control_block.process_incoming(view)
+        rcv_nxt = self.control_block.get_rcv_nxt()
+        data = self.control_block.from_in_buffer(size)
+        
+        self.assertEquals(self.DEFAULT_IRS + size, rcv_nxt)
+        self.assertEquals(payload, data)
+        self.assertIsInstance(data, str)
+        
+    def test_out_of_order_data_reassembled_across_wraparound(self):
+        size = 100
+        offset = 50
+        payload = self.DEFAULT_DATA[:size]
+        irs = constants.MAX_SEQ - 20
+        control_block = PTCControlBlock(self.DEFAULT_ISS, irs, self.DEFAULT_IW,
+                                        self.DEFAULT_IW)
+        packet1 = self.packet_builder.build(flags=[ACKFlag],
+                                            seq=irs + offset,
+                                            ack=self.DEFAULT_ISS,
+                                            payload=payload[offset:])
+        packet2 = self.packet_builder.build(flags=[ACKFlag],
+                                            seq=irs,
+                                            ack=self.DEFAULT_ISS,
+                                            payload=payload[:offset+10])
+        
+        control_block.process_incoming(packet1)
+        rcv_wnd = control_block.get_rcv_wnd()
+        control_block.process_incoming(packet2)
+        rcv_nxt = control_block.get_rcv_nxt()
+        data = control_block.from_in_buffer(size)
+        
+        self.assertEquals(self.DEFAULT_IW, rcv_wnd)
+        self.assertEquals((irs + size) % (constants.MAX_SEQ + 1), rcv_nxt)
+        self.assertEquals(payload, data)
+        
+    def test_rcv_wnd_accounts_for_reassembled_data(self):
+        size = 100
+        offset = 50
+        payload = self.DEFAULT_DATA[:size]
+        packet1 = self.packet_builder.build(flags=[ACKFlag],
+                                            seq=self.DEFAULT_IRS + offset,
+                                            ack=self.DEFAULT_ISS,
+                                            payload=payload[offset:])
+        packet2 = self.packet_builder.build(flags=[ACKFlag],
+                                            seq=self.DEFAULT_IRS,
+                                            ack=self.DEFAULT_ISS,
+                                            payload=payload[:offset])
+        
+        self.control_block.process_incoming(packet1)
+        self.control_block.process_incoming(packet2)
+        rcv_wnd = self.control_block.get_rcv_wnd()
+        
+        # The right edge of the window must not move.
+        self.assertEquals(self.DEFAULT_IW - size, rcv_wnd)
+        
+    def test_rcv_wnd_capped_by_reassembly_limit(self):
+        limit = 100
+        offset = 50
+        payload = self.DEFAULT_DATA[:2*limit]
+        control_block = PTCControlBlock(self.DEFAULT_ISS, self.DEFAULT_IRS,
+                                        self.DEFAULT_IW, self.DEFAULT_IW,
+                                        reassembly_limit=limit)
+        packet1 = self.packet_builder.build(flags=[ACKFlag],
+                                            seq=self.DEFAULT_IRS + offset,
+                                            ack=self.DEFAULT_ISS,
+                                            payload=payload[offset:])
+        packet2 = self.packet_builder.build(flags=[ACKFlag],
+                                            seq=self.DEFAULT_IRS,
+                                            ack=self.DEFAULT_ISS,
+                                            payload=payload[:offset])
+        
+        rcv_wnd = control_block.get_rcv_wnd()
+        out_of_order = control_block.process_incoming(packet1)
+        control_block.process_incoming(packet2)
+        rcv_nxt = control_block.get_rcv_nxt()
+        data = control_block.from_in_buffer(len(payload))
+        
+        # Data beyond the window announced is dropped, so that what is held
+        # out of order stays below the limit.
+        self.assertEquals(limit, rcv_wnd)
+        self.assertTrue(out_of_order)
+        self.assertEquals(self.DEFAULT_IRS + limit, rcv_nxt)
+        self.assertEquals(payload[:limit], data)
+        self.assertEquals(limit, control_block.get_rcv_wnd())
+        
+    def test_out_of_order_data_beyond_limit_not_reported(self):
+        offset = 50
+        self.control_block.in_buffer = DataBuffer(start_index=self.DEFAULT_IRS,
+                                                  reassembly_limit=offset)
+        packet = self.packet_builder.build(flags=[ACKFlag],
+                                           seq=self.DEFAULT_IRS + offset,
+                                           ack=self.DEFAULT_ISS,
+                                           payload=self.DEFAULT_DATA)
+                                           
+        out_of_order = self.control_block.process_incoming(packet)
+        
+        self.assertFalse(out_of_order)
+        self.assertEquals([], self.control_block.get_sack_blocks())
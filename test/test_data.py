@@ -1,5 +1,8 @@
+import threading
+
 from base import ConnectedSocketTestCase
 
+from ptc.exceptions import PTCError, WouldBlockError
 from ptc.packet import ACKFlag
 
 
@@ -31,6 +34,82 @@ class DataExchangeTest(ConnectedSocketTestCase):
         data = self.receive_data()
         self.assertEqual(self.DEFAULT_DATA, data)
         
+    def test_window_sent_as_single_batch(self):
+        batches = list()
+        socket = self.socket.protocol.socket
+        send_batch = socket.send_batch
+        def custom_send_batch(packets):
+            batches.append(packets)
+            send_batch(packets)
+        socket.send_batch = custom_send_batch
+        self.socket.protocol.pmtu.set_maximum(4)
+        self.socket.send(self.DEFAULT_DATA)
+        data = self.receive_data()
+        
+        self.assertEqual(self.DEFAULT_DATA, data)
+        self.assertEqual([4, 4, 2], [packet.get_payload_size()
+                                     for packet in batches[0]])
+        
+    def test_non_blocking_send_takes_what_fits(self):
+        self.socket.set_send_buffer_size(8)
+        self.socket.setblocking(False)
+        taken = self.socket.send(self.DEFAULT_DATA)
+        
+        self.assertEqual(8, taken)
+        self.assertRaises(WouldBlockError, self.socket.send, self.DEFAULT_DATA)
+        self.assertEqual(self.DEFAULT_DATA[:8], self.receive_data())
+        self.assertEqual(4, self.socket.send(self.DEFAULT_DATA[8:12]))
+        
+    def test_blocking_send_waits_for_room(self):
+        self.socket.set_send_buffer_size(8)
+        thread = threading.Thread(target=self.socket.send,
+                                  args=(self.DEFAULT_DATA,))
+        thread.setDaemon(True)
+        thread.start()
+        data = self.receive_data()
+        thread.join(self.DEFAULT_TIMEOUT)
+        
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.DEFAULT_DATA, data)
+        
+    def test_blocked_send_fails_once_connection_freed(self):
+        self.socket.set_send_buffer_size(8)
+        errors = list()
+        def send():
+            try:
+                self.socket.send(self.DEFAULT_DATA)
+            except PTCError, e:
+                errors.append(e)
+        thread = threading.Thread(target=send)
+        thread.setDaemon(True)
+        thread.start()
+        thread.join(0.1)
+        blocked = thread.is_alive()
+        # As when the other end stops answering for too long.
+        self.socket.protocol.free()
+        thread.join(self.DEFAULT_TIMEOUT)
+        
+        self.assertTrue(blocked)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(1, len(errors))
+        
+    def test_drain_waits_for_acknowledgements(self):
+        self.socket.send(self.DEFAULT_DATA)
+        drained = threading.Event()
+        def drain():
+            self.socket.drain()
+            drained.set()
+        thread = threading.Thread(target=drain)
+        thread.setDaemon(True)
+        thread.start()
+        
+        self.assertFalse(drained.wait(0.1))
+        
+        self.receive_data()
+        thread.join(self.DEFAULT_TIMEOUT)
+        
+        self.assertTrue(drained.is_set())
+        
     def test_receiving_data_out_of_order(self):
         size = 9
         offset = 4
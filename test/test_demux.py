@@ -0,0 +1,111 @@
+from base import PTCTestCase
+from ptc.constants import NULL_ADDRESS
+from ptc.demux import PacketDemultiplexer
+from ptc.packet import SYNFlag
+
+
+class EndpointMock(object):
+    
+    def __init__(self):
+        self.packets = list()
+        self.batches = list()
+        
+    def handle_incoming(self, packet):
+        self.packets.append(packet)
+        
+    def handle_incoming_batch(self, packets):
+        self.batches.append(packets)
+        self.packets.extend(packets)
+
+
+class PacketDemultiplexerTest(PTCTestCase):
+    
+    def set_up(self):
+        self.demultiplexer = PacketDemultiplexer()
+        self.packet = self.packet_builder.build(flags=[SYNFlag], seq=1111)
+        
+    def register(self, address, port, remote_address=None, remote_port=None):
+        endpoint = EndpointMock()
+        self.demultiplexer.register(endpoint, address, port, remote_address,
+                                    remote_port)
+        return endpoint
+    
+    def test_dispatch_to_connected_endpoint(self):
+        endpoint = self.register(self.DEFAULT_DST_ADDRESS,
+                                 self.DEFAULT_DST_PORT,
+                                 self.DEFAULT_SRC_ADDRESS,
+                                 self.DEFAULT_SRC_PORT)
+        dispatched = self.demultiplexer.dispatch(self.packet.get_bytes())
+        
+        self.assertTrue(dispatched)
+        self.assertEqual(1, len(endpoint.packets))
+        self.assertEqual(1111, endpoint.packets[0].get_seq_number())
+        self.assertIn(SYNFlag, endpoint.packets[0])
+        
+    def test_connected_endpoint_preferred_over_listening_ones(self):
+        wildcard = self.register(NULL_ADDRESS, self.DEFAULT_DST_PORT)
+        listening = self.register(self.DEFAULT_DST_ADDRESS,
+                                  self.DEFAULT_DST_PORT)
+        other = self.register(self.DEFAULT_DST_ADDRESS,
+                              self.DEFAULT_DST_PORT,
+                              self.DEFAULT_SRC_ADDRESS,
+                              self.DEFAULT_SRC_PORT + 1)
+        
+        self.demultiplexer.dispatch(self.packet.get_bytes())
+        self.assertEqual(1, len(listening.packets))
+        
+        connected = self.register(self.DEFAULT_DST_ADDRESS,
+                                  self.DEFAULT_DST_PORT,
+                                  self.DEFAULT_SRC_ADDRESS,
+                                  self.DEFAULT_SRC_PORT)
+        self.demultiplexer.dispatch(self.packet.get_bytes())
+        
+        self.assertEqual(1, len(connected.packets))
+        self.assertEqual(1, len(listening.packets))
+        self.assertEqual(0, len(wildcard.packets))
+        self.assertEqual(0, len(other.packets))
+        
+    def test_dispatch_to_endpoint_bound_to_null_address(self):
+        endpoint = self.register(NULL_ADDRESS, self.DEFAULT_DST_PORT)
+        dispatched = self.demultiplexer.dispatch(self.packet.get_bytes())
+        
+        self.assertTrue(dispatched)
+        self.assertEqual(1, len(endpoint.packets))
+        
+    def test_packets_for_unknown_endpoints_not_dispatched(self):
+        endpoint = self.register(self.DEFAULT_DST_ADDRESS,
+                                 self.DEFAULT_DST_PORT + 1)
+        
+        self.assertFalse(self.demultiplexer.dispatch(self.packet.get_bytes()))
+        self.assertFalse(self.demultiplexer.dispatch('E\x00\x00\x14'))
+        self.assertEqual(0, len(endpoint.packets))
+        
+    def test_registration_replaced_and_removed(self):
+        endpoint = self.register(self.DEFAULT_DST_ADDRESS,
+                                 self.DEFAULT_DST_PORT + 1)
+        self.demultiplexer.register(endpoint, self.DEFAULT_DST_ADDRESS,
+                                    self.DEFAULT_DST_PORT)
+        self.demultiplexer.dispatch(self.packet.get_bytes())
+        self.demultiplexer.unregister(endpoint)
+        dispatched = self.demultiplexer.dispatch(self.packet.get_bytes())
+        
+        self.assertFalse(dispatched)
+        self.assertEqual(1, len(endpoint.packets))
+        self.assertEqual(0, len(self.demultiplexer.endpoints))
+        
+    def test_batch_dispatched_once_per_endpoint(self):
+        endpoint = self.register(self.DEFAULT_DST_ADDRESS,
+                                 self.DEFAULT_DST_PORT)
+        other = self.register(self.DEFAULT_DST_ADDRESS,
+                              self.DEFAULT_DST_PORT + 1)
+        packet_bytes = self.packet.get_bytes()
+        self.packet.set_destination_port(self.DEFAULT_DST_PORT + 1)
+        other_bytes = self.packet.get_bytes()
+        batch = [memoryview(packet_bytes), memoryview(other_bytes),
+                 memoryview('E\x00\x00\x14'), memoryview(packet_bytes)]
+        self.demultiplexer.dispatch_batch(batch)
+        
+        self.assertEqual(1, len(endpoint.batches))
+        self.assertEqual(2, len(endpoint.batches[0]))
+        self.assertEqual(1, len(other.batches))
+        self.assertEqual(1, len(other.batches[0]))
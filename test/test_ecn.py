@@ -0,0 +1,119 @@
+import unittest
+
+from base import ConnectedSocketTestCase
+from ptc.constants import ECT, CE, NOT_ECT
+from ptc.ecn import ExplicitCongestionNotification
+from ptc.packet import PTCPacket, SYNFlag, ACKFlag, ECEFlag, CWRFlag
+
+
+class ExplicitCongestionNotificationTest(unittest.TestCase):
+
+    SND_NXT = 5000
+    
+    def setUp(self):
+        self.ecn = ExplicitCongestionNotification(None)
+        
+    def build_packet(self, flags, ack=0):
+        packet = PTCPacket()
+        packet.add_flags(flags)
+        packet.set_ack_number(ack)
+        return packet
+        
+    def test_negotiation(self):
+        self.assertEqual([SYNFlag, ECEFlag, CWRFlag],
+                         self.ecn.get_syn_flags([SYNFlag]))
+        self.assertEqual([SYNFlag, ACKFlag],
+                         self.ecn.get_syn_flags([SYNFlag, ACKFlag]))
+                         
+        self.ecn.negotiate(self.build_packet([SYNFlag, ECEFlag, CWRFlag]))
+        
+        self.assertTrue(self.ecn.is_enabled())
+        self.assertEqual([SYNFlag, ACKFlag, ECEFlag],
+                         self.ecn.get_syn_flags([SYNFlag, ACKFlag]))
+                         
+        # An ECE echoed back with CWR on a SYN/ACK is no agreement.
+        self.ecn.negotiate(self.build_packet([SYNFlag, ACKFlag, ECEFlag,
+                                              CWRFlag]))
+                                              
+        self.assertFalse(self.ecn.is_enabled())
+        
+    def test_not_used_unless_available(self):
+        self.ecn.set_available(False)
+        
+        self.assertEqual([SYNFlag], self.ecn.get_syn_flags([SYNFlag]))
+        
+        self.ecn.negotiate(self.build_packet([SYNFlag, ECEFlag, CWRFlag]))
+        
+        self.assertFalse(self.ecn.is_enabled())
+        self.assertEqual([SYNFlag, ACKFlag],
+                         self.ecn.get_syn_flags([SYNFlag, ACKFlag]))
+        
+    def test_window_reduced_once_per_window(self):
+        self.ecn.negotiate(self.build_packet([SYNFlag, ACKFlag, ECEFlag]))
+        results = [self.ecn.process_echo(self.build_packet([ACKFlag, ECEFlag],
+                                                           ack=ack),
+                                         self.SND_NXT)
+                   for ack in [1000, 2000, self.SND_NXT,
+                               self.SND_NXT + 100]]
+                               
+        self.assertEqual([True, False, False, True], results)
+        self.assertTrue(self.ecn.take_cwr())
+        self.assertFalse(self.ecn.take_cwr())
+        self.assertFalse(self.ecn.process_echo(self.build_packet([ACKFlag]),
+                                               self.SND_NXT))
+
+
+class ECNTest(ConnectedSocketTestCase):
+
+    def set_up(self):
+        ConnectedSocketTestCase.set_up(self)
+        self.socket.protocol.ecn.enabled = True
+        
+    def send_data(self, ecn=NOT_ECT, flags=None, offset=0):
+        packet = self.packet_builder.build(flags=[ACKFlag] + (flags or []),
+                                           seq=self.DEFAULT_IRS + offset,
+                                           ack=self.DEFAULT_ISS,
+                                           payload='da',
+                                           window=self.DEFAULT_IW)
+        packet.set_type_of_service(ecn)
+        self.send(packet)
+        return self.receive(self.DEFAULT_TIMEOUT)
+        
+    def test_only_data_sent_as_ecn_capable(self):
+        self.socket.send(self.DEFAULT_DATA)
+        data_packet = self.receive(self.DEFAULT_TIMEOUT)
+        ack_packet = self.send_data()
+        
+        self.assertEqual(ECT, data_packet.get_ecn())
+        self.assertEqual(NOT_ECT, ack_packet.get_ecn())
+        self.assertNotIn(ECEFlag, ack_packet)
+        
+    def test_congestion_echoed_until_window_reduced(self):
+        ack_packets = [self.send_data(ecn=CE),
+                       self.send_data(offset=2),
+                       self.send_data(flags=[CWRFlag], offset=4)]
+                       
+        self.assertEqual([True, True, False],
+                         [ECEFlag in packet for packet in ack_packets])
+        self.assertEqual(self.DEFAULT_IRS + 6,
+                         ack_packets[-1].get_ack_number())
+                         
+    def test_echo_reduces_window(self):
+        congestion_control = self.socket.protocol.congestion_control
+        congestion_control.cwnd = 20
+        self.socket.protocol.pmtu.set_maximum(2)
+        self.socket.send(self.DEFAULT_DATA[:8])
+        for _ in range(4):
+            self.receive(self.DEFAULT_TIMEOUT)
+        ack_packet = self.packet_builder.build(flags=[ACKFlag, ECEFlag],
+                                               seq=self.DEFAULT_IRS,
+                                               ack=self.DEFAULT_ISS + 8,
+                                               window=self.DEFAULT_IW)
+        self.send(ack_packet)
+        self.socket.send(self.DEFAULT_DATA[:4])
+        packets = [self.receive(self.DEFAULT_TIMEOUT) for _ in range(2)]
+        
+        # Nothing left in flight: down to the minimum of two segments.
+        self.assertEqual(4, congestion_control.get_ssthresh())
+        self.assertEqual([True, False],
+                         [CWRFlag in packet for packet in packets])
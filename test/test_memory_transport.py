@@ -0,0 +1,61 @@
+import socket
+import threading
+import time
+
+from base import TransportTestCase
+
+import ptc
+from ptc.demux import PacketDemultiplexer
+from ptc.packet import SYNFlag
+from ptc.packet_utils import PacketBuilder
+from ptc.soquete import MemorySoquete
+from test_demux import EndpointMock
+
+
+class MemoryTransportTest(TransportTestCase):
+    
+    TRANSPORT = ptc.MEMORY_TRANSPORT
+        
+    def test_receive_batch_honors_timeout(self):
+        transport = MemorySoquete()
+        timer = threading.Timer(self.TIMEOUT, transport.interrupt)
+        timer.start()
+        start = time.time()
+        try:
+            self.assertRaises(socket.timeout, transport.receive_batch, 0.05)
+        finally:
+            timer.cancel()
+            transport.close()
+        
+        self.assertLess(time.time() - start, self.TIMEOUT)
+        
+    def test_packets_delivered_as_they_are_to_many_endpoints(self):
+        endpoint_count = 5000
+        demultiplexer = PacketDemultiplexer(MemorySoquete)
+        # Packets are drained here instead.
+        demultiplexer.start_receiving = lambda: None
+        transport = demultiplexer.get_socket()
+        builder = PacketBuilder()
+        builder.set_source_address('10.0.0.2')
+        builder.set_source_port(5555)
+        builder.set_destination_address(self.ADDRESS)
+        endpoints = list()
+        packets = list()
+        for port in range(1, endpoint_count + 1):
+            endpoint = EndpointMock()
+            demultiplexer.register(endpoint, self.ADDRESS, port)
+            endpoints.append(endpoint)
+            builder.set_destination_port(port)
+            packet = builder.build(flags=[SYNFlag], seq=port)
+            packets.append(packet)
+            transport.send(packet)
+        while True:
+            try:
+                batch = transport.receive_batch(timeout=0)
+            except socket.timeout:
+                break
+            demultiplexer.dispatch_batch(batch)
+            
+        for endpoint, packet in zip(endpoints, packets):
+            self.assertEqual(1, len(endpoint.packets))
+            self.assertIs(packet, endpoint.packets[0])
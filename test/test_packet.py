@@ -1,7 +1,10 @@
 import unittest
 
-from ptc.packet import PTCPacket, SYNFlag, ACKFlag
-from ptc.packet_utils import PacketDecoder
+from ptc import options
+from ptc.checksum import IPChecksumAlgorithm
+from ptc.constants import ECT, CE
+from ptc.packet import PTCPacket, PTCPacketView, SYNFlag, ACKFlag, FINFlag
+from ptc.packet_utils import PacketBuilder, PacketDecoder
 
 
 class PacketTest(unittest.TestCase):
@@ -29,7 +32,7 @@ class PacketTest(unittest.TestCase):
         return packet
     
     def get_expected_packet_bytes(self):
-        packet_bytes = "E\x00\x00$\x00\x00@\x00\xff\xca\x00\x00\xc0\xa8\x00e"
+        packet_bytes = "E\x00\x00+\x00\x00@\x00\xff\xca\x00\x00\xc0\xa8\x00e"
         packet_bytes += "\xc0\xa8\x00f\xd7\xb5\x00\x16\x00\x00\x04\xd2\x00"
         packet_bytes += "\x00\x00\n\x00\x12'\x10payload"
         return packet_bytes
@@ -76,4 +79,221 @@ class PacketTest(unittest.TestCase):
         self.assertIn(SYNFlag, flags)
         self.assertIn(ACKFlag, flags)
         self.assertEqual(window_size, self.WINDOW_SIZE)
-        self.assertEqual(payload, self.PAYLOAD)
\ No newline at end of file
+        self.assertEqual(payload, self.PAYLOAD)
+        
+    def test_bytes_are_cached(self):
+        packet = self.get_custom_packet()
+        packet_bytes = packet.get_bytes()
+        
+        self.assertIs(packet_bytes, packet.get_bytes())
+        
+    def test_cached_bytes_invalidated_on_change(self):
+        packet = self.get_custom_packet()
+        packet_bytes = packet.get_bytes()
+        packet.set_seq_number(self.SEQ_NUMBER + 1)
+        packet.set_source_ip(self.DESTINATION_IP)
+        new_packet_bytes = packet.get_bytes()
+        decoded_packet = self.build_packet_from_bytes(new_packet_bytes)
+        
+        self.assertNotEqual(packet_bytes, new_packet_bytes)
+        self.assertEqual(self.SEQ_NUMBER + 1,
+                         decoded_packet.get_seq_number())
+        self.assertEqual(self.DESTINATION_IP, decoded_packet.get_source_ip())
+        
+    def get_packet_builder(self):
+        packet_builder = PacketBuilder()
+        packet_builder.set_source_address(self.SOURCE_IP)
+        packet_builder.set_destination_address(self.DESTINATION_IP)
+        packet_builder.set_source_port(self.SOURCE_PORT)
+        packet_builder.set_destination_port(self.DESTINATION_PORT)
+        return packet_builder
+        
+    def test_packet_from_builder(self):
+        packet_builder = self.get_packet_builder()
+        packet = packet_builder.build(payload=self.PAYLOAD,
+                                      flags=[SYNFlag, ACKFlag],
+                                      seq=self.SEQ_NUMBER,
+                                      ack=self.ACK_NUMBER,
+                                      window=self.WINDOW_SIZE)
+        packet_bytes = packet.get_bytes()
+        decoded_packet = self.build_packet_from_bytes(packet_bytes)
+        
+        self.assertEqual(len(packet_bytes), packet.get_length())
+        self.assertTrue(IPChecksumAlgorithm.is_valid(packet_bytes[:20]))
+        for current_packet in [packet, decoded_packet]:
+            self.assertEqual(self.SOURCE_IP, current_packet.get_source_ip())
+            self.assertEqual(self.DESTINATION_IP,
+                             current_packet.get_destination_ip())
+            self.assertEqual(self.SOURCE_PORT,
+                             current_packet.get_source_port())
+            self.assertEqual(self.DESTINATION_PORT,
+                             current_packet.get_destination_port())
+            self.assertEqual(self.SEQ_NUMBER,
+                             current_packet.get_seq_number())
+            self.assertEqual(self.ACK_NUMBER,
+                             current_packet.get_ack_number())
+            self.assertEqual(self.WINDOW_SIZE,
+                             current_packet.get_window_size())
+            self.assertIn(SYNFlag, current_packet)
+            self.assertIn(ACKFlag, current_packet)
+            self.assertEqual(self.PAYLOAD, current_packet.get_payload())
+            
+    def test_pure_ack_reuses_template_ip_header(self):
+        packet_builder = self.get_packet_builder()
+        data_packet = packet_builder.build(payload=self.PAYLOAD,
+                                           flags=[ACKFlag])
+        ack_packet = packet_builder.build(flags=[ACKFlag],
+                                          ack=self.ACK_NUMBER,
+                                          window=self.WINDOW_SIZE)
+        template = packet_builder.get_template()
+        ack_bytes = ack_packet.get_bytes()
+        decoded_packet = self.build_packet_from_bytes(ack_bytes)
+        
+        self.assertEqual(template.header[:20], ack_bytes[:20])
+        self.assertNotEqual(template.header[:20], data_packet.get_bytes()[:20])
+        self.assertEqual(self.ACK_NUMBER, decoded_packet.get_ack_number())
+
+    def test_data_packets_built_in_bulk(self):
+        packet_builder = self.get_packet_builder()
+        data = memoryview(self.PAYLOAD * 2)
+        segments = [(self.SEQ_NUMBER, data[:len(self.PAYLOAD)]),
+                    (self.SEQ_NUMBER + len(self.PAYLOAD),
+                     data[len(self.PAYLOAD):])]
+        packets = packet_builder.build_data_packets(segments,
+                                                    flags=[ACKFlag],
+                                                    ack=self.ACK_NUMBER,
+                                                    window=self.WINDOW_SIZE)
+        
+        for (seq_number, _), packet in zip(segments, packets):
+            decoded_packet = self.build_packet_from_bytes(packet.get_bytes())
+            for current_packet in [packet, decoded_packet]:
+                self.assertEqual(seq_number, current_packet.get_seq_number())
+                self.assertEqual(self.ACK_NUMBER,
+                                 current_packet.get_ack_number())
+                self.assertEqual(self.WINDOW_SIZE,
+                                 current_packet.get_window_size())
+                self.assertEqual(set([ACKFlag]), current_packet.get_flags())
+                self.assertEqual(self.PAYLOAD, current_packet.get_payload())
+                self.assertEqual(len(self.PAYLOAD),
+                                 current_packet.get_payload_size())
+            self.assertTrue(IPChecksumAlgorithm.is_valid(
+                packet.get_bytes()[:20]))
+            
+    def test_ect_data_packets(self):
+        packet_builder = self.get_packet_builder()
+        segments = [(self.SEQ_NUMBER, self.PAYLOAD)]
+        packet = packet_builder.build_data_packets(segments, flags=[ACKFlag],
+                                                   ack=self.ACK_NUMBER,
+                                                   ect=True)[0]
+        decoded_packet = self.build_packet_from_bytes(packet.get_bytes())
+        
+        for current_packet in [packet, decoded_packet]:
+            self.assertEqual(ECT, current_packet.get_ecn())
+            self.assertEqual(self.PAYLOAD, current_packet.get_payload())
+        self.assertTrue(IPChecksumAlgorithm.is_valid(
+            packet.get_bytes()[:20]))
+        self.assertEqual(0, packet_builder.build(flags=[ACKFlag]).get_ecn())
+            
+    def test_ecn_codepoint_decoded(self):
+        packet = self.get_custom_packet()
+        packet.set_type_of_service(0xb8 | CE)
+        packet_bytes = packet.get_bytes()
+        decoded_packet = self.build_packet_from_bytes(packet_bytes)
+        view = PTCPacketView(memoryview(packet_bytes))
+        
+        for current_packet in [packet, decoded_packet, view]:
+            self.assertEqual(CE, current_packet.get_ecn())
+            self.assertEqual(0xb8 | CE, current_packet.get_type_of_service())
+            
+    def test_packet_view(self):
+        packet_bytes = self.get_custom_packet().get_bytes()
+        view = PTCPacketView(memoryview(packet_bytes))
+        payload = view.get_payload()
+        seq_lo, seq_hi = view.get_seq_interval()
+        
+        self.assertEqual(self.SOURCE_IP, view.get_source_ip())
+        self.assertEqual(self.DESTINATION_IP, view.get_destination_ip())
+        self.assertEqual(self.SOURCE_PORT, view.get_source_port())
+        self.assertEqual(self.DESTINATION_PORT, view.get_destination_port())
+        self.assertEqual(self.SEQ_NUMBER, view.get_seq_number())
+        self.assertEqual(self.ACK_NUMBER, view.get_ack_number())
+        self.assertEqual(self.WINDOW_SIZE, view.get_window_size())
+        self.assertEqual(set([SYNFlag, ACKFlag]), view.get_flags())
+        self.assertIn(SYNFlag, view)
+        self.assertIn(ACKFlag, view)
+        self.assertIsInstance(payload, memoryview)
+        self.assertEqual(self.PAYLOAD, payload)
+        self.assertTrue(view.has_payload())
+        self.assertEqual(self.SEQ_NUMBER + len(self.PAYLOAD), seq_hi)
+        
+    def test_flags_kept_as_bitmask(self):
+        packet = self.get_custom_packet()
+        expected_bits = SYNFlag.get_bits() | ACKFlag.get_bits()
+        decoded_packet = self.build_packet_from_bytes(packet.get_bytes())
+        
+        for current_packet in [packet, decoded_packet]:
+            self.assertEqual(expected_bits, current_packet.get_flags_bits())
+            self.assertEqual(set([SYNFlag, ACKFlag]),
+                             current_packet.get_flags())
+            self.assertNotIn(FINFlag, current_packet)
+            self.assertNotIn('flag', current_packet)
+            
+        packet.add_flag(FINFlag)
+        self.assertIn(FINFlag, packet)
+        
+    def test_packet_is_slotted(self):
+        packet = self.get_custom_packet()
+        packet_bytes = packet.get_bytes()
+        total_length = (ord(packet_bytes[2]) << 8) + ord(packet_bytes[3])
+        
+        self.assertFalse(hasattr(packet, '__dict__'))
+        self.assertRaises(AttributeError, setattr, packet, 'field', 0)
+        self.assertEqual(len(packet_bytes), total_length)
+        self.assertEqual(len(packet_bytes), packet.get_length())
+        
+    def test_options_before_payload(self):
+        packet = self.get_custom_packet()
+        packet.set_options(options.encode_mss(1400))
+        packet_bytes = packet.get_bytes()
+        decoded_packet = self.build_packet_from_bytes(packet_bytes)
+        view = PTCPacketView(memoryview(packet_bytes))
+        
+        self.assertEqual(len(packet_bytes), packet.get_length())
+        for current_packet in [packet, decoded_packet, view]:
+            self.assertEqual(1400, current_packet.get_mss())
+            self.assertEqual(self.PAYLOAD, current_packet.get_payload())
+            self.assertEqual(set([SYNFlag, ACKFlag]),
+                             current_packet.get_flags())
+            
+    def test_options_padded_to_words(self):
+        packet = self.get_custom_packet()
+        packet.set_options(chr(options.NOP))
+        
+        self.assertEqual(options.WORD_SIZE, len(packet.get_options()))
+        self.assertIsNone(packet.get_mss())
+        self.assertRaises(ValueError, packet.set_options,
+                          chr(options.NOP) * (options.MAX_SIZE + 1))
+        
+    def test_sack_blocks_decoded(self):
+        blocks = [(1000, 1100), (1200, 1300)]
+        packet = self.get_custom_packet()
+        packet.set_options(options.encode_mss(1400) +
+                           options.encode_sack_permitted() +
+                           options.encode_sack(blocks))
+        packet_bytes = packet.get_bytes()
+        decoded_packet = self.build_packet_from_bytes(packet_bytes)
+        view = PTCPacketView(memoryview(packet_bytes))
+        
+        for current_packet in [packet, decoded_packet, view]:
+            self.assertEqual(blocks, current_packet.get_sack_blocks())
+            self.assertTrue(current_packet.get_sack_permitted())
+            self.assertEqual(1400, current_packet.get_mss())
+            
+    def test_sack_blocks_limited_to_option_size(self):
+        blocks = [(index, index + 1) for index in range(20)]
+        packet = self.get_custom_packet()
+        packet.set_options(options.encode_sack(blocks))
+        
+        self.assertEqual(blocks[:options.MAX_SACK_BLOCKS],
+                         packet.get_sack_blocks())
+        self.assertFalse(packet.get_sack_permitted())
@@ -0,0 +1,138 @@
+import time
+import unittest
+
+from base import ConnectedSocketTestCase
+from ptc.constants import MAX_MSS, BASE_MSS, INITIAL_RTO, CLOCK_TICK,\
+                          PMTU_PROBE_INTERVAL, PMTU_BLACK_HOLE_RETRANSMISSIONS
+from ptc.packet import ACKFlag, PTCPacket
+from ptc.pmtu import PathMTUDiscovery
+
+
+class PathMTUDiscoveryTest(unittest.TestCase):
+
+    SEQ_NUMBER = 1000
+
+    def setUp(self):
+        self.pmtu = PathMTUDiscovery(None)
+        self.seq_number = self.SEQ_NUMBER
+
+    def send_segment(self):
+        size = self.pmtu.get_segment_size()
+        packet = PTCPacket()
+        packet.set_payload('x' * size)
+        packet.set_seq_number(self.seq_number)
+        self.seq_number += size
+        self.pmtu.segments_sent([packet])
+        return packet
+
+    def fall_back_after_black_hole(self):
+        packet = self.send_segment()
+        for retransmissions in range(1, PMTU_BLACK_HOLE_RETRANSMISSIONS+1):
+            segment_size = self.pmtu.process_timeout(
+                packet.get_payload_size(), retransmissions)
+        return segment_size
+
+    def send_segments_until_probing(self):
+        for _ in range(PMTU_PROBE_INTERVAL):
+            self.send_segment()
+        return self.send_segment()
+
+    def test_negotiated_mss_used(self):
+        self.pmtu.set_maximum(1000)
+
+        self.assertEqual(1000, self.pmtu.get_segment_size())
+
+    def test_fall_back_to_base_mss_on_black_hole(self):
+        self.pmtu.set_maximum(1400)
+        packet = self.send_segment()
+        first_timeout_size = self.pmtu.process_timeout(
+            packet.get_payload_size(), 1)
+
+        self.assertEqual(1400, first_timeout_size)
+        self.assertEqual(BASE_MSS, self.fall_back_after_black_hole())
+        self.assertEqual(BASE_MSS, self.pmtu.get_mss())
+
+    def test_small_segments_do_not_trigger_fall_back(self):
+        self.pmtu.set_maximum(BASE_MSS)
+
+        self.assertEqual(BASE_MSS, self.fall_back_after_black_hole())
+
+    def test_probe_sent_after_enough_segments(self):
+        self.pmtu.set_maximum(1400)
+        self.fall_back_after_black_hole()
+        probe = self.send_segments_until_probing()
+
+        self.assertEqual((BASE_MSS + 1399 + 1) / 2, len(probe.get_payload()))
+        # No other probe until this one is resolved.
+        self.assertEqual(BASE_MSS, self.pmtu.get_segment_size())
+
+    def test_acknowledged_probe_raises_mss(self):
+        self.pmtu.set_maximum(1400)
+        self.fall_back_after_black_hole()
+        probe = self.send_segments_until_probing()
+        _, ack_number = probe.get_seq_interval()
+        self.pmtu.process_ack(ack_number - 1)
+
+        self.assertEqual(BASE_MSS, self.pmtu.get_mss())
+
+        self.pmtu.process_ack(ack_number)
+
+        self.assertEqual(len(probe.get_payload()), self.pmtu.get_mss())
+
+    def test_lost_probe_narrows_search(self):
+        self.pmtu.set_maximum(1400)
+        self.fall_back_after_black_hole()
+        probe = self.send_segments_until_probing()
+        probe_size = len(probe.get_payload())
+        segment_size = self.pmtu.process_timeout(probe_size, 1)
+        next_probe = self.send_segments_until_probing()
+
+        self.assertEqual(BASE_MSS, segment_size)
+        self.assertEqual((BASE_MSS + probe_size - 1 + 1) / 2,
+                         len(next_probe.get_payload()))
+
+    def test_route_limit_lowers_mss(self):
+        self.pmtu.set_route_limit(1000)
+
+        self.assertEqual(1000, self.pmtu.get_mss())
+        self.assertTrue(1000 < MAX_MSS)
+
+
+class SegmentSizeTest(ConnectedSocketTestCase):
+
+    def receive_packets(self, count):
+        return [self.receive(self.DEFAULT_TIMEOUT) for _ in range(count)]
+
+    def test_segments_not_larger_than_mss(self):
+        self.socket.protocol.pmtu.set_maximum(4)
+        data = self.DEFAULT_DATA[:10]
+        self.socket.send(data)
+        packets = self.receive_packets(3)
+
+        self.assertEqual([4, 4, 2],
+                         [len(packet.get_payload()) for packet in packets])
+        self.assertEqual(data, ''.join(packet.get_payload()
+                                       for packet in packets))
+
+    def test_segment_split_when_retransmitted_with_lower_mss(self):
+        data = self.DEFAULT_DATA[:10]
+        self.socket.send(data)
+        self.receive(self.DEFAULT_TIMEOUT)
+        self.socket.protocol.pmtu.set_route_limit(4)
+        time.sleep(INITIAL_RTO * CLOCK_TICK)
+        packets = self.receive_packets(3)
+        seq_numbers = [packet.get_seq_number() for packet in packets]
+
+        self.assertEqual(data, ''.join(packet.get_payload()
+                                       for packet in packets))
+        self.assertEqual([self.DEFAULT_ISS, self.DEFAULT_ISS + 4,
+                          self.DEFAULT_ISS + 8], seq_numbers)
+        self.assertEqual(3, self.socket.protocol.rqueue.get_segment_count())
+
+        ack_packet = self.packet_builder.build(flags=[ACKFlag],
+                                               seq=self.DEFAULT_IRS,
+                                               ack=self.DEFAULT_ISS + 10,
+                                               window=self.DEFAULT_IW)
+        self.send(ack_packet)
+
+        self.assertTrue(self.socket.protocol.rqueue.empty())
@@ -0,0 +1,75 @@
+import unittest
+
+from ptc.reassembly import ReassemblyQueue
+
+
+class ReassemblyQueueTest(unittest.TestCase):
+    
+    DEFAULT_DATA = 'abcdefghijklmnopqrstuvwxyz'
+    
+    def setUp(self):
+        self.queue = ReassemblyQueue()
+        
+    def get_data(self, start, end):
+        return self.DEFAULT_DATA[start:end]
+    
+    def add(self, start, end):
+        return self.queue.add(start, self.get_data(start, end))
+    
+    def get_intervals(self):
+        return zip(self.queue.starts, self.queue.ends)
+    
+    def pop_from(self, position):
+        return ''.join(self.queue.pop_from(position))
+        
+    def test_disjoint_intervals_kept_sorted(self):
+        self.add(20, 24)
+        self.add(5, 8)
+        self.add(12, 15)
+        
+        self.assertEqual([(5, 8), (12, 15), (20, 24)], self.get_intervals())
+        self.assertEqual(10, self.queue.get_size())
+        
+    def test_adjacent_intervals_coalesced(self):
+        self.add(5, 8)
+        self.add(10, 12)
+        self.add(8, 10)
+        
+        self.assertEqual([(5, 12)], self.get_intervals())
+        self.assertEqual(self.get_data(5, 12), self.pop_from(5))
+        
+    def test_overlapping_data_trimmed(self):
+        self.add(5, 10)
+        self.add(12, 15)
+        self.add(18, 20)
+        self.add(3, 19)
+        
+        self.assertEqual([(3, 20)], self.get_intervals())
+        self.assertEqual(17, self.queue.get_size())
+        self.assertEqual(self.get_data(3, 20), self.pop_from(3))
+        self.assertEqual(0, self.queue.get_size())
+        self.assertTrue(self.queue.empty())
+        
+    def test_duplicate_data_not_accounted(self):
+        self.add(5, 10)
+        self.add(6, 9)
+        
+        self.assertEqual([(5, 10)], self.get_intervals())
+        self.assertEqual(5, self.queue.get_size())
+        
+    def test_pop_discards_data_already_received(self):
+        self.add(5, 10)
+        self.add(12, 15)
+        
+        self.assertEqual('', self.pop_from(4))
+        self.assertEqual(self.get_data(13, 15), self.pop_from(13))
+        self.assertEqual(0, self.queue.get_size())
+        
+    def test_limit(self):
+        self.queue = ReassemblyQueue(limit=10)
+        
+        self.assertTrue(self.add(0, 8))
+        self.assertFalse(self.add(10, 13))
+        self.assertTrue(self.add(4, 10))
+        self.assertEqual(10, self.queue.get_size())
+        self.assertEqual([(0, 10)], self.get_intervals())
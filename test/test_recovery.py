@@ -0,0 +1,98 @@
+import unittest
+
+from base import ConnectedSocketTestCase
+from ptc.constants import DUPLICATE_ACK_THRESHOLD
+from ptc.packet import ACKFlag
+from ptc.recovery import FastRecovery
+
+
+class FastRecoveryTest(unittest.TestCase):
+
+    SND_UNA = 1000
+    SND_NXT = 5000
+    
+    def setUp(self):
+        self.recovery = FastRecovery(None)
+        
+    def receive_duplicate_acks(self, count, snd_una=SND_UNA,
+                               snd_nxt=SND_NXT):
+        return [self.recovery.process_duplicate_ack(snd_una, snd_nxt)
+                for _ in range(count)]
+                
+    def test_retransmission_after_enough_duplicate_acks(self):
+        results = self.receive_duplicate_acks(DUPLICATE_ACK_THRESHOLD + 1)
+        
+        self.assertEqual([False] * (DUPLICATE_ACK_THRESHOLD - 1) +\
+                         [True, False], results)
+        self.assertTrue(self.recovery.is_in_recovery())
+        
+    def test_new_ack_resets_duplicate_count(self):
+        self.receive_duplicate_acks(DUPLICATE_ACK_THRESHOLD - 1)
+        self.recovery.process_ack(self.SND_UNA + 100)
+        results = self.receive_duplicate_acks(DUPLICATE_ACK_THRESHOLD - 1,
+                                              snd_una=self.SND_UNA + 100)
+                                              
+        self.assertFalse(any(results))
+        
+    def test_partial_ack_calls_for_retransmission(self):
+        self.receive_duplicate_acks(DUPLICATE_ACK_THRESHOLD)
+        
+        self.assertTrue(self.recovery.process_ack(self.SND_NXT - 100))
+        self.assertTrue(self.recovery.is_in_recovery())
+        self.assertFalse(self.recovery.process_ack(self.SND_NXT))
+        self.assertFalse(self.recovery.is_in_recovery())
+        
+    def test_no_recovery_for_data_sent_before_timeout(self):
+        self.recovery.process_timeout(self.SND_NXT)
+        results = self.receive_duplicate_acks(DUPLICATE_ACK_THRESHOLD,
+                                              snd_una=self.SND_NXT - 100)
+                                              
+        self.assertFalse(any(results))
+        
+        self.recovery.process_ack(self.SND_NXT + 100)
+        results = self.receive_duplicate_acks(DUPLICATE_ACK_THRESHOLD,
+                                              snd_una=self.SND_NXT + 100,
+                                              snd_nxt=self.SND_NXT + 200)
+                                              
+        self.assertTrue(any(results))
+
+
+class FastRetransmissionTest(ConnectedSocketTestCase):
+
+    def test_retransmission_after_duplicate_acks(self):
+        data = self.DEFAULT_DATA[:8]
+        self.send_segments(data, 2)
+        for _ in range(DUPLICATE_ACK_THRESHOLD):
+            self.send(self.build_ack(self.DEFAULT_ISS))
+        packet = self.receive(self.TIMEOUT)
+        
+        self.assertEqual(self.DEFAULT_ISS, packet.get_seq_number())
+        self.assertEqual(data[:2], packet.get_payload())
+        
+    def test_partial_ack_retransmits_next_segment(self):
+        data = self.DEFAULT_DATA[:8]
+        self.send_segments(data, 2)
+        for _ in range(DUPLICATE_ACK_THRESHOLD):
+            self.send(self.build_ack(self.DEFAULT_ISS))
+        self.receive(self.TIMEOUT)
+        self.send(self.build_ack(self.DEFAULT_ISS + 4))
+        packet = self.receive(self.TIMEOUT)
+        
+        self.assertEqual(self.DEFAULT_ISS + 4, packet.get_seq_number())
+        self.assertEqual(data[4:6], packet.get_payload())
+        
+        self.send(self.build_ack(self.DEFAULT_ISS + 8))
+        
+        self.assertFalse(self.socket.protocol.fast_recovery.is_in_recovery())
+        
+    def test_out_of_order_data_acknowledged_at_once(self):
+        packet = self.packet_builder.build(flags=[ACKFlag],
+                                           seq=self.DEFAULT_IRS + 4,
+                                           ack=self.DEFAULT_ISS,
+                                           payload='data',
+                                           window=self.DEFAULT_IW)
+        self.send(packet)
+        ack_packet = self.receive(self.TIMEOUT)
+        
+        self.assertEqual(self.DEFAULT_IRS, ack_packet.get_ack_number())
+        self.assertFalse(ack_packet.has_payload())
@@ -239,6 +239,45 @@ class RetransmissionTest(ConnectedSocketTestCase, RetransmissionTestMixin):
         # retransmission of the second packet.
         self.assertEquals(first_rto, new_rto)        
         
+    def test_retransmitted_packet_not_used_for_estimating_rto_3(self):
+        # Scenario: a small packet is retransmitted and then another one,
+        # tracked for its RTT, is sent. On the next timeout, both are
+        # retransmitted together, starting before the tracked packet.
+        rto_estimator = self.socket.protocol.rto_estimator
+        self.socket.send(self.DEFAULT_DATA[:3])
+        self.receive()
+        self.wait_until_retransmission_timer_expires()
+        self.receive()
+        self.socket.send(self.DEFAULT_DATA[3:6])
+        self.receive()
+        tracked_packet = rto_estimator.get_tracked_packet()
+        # RTO was backed off once.
+        packet = self.receive(3 * self.DEFAULT_TIMEOUT)
+        ack_packet = self.packet_builder.build(flags=[ACKFlag],
+                                               seq=self.DEFAULT_IRS,
+                                               ack=self.DEFAULT_ISS + 6,
+                                               window=self.DEFAULT_IW)
+        self.send(ack_packet)
+        
+        self.assertEquals(self.DEFAULT_ISS + 3,
+                          tracked_packet.get_seq_number())
+        self.assertEquals(self.DEFAULT_ISS, packet.get_seq_number())
+        self.assertEquals(self.DEFAULT_DATA[:6], packet.get_payload())
+        # No RTT was sampled.
+        self.assertEquals(0, rto_estimator.get_srtt())
+        
+    def test_small_segments_retransmitted_together(self):
+        data = self.DEFAULT_DATA[:9]
+        for offset in range(0, len(data), 3):
+            self.socket.send(data[offset:offset+3])
+            self.receive(self.DEFAULT_TIMEOUT)
+        self.wait_until_retransmission_timer_expires()
+        packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertEquals(self.DEFAULT_ISS, packet.get_seq_number())
+        self.assertEquals(data, packet.get_payload())
+        self.assertEquals(1, self.socket.protocol.rqueue.get_segment_count())
+        
 
 class SYNRetransmissionTest(PTCTestCase, RetransmissionTestMixin):
 
@@ -1,7 +1,7 @@
 from base import PTCTestCase
 from ptc.constants import MAX_SEQ
-from ptc.packet import ACKFlag
-from ptc.rqueue import RetransmissionQueue
+from ptc.packet import SYNFlag, ACKFlag, PTCPacketView
+from ptc.rqueue import RetransmissionQueue, SentSegment
 from ptc.seqnum import SequenceNumber
 
 
@@ -21,13 +21,17 @@ class RetransmissionQueueTest(PTCTestCase):
                                             payload=self.DEFAULT_DATA)
         self.packets = [packet1, packet2]
         
-    def get_packet_for_seqs(self, seq_lo, seq_hi):
+    def get_segment_for_seqs(self, seq_lo, seq_hi):
         if seq_hi < seq_lo:
             seq_hi = MAX_SEQ + seq_hi 
         payload = 'x' * int(seq_hi - seq_lo + 1)
         packet = self.packet_builder.build(seq=seq_lo,
                                            payload=payload)
-        return packet        
+        return self.queue.segment_for(packet)
+    
+    def get_segment_for(self, packet):
+        seq_lo, seq_hi = packet.get_seq_interval()
+        return SentSegment(seq_lo, seq_hi, 0)
     
     def test_empty_queue(self):
         self.assertTrue(self.queue.empty())
@@ -43,7 +47,7 @@ class RetransmissionQueueTest(PTCTestCase):
         head = self.queue.head()
         expected_seq = self.packets[0].get_seq_number()
         
-        self.assertEquals(expected_seq, head.get_seq_number())
+        self.assertEquals(expected_seq, head.seq_lo)
         
     def test_acked_packet_removed_from_queue(self):
         self.queue.put(self.packets[0])
@@ -55,7 +59,19 @@ class RetransmissionQueueTest(PTCTestCase):
                                                     self.snd_nxt)
         
         self.assertEquals(1, len(packets))
-        self.assertEquals(expected_seq, packets[0].get_seq_number())
+        self.assertEquals(expected_seq, packets[0].seq_lo)
+        
+    def test_packet_acked_by_packet_view_removed_from_queue(self):
+        self.queue.put(self.packets[0])
+        _, target_ack = self.packets[0].get_seq_interval()
+        ack_packet = self.packet_builder.build(flags=[ACKFlag],
+                                               ack=target_ack)
+        ack_view = PTCPacketView(memoryview(ack_packet.get_bytes()))
+        packets = self.queue.remove_acknowledged_by(ack_view, self.snd_una,
+                                                    self.snd_nxt)
+        
+        self.assertEquals(1, len(packets))
+        self.assertTrue(self.queue.empty())
         
     def test_partially_acked_packet_not_removed_from_queue(self):
         self.queue.put(self.packets[0])
@@ -75,9 +91,10 @@ class RetransmissionQueueTest(PTCTestCase):
         seq_lo = SequenceNumber(80)
         seq_hi = SequenceNumber(85)
         ack = SequenceNumber(90)
-        packet = self.get_packet_for_seqs(seq_lo, seq_hi)
+        segment = self.get_segment_for_seqs(seq_lo, seq_hi)
  
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
         self.assertTrue(result)
          
         # Case 2: snd_una < ack < seq_lo < seq_hi < snd_nxt
@@ -85,7 +102,8 @@ class RetransmissionQueueTest(PTCTestCase):
         ack = seq_lo - 1
         snd_una = ack - 1
   
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
         self.assertFalse(result)
           
         # Case 3: snd_una < seq_lo < ack < seq_hi < snd_nxt
@@ -93,7 +111,8 @@ class RetransmissionQueueTest(PTCTestCase):
         ack = seq_hi - 1
         snd_una = seq_lo - 1
           
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
         self.assertFalse(result)
 
     def test_ack_covers_packet_with_wraparound(self):
@@ -104,9 +123,10 @@ class RetransmissionQueueTest(PTCTestCase):
         snd_nxt = ack + 1
         snd_una = snd_nxt + 10
         seq_lo = SequenceNumber(MAX_SEQ - 10)
-        packet = self.get_packet_for_seqs(seq_lo, seq_hi)
+        segment = self.get_segment_for_seqs(seq_lo, seq_hi)
         
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
         self.assertTrue(result)
         
         # Case 2: ack < seq_hi < snd_nxt < snd_una < seq_lo
@@ -114,19 +134,100 @@ class RetransmissionQueueTest(PTCTestCase):
         ack = seq_hi - 1
         snd_nxt = seq_hi + 1
         
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
         self.assertFalse(result)
         
         # Case 3: seq_hi < snd_nxt < snd_una < seq_lo < ack
         # Should be false.
         ack = seq_lo + 1
         
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
         self.assertFalse(result)
         
         # Case 4: seq_hi < snd_nxt < snd_una < ack < seq_lo
         # Should be false.
         ack = seq_lo - 1
         
-        result = self.queue.ack_covers_packet(ack, packet, snd_una, snd_nxt)
-        self.assertFalse(result)        
\ No newline at end of file
+        result = self.queue.ack_covers_segment(ack, segment, snd_una,
+                                               snd_nxt)
+        self.assertFalse(result)
+
+    def test_byte_and_segment_counts(self):
+        self.queue.put(self.packets[0])
+        self.queue.put(self.packets[1])
+        size = len(self.DEFAULT_DATA)
+        
+        self.assertEquals(2, self.queue.get_segment_count())
+        self.assertEquals(2 * size, self.queue.get_byte_count())
+        
+        _, target_ack = self.packets[0].get_seq_interval()
+        ack_packet = self.packet_builder.build(flags=[ACKFlag],
+                                               ack=target_ack)
+        self.queue.remove_acknowledged_by(ack_packet, self.snd_una,
+                                          self.snd_nxt)
+        
+        self.assertEquals(1, self.queue.get_segment_count())
+        self.assertEquals(size, self.queue.get_byte_count())
+        
+    def test_removal_stops_at_first_packet_not_covered(self):
+        self.queue.put(self.packets[0])
+        self.queue.put(self.packets[1])
+        _, seq_hi = self.packets[1].get_seq_interval()
+        ack_packet = self.packet_builder.build(flags=[ACKFlag],
+                                               ack=seq_hi - 1)
+        packets = self.queue.remove_acknowledged_by(ack_packet, self.snd_una,
+                                                    self.snd_nxt)
+        
+        self.assertEquals([self.get_segment_for(self.packets[0])], packets)
+        # Only its last byte is left to acknowledge.
+        self.assertEquals(SentSegment(seq_hi - 1, seq_hi, 0),
+                          self.queue.head())
+        
+    def test_partially_acked_head_trimmed(self):
+        self.queue.put(self.packets[0])
+        ack = self.DEFAULT_SEQ + 10
+        ack_packet = self.packet_builder.build(flags=[ACKFlag], ack=ack)
+        self.queue.remove_acknowledged_by(ack_packet, self.snd_una,
+                                          self.snd_nxt)
+        
+        self.assertEquals(ack, self.queue.head().seq_lo)
+        self.assertEquals(len(self.DEFAULT_DATA) - 10,
+                          self.queue.get_byte_count())
+        
+    def test_large_head_split_when_regrouped(self):
+        self.queue.put(self.packets[0])
+        self.queue.put(self.packets[1])
+        size = len(self.DEFAULT_DATA) / 2 + 1
+        segments = self.queue.regroup_head(size)
+        
+        self.assertEquals([size, len(self.DEFAULT_DATA) - size],
+                          [segment.seq_hi - segment.seq_lo
+                           for segment in segments])
+        self.assertEquals(3, self.queue.get_segment_count())
+        
+    def test_small_segments_merged_when_regrouped(self):
+        size = len(self.DEFAULT_DATA)
+        for offset in range(0, size, 10):
+            packet = self.packet_builder.build(seq=self.DEFAULT_SEQ+offset,
+                                               payload='x' * 10)
+            self.queue.put(packet)
+        segments = self.queue.regroup_head(25)
+        
+        self.assertEquals([SentSegment(self.DEFAULT_SEQ, self.DEFAULT_SEQ+25,
+                                       0)], segments)
+        # The segment partially merged is trimmed.
+        self.assertEquals(self.DEFAULT_SEQ + 25,
+                          self.queue.queue[1].seq_lo)
+        self.assertEquals(size, self.queue.get_byte_count())
+        
+    def test_control_segment_not_regrouped(self):
+        syn_packet = self.packet_builder.build(flags=[SYNFlag],
+                                               seq=self.DEFAULT_SEQ - 1)
+        self.queue.put(syn_packet)
+        self.queue.put(self.packets[0])
+        segments = self.queue.regroup_head(1000)
+        
+        self.assertEquals([self.queue.segment_for(syn_packet)], segments)
+        self.assertEquals(2, self.queue.get_segment_count())
@@ -64,10 +64,16 @@ class RTOEstimatorTest(ConnectedSocketTestCase):
     def test_ack_not_covering_tracked_packet_is_ignored(self):
         packet = self.packet_builder.build(flags=[ACKFlag],
                                            ack=self.DEFAULT_ISS - 5)
-        self.rto_estimator.process_ack(packet)
+        sampled_rtt = self.rto_estimator.process_ack(packet)
         rto = self.rto_estimator.get_current_rto()
         
+        self.assertIsNone(sampled_rtt)
         self.assertEquals(INITIAL_RTO, rto)
+        
+    def test_sampled_rtt_returned(self):
+        sampled_rtt = self.rto_estimator.process_ack(self.ack_packet)
+        
+        self.assertEquals(self.rto_estimator.get_srtt(), sampled_rtt)
     
     def test_ack_is_ignored_when_not_tracking(self):
         self.rto_estimator.untrack()
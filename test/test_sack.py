@@ -0,0 +1,132 @@
+import socket
+import unittest
+
+from base import ConnectedSocketTestCase
+from ptc.constants import DUPLICATE_ACK_THRESHOLD
+from ptc.packet import ACKFlag
+from ptc.sack import SACKScoreboard
+
+
+class SACKScoreboardTest(unittest.TestCase):
+
+    SND_UNA = 1000
+    SND_NXT = 2000
+
+    def setUp(self):
+        self.scoreboard = SACKScoreboard(None)
+
+    def update(self, blocks, snd_una=SND_UNA):
+        blocks = [(self.SND_UNA + lo, self.SND_UNA + hi) for lo, hi in blocks]
+        self.scoreboard.update(blocks, snd_una, self.SND_NXT)
+
+    def test_blocks_merged(self):
+        self.update([(300, 400), (100, 200)])
+        self.update([(150, 300), (500, 600)])
+
+        self.assertEqual([(1100, 1400), (1500, 1600)],
+                         self.scoreboard.get_blocks())
+        self.assertEqual(400, self.scoreboard.get_sacked_bytes())
+
+    def test_acknowledged_and_bogus_blocks_dropped(self):
+        self.update([(100, 200), (300, 400), (900, 1100)])
+        self.update(list(), snd_una=self.SND_UNA + 350)
+
+        self.assertEqual([(1350, 1400)], self.scoreboard.get_blocks())
+
+    def test_holes_below_highest_block(self):
+        self.assertIsNone(self.scoreboard.get_holes(self.SND_UNA))
+
+        self.update([(100, 200), (300, 400)])
+
+        self.assertEqual([(1000, 1100), (1200, 1300)],
+                         self.scoreboard.get_holes(self.SND_UNA))
+
+    def test_holes_taken_once(self):
+        self.update([(100, 200)])
+        holes = self.scoreboard.take_holes(self.SND_UNA)
+        self.update([(100, 200), (300, 400)])
+
+        self.assertEqual([(1000, 1100)], holes)
+        self.assertEqual([(1200, 1300)],
+                         self.scoreboard.take_holes(self.SND_UNA))
+        self.assertFalse(self.scoreboard.has_holes(self.SND_UNA))
+
+        self.scoreboard.clear()
+        self.update([(100, 200)])
+
+        self.assertEqual([(1000, 1100)],
+                         self.scoreboard.get_holes(self.SND_UNA))
+
+
+class SACKRetransmissionTest(ConnectedSocketTestCase):
+
+    def set_up(self):
+        ConnectedSocketTestCase.set_up(self)
+        self.socket.protocol.sack_enabled = True
+
+    def send_duplicate_acks(self, blocks):
+        for _ in range(DUPLICATE_ACK_THRESHOLD):
+            self.send(self.build_ack(self.DEFAULT_ISS, blocks))
+
+    def receive_seq_numbers(self, count):
+        return [self.receive(self.TIMEOUT).get_seq_number()
+                for _ in range(count)]
+
+    def test_holes_retransmitted_together(self):
+        data = self.DEFAULT_DATA[:10]
+        self.send_segments(data, 2)
+        self.send_duplicate_acks([(2, 4), (6, 8)])
+        seq_numbers = self.receive_seq_numbers(2)
+
+        self.assertEqual([self.DEFAULT_ISS, self.DEFAULT_ISS + 4],
+                         seq_numbers)
+        # Nothing beyond the highest block is taken as lost.
+        self.assertRaises(socket.timeout, self.receive, self.TIMEOUT)
+
+    def test_new_holes_retransmitted_during_recovery(self):
+        data = self.DEFAULT_DATA[:10]
+        self.send_segments(data, 2)
+        self.send_duplicate_acks([(2, 4)])
+        first_seq_numbers = self.receive_seq_numbers(1)
+        self.send(self.build_ack(self.DEFAULT_ISS, [(2, 4), (6, 8)]))
+        packet = self.receive(self.TIMEOUT)
+
+        self.assertEqual([self.DEFAULT_ISS], first_seq_numbers)
+        self.assertEqual(self.DEFAULT_ISS + 4, packet.get_seq_number())
+        self.assertEqual(data[4:6], packet.get_payload())
+
+        # A partial ACK pointing at a hole already retransmitted.
+        self.send(self.build_ack(self.DEFAULT_ISS + 4, [(6, 8)]))
+
+        self.assertRaises(socket.timeout, self.receive, self.TIMEOUT)
+        self.assertTrue(self.socket.protocol.fast_recovery.is_in_recovery())
+
+    def test_retransmitted_holes_not_used_for_estimating_rto(self):
+        rto_estimator = self.socket.protocol.rto_estimator
+        packets = self.send_segments(self.DEFAULT_DATA[:10], 2)
+        # As if the first segment had been sampled already, another one is
+        # tracked. Holes are then cut with a larger MSS, so that none of
+        # them starts where it does.
+        rto_estimator.track(packets[1])
+        self.socket.protocol.pmtu.set_maximum(4)
+        self.send_duplicate_acks([(6, 8)])
+        seq_numbers = self.receive_seq_numbers(2)
+
+        self.assertEqual([self.DEFAULT_ISS, self.DEFAULT_ISS + 4],
+                         seq_numbers)
+        self.assertFalse(rto_estimator.is_tracking_packets())
+
+    def test_out_of_order_data_reported(self):
+        for offset in [2, 6]:
+            packet = self.packet_builder.build(flags=[ACKFlag],
+                                               seq=self.DEFAULT_IRS + offset,
+                                               ack=self.DEFAULT_ISS,
+                                               payload='da',
+                                               window=self.DEFAULT_IW)
+            self.send(packet)
+            ack_packet = self.receive(self.TIMEOUT)
+
+        self.assertEqual(self.DEFAULT_IRS, ack_packet.get_ack_number())
+        self.assertEqual([(self.DEFAULT_IRS + 2, self.DEFAULT_IRS + 4),
+                          (self.DEFAULT_IRS + 6, self.DEFAULT_IRS + 8)],
+                         ack_packet.get_sack_blocks())
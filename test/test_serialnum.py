@@ -0,0 +1,53 @@
+import unittest
+
+from ptc import serialnum
+from ptc.constants import MAX_SEQ
+from ptc.seqnum import SequenceNumber
+
+
+class SerialNumberTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.n = 10
+        self.m = MAX_SEQ - 10
+        
+    def test_addition_and_subtraction(self):
+        self.assertEqual(serialnum.add(self.n, 5), 15)
+        self.assertEqual(serialnum.add(self.m, 20), 9)
+        self.assertEqual(serialnum.sub(self.n, self.m), 21)
+        self.assertEqual(serialnum.sub(self.m, self.n), MAX_SEQ - 20)
+        self.assertEqual(serialnum.normalize(-1), MAX_SEQ)
+        
+    def test_comparison(self):
+        self.assertTrue(serialnum.lt(self.m, self.n))
+        self.assertTrue(serialnum.leq(self.m, self.n))
+        self.assertTrue(serialnum.leq(self.n, self.n))
+        self.assertFalse(serialnum.lt(self.n, self.n))
+        self.assertTrue(serialnum.gt(self.n, self.m))
+        self.assertTrue(serialnum.geq(self.n, self.m))
+        self.assertEqual(serialnum.maximum(self.m, self.n), self.n)
+        self.assertEqual(serialnum.minimum(self.m, self.n), self.m)
+        
+    def test_intervals(self):
+        self.assertTrue(serialnum.a_lt_b_lt_c(self.m, 0, self.n))
+        self.assertTrue(serialnum.a_lt_b_lt_c(self.m, MAX_SEQ, self.n))
+        self.assertFalse(serialnum.a_lt_b_lt_c(self.m, self.n, self.n))
+        self.assertFalse(serialnum.a_lt_b_lt_c(self.m, 20, self.n))
+        self.assertTrue(serialnum.a_leq_b_lt_c(self.m, self.m, self.n))
+        self.assertTrue(serialnum.a_lt_b_leq_c(self.m, self.n, self.n))
+        self.assertTrue(serialnum.a_leq_b_leq_c(self.n, self.n, self.n))
+        self.assertFalse(serialnum.a_leq_b_leq_c(self.n, self.m, 20))
+        
+    def test_unreduced_upper_end(self):
+        upper = self.m + 15
+        
+        self.assertTrue(serialnum.a_leq_b_leq_c(self.m, 3, upper))
+        self.assertFalse(serialnum.a_leq_b_leq_c(self.m, 5, upper))
+        
+    def test_sequence_number_operands(self):
+        n = SequenceNumber(self.n)
+        m = SequenceNumber(self.m)
+        
+        self.assertEqual(serialnum.sub(n, m), 21)
+        self.assertTrue(serialnum.lt(m, n))
+        self.assertTrue(serialnum.a_lt_b_leq_c(m, 0, n))
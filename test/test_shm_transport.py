@@ -0,0 +1,134 @@
+import ctypes
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from base import TransportTestCase
+
+import ptc
+from ptc.constants import SHM_DIRECTORY, SHM_RING_SIZE
+from ptc.ring import SharedMemoryRing
+from ptc.soquete import SharedMemorySoquete
+
+
+class SharedMemoryRingTest(unittest.TestCase):
+    
+    CAPACITY = 64
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, 'ring')
+        self.producer = SharedMemoryRing.open(path, self.CAPACITY)
+        self.consumer = SharedMemoryRing.open(path, self.CAPACITY)
+        self.buffer = bytearray(self.CAPACITY)
+        array = (ctypes.c_char * self.CAPACITY).from_buffer(self.buffer)
+        self.address = ctypes.addressof(array)
+        
+    def tearDown(self):
+        self.producer.close()
+        self.consumer.close()
+        shutil.rmtree(self.directory)
+        
+    def get(self):
+        size = self.consumer.get_into(self.address)
+        if size is None:
+            return None
+        return str(self.buffer[:size])
+    
+    def test_datagrams_read_in_order(self):
+        self.assertTrue(self.producer.put('first'))
+        self.assertTrue(self.producer.put(bytearray('second')))
+        
+        self.assertEqual('first', self.get())
+        self.assertEqual('second', self.get())
+        self.assertIsNone(self.get())
+        self.assertTrue(self.consumer.empty())
+        
+    def test_datagrams_wrap_around(self):
+        # Records take 4 bytes plus the data, padded to 4.
+        data = ['a' * 20, 'b' * 20, 'c' * 20]
+        self.assertTrue(self.producer.put(data[0]))
+        self.assertTrue(self.producer.put(data[1]))
+        self.assertEqual(data[0], self.get())
+        # Only 16 bytes left at the end: this one goes at the start.
+        self.assertTrue(self.producer.put(data[2]))
+        
+        self.assertEqual(data[1], self.get())
+        self.assertEqual(data[2], self.get())
+        self.assertIsNone(self.get())
+        
+    def test_datagrams_dropped_when_full(self):
+        self.assertTrue(self.producer.put('a' * 28))
+        self.assertTrue(self.producer.put('b' * 28))
+        
+        self.assertFalse(self.producer.put('c'))
+        self.assertEqual('a' * 28, self.get())
+        self.assertTrue(self.producer.put('c'))
+        
+        
+def run_echo_server(port, ready, timeout):
+    with ptc.Socket(transport=ptc.SHM_TRANSPORT) as server:
+        server.bind((SharedMemoryTransportTest.ADDRESS, port))
+        server.listen()
+        ready.set()
+        server.accept(timeout=timeout)
+        data = server.recv(SharedMemoryTransportTest.SIZE)
+        while len(data) < SharedMemoryTransportTest.SIZE:
+            data += server.recv(SharedMemoryTransportTest.SIZE)
+        server.send(data[::-1])
+    SharedMemoryTransportTest.close_transports(timeout)
+        
+        
+class SharedMemoryTransportTest(TransportTestCase):
+    
+    TRANSPORT = ptc.SHM_TRANSPORT
+    SIZE = 10000
+    
+    def setUp(self):
+        if not os.path.isdir(SHM_DIRECTORY):
+            self.skipTest('%s not available' % SHM_DIRECTORY)
+        TransportTestCase.setUp(self)
+        
+    def test_data_exchange_between_processes(self):
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=run_echo_server,
+                                         args=(self.SERVER_PORT, ready,
+                                               self.TIMEOUT))
+        server.start()
+        ready.wait(self.TIMEOUT)
+        data = ''.join(chr(i % 256) for i in range(self.SIZE))
+        with ptc.Socket(transport=ptc.SHM_TRANSPORT) as client:
+            client.connect((self.ADDRESS, self.SERVER_PORT),
+                           timeout=self.TIMEOUT)
+            client.send(data)
+            received = str()
+            while len(received) < self.SIZE:
+                received += client.recv(self.SIZE)
+        server.join(self.TIMEOUT)
+        
+        self.assertEqual(data[::-1], received)
+        self.assertEqual(0, server.exitcode)
+        self.assertFalse(os.path.exists(
+            os.path.join(SHM_DIRECTORY, 'ptc-%d' % server.pid)))
+        
+    def test_rings_of_exited_senders_unmapped(self):
+        sender = multiprocessing.Process(target=os.getpid)
+        sender.start()
+        sender.join(self.TIMEOUT)
+        transport = SharedMemorySoquete()
+        try:
+            ring_path = os.path.join(transport.directory, str(sender.pid))
+            ring = SharedMemoryRing.open(ring_path, SHM_RING_SIZE)
+            ring.put('data')
+            transport.inboxes[sender.pid] = ring
+            
+            self.assertEqual(1, len(transport.receive_batch(timeout=0)))
+            self.assertRaises(socket.timeout, transport.receive_batch,
+                              timeout=0)
+            self.assertEqual(dict(), transport.inboxes)
+            self.assertFalse(os.path.exists(ring_path))
+        finally:
+            transport.close()
@@ -1,5 +1,7 @@
 import ptc
-from ptc.packet import SYNFlag, ACKFlag
+from ptc.exceptions import PTCError
+from ptc.options import encode_mss, encode_sack_permitted
+from ptc.packet import SYNFlag, ACKFlag, ECEFlag, CWRFlag
 from base import PTCTestCase
 
 
@@ -40,6 +42,25 @@ class SYNTest(PTCTestCase):
         self.assertEquals(seq_number+1, rcv_nxt)
         self.assertEquals(ptc.constants.ESTABLISHED, server.protocol.state)
     
+    def test_data_with_handshake_ack_accepted(self):
+        server = self.launch_server()
+        seq_number = 1111
+        syn_packet = self.packet_builder.build(flags=[SYNFlag], seq=seq_number)
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        # The plain ACK completing the handshake is missing: data comes first.
+        data_packet = self.packet_builder.build(
+            flags=[ACKFlag], seq=seq_number+1,
+            ack=syn_ack_packet.get_seq_number()+1, payload='data')
+        self.send(data_packet)
+        ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertEquals(ptc.constants.ESTABLISHED, server.protocol.state)
+        self.assertEquals(seq_number+1+len('data'),
+                          ack_packet.get_ack_number())
+        self.assertEquals('data', server.recv(10))
+    
     def test_client_connection(self):
         # 1. Create a client instance
         client = self.launch_client()
@@ -72,3 +93,113 @@ class SYNTest(PTCTestCase):
         self.assertEquals(snd_nxt, snd_una)
         self.assertEquals(seq_number+1, rcv_nxt)
         self.assertEquals(ptc.constants.ESTABLISHED, client.protocol.state)
+        
+    def test_mss_negotiated_by_server(self):
+        server = self.launch_server()
+        syn_packet = self.packet_builder.build(flags=[SYNFlag], seq=1111,
+                                               options=encode_mss(100))
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertEquals(ptc.constants.MAX_MSS, syn_ack_packet.get_mss())
+        self.assertEquals(100, server.protocol.pmtu.get_mss())
+        
+    def test_mss_negotiated_by_client(self):
+        client = self.launch_client()
+        syn_packet = self.receive(self.DEFAULT_TIMEOUT)
+        syn_seq_number = syn_packet.get_seq_number()
+        syn_ack_packet = self.packet_builder.build(flags=[SYNFlag, ACKFlag],
+                                                   seq=1111,
+                                                   ack=syn_seq_number+1,
+                                                   options=encode_mss(100))
+        self.send(syn_ack_packet)
+        
+        self.assertEquals(ptc.constants.MAX_MSS, syn_packet.get_mss())
+        self.assertEquals(100, client.protocol.pmtu.get_mss())
+        
+    def test_missing_mss_option_allows_any_size(self):
+        server = self.launch_server()
+        server.protocol.pmtu.set_maximum(100)
+        syn_packet = self.packet_builder.build(flags=[SYNFlag], seq=1111)
+        self.send(syn_packet)
+        self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertEquals(ptc.constants.MAX_MSS,
+                          server.protocol.pmtu.get_mss())
+        
+    def test_receive_buffer_size_announced_as_window(self):
+        server = self.launch_server()
+        server.set_receive_buffer_size(4096)
+        syn_packet = self.packet_builder.build(flags=[SYNFlag], seq=1111)
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertEquals(4096, syn_ack_packet.get_window_size())
+        self.assertRaises(PTCError,
+                          server.set_receive_buffer_size, 8192)
+        
+    def test_sack_negotiated_by_server(self):
+        server = self.launch_server()
+        syn_packet = self.packet_builder.build(
+            flags=[SYNFlag], seq=1111,
+            options=encode_mss(100) + encode_sack_permitted())
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertTrue(syn_ack_packet.get_sack_permitted())
+        self.assertTrue(server.protocol.sack_enabled)
+        
+    def test_sack_not_used_unless_offered(self):
+        server = self.launch_server()
+        syn_packet = self.packet_builder.build(flags=[SYNFlag], seq=1111,
+                                               options=encode_mss(100))
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertFalse(syn_ack_packet.get_sack_permitted())
+        self.assertFalse(server.protocol.sack_enabled)
+        
+    def test_sack_negotiated_by_client(self):
+        client = self.launch_client()
+        syn_packet = self.receive(self.DEFAULT_TIMEOUT)
+        syn_seq_number = syn_packet.get_seq_number()
+        syn_ack_packet = self.packet_builder.build(
+            flags=[SYNFlag, ACKFlag], seq=1111, ack=syn_seq_number+1,
+            options=encode_mss(100) + encode_sack_permitted())
+        self.send(syn_ack_packet)
+        
+        self.assertTrue(syn_packet.get_sack_permitted())
+        self.assertTrue(client.protocol.sack_enabled)
+        
+    def test_ecn_negotiated_by_server(self):
+        server = self.launch_server()
+        syn_packet = self.packet_builder.build(
+            flags=[SYNFlag, ECEFlag, CWRFlag], seq=1111)
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertIn(ECEFlag, syn_ack_packet)
+        self.assertNotIn(CWRFlag, syn_ack_packet)
+        self.assertTrue(server.protocol.ecn.is_enabled())
+        
+    def test_ecn_not_used_unless_offered(self):
+        server = self.launch_server()
+        syn_packet = self.packet_builder.build(flags=[SYNFlag], seq=1111)
+        self.send(syn_packet)
+        syn_ack_packet = self.receive(self.DEFAULT_TIMEOUT)
+        
+        self.assertNotIn(ECEFlag, syn_ack_packet)
+        self.assertFalse(server.protocol.ecn.is_enabled())
+        
+    def test_ecn_negotiated_by_client(self):
+        client = self.launch_client()
+        syn_packet = self.receive(self.DEFAULT_TIMEOUT)
+        syn_seq_number = syn_packet.get_seq_number()
+        syn_ack_packet = self.packet_builder.build(
+            flags=[SYNFlag, ACKFlag, ECEFlag], seq=1111,
+            ack=syn_seq_number+1)
+        self.send(syn_ack_packet)
+        
+        self.assertIn(ECEFlag, syn_packet)
+        self.assertIn(CWRFlag, syn_packet)
+        self.assertTrue(client.protocol.ecn.is_enabled())
@@ -0,0 +1,31 @@
+from base import TransportTestCase
+
+import ptc
+from ptc.demux import PacketDemultiplexer
+from ptc.packet import SYNFlag
+
+
+class UDPTransportTest(TransportTestCase):
+    
+    # These use actual UDP sockets over the loopback interface.
+    
+    TRANSPORT = ptc.UDP_TRANSPORT
+        
+    def test_listening_and_connecting_sockets_use_different_ports(self):
+        listening = PacketDemultiplexer.get_instance(ptc.UDP_TRANSPORT, True)
+        connecting = PacketDemultiplexer.get_instance(ptc.UDP_TRANSPORT,
+                                                      False)
+        
+        self.assertIsNot(listening, connecting)
+        self.assertIs(connecting,
+                      PacketDemultiplexer.get_instance(ptc.UDP_TRANSPORT,
+                                                       False))
+        
+    def test_ecn_not_offered(self):
+        server = ptc.Socket(transport=ptc.UDP_TRANSPORT)
+        server.bind((self.ADDRESS, self.SERVER_PORT))
+        server.listen()
+        protocol = server.protocol
+        protocol.demultiplexer.unregister(protocol)
+        
+        self.assertEqual([SYNFlag], protocol.ecn.get_syn_flags([SYNFlag]))